@@ -0,0 +1,95 @@
+from collections import OrderedDict
+
+import numpy as np
+
+
+class ActionCache(object):
+    '''
+    LRU cache of model outputs keyed by the quantised feature vector.
+
+    Each feature is bucketed in steps of resolution standard deviations,
+    using the scaler's statistics, so nearly identical ticks (long
+    straights, standing starts) share one prediction. get() returns None
+    on a miss. Every validate_every-th hit also returns None, so the model
+    runs anyway; put() then compares the fresh action with the cached one,
+    tracks the error and replaces the entry. A validation whose error
+    exceeds max_error is a violation: every entry is dropped, since they
+    were all bucketed at the same resolution, and after max_violations of
+    them the cache turns itself off and the model runs on every tick.
+    '''
+
+    def __init__(self, resolution=0.05, capacity=4096, validate_every=50, max_error=0.05, max_violations=3,
+                 mean=None, scale=None):
+        '''Constructor, mean and scale are the feature scaler's mean_ and scale_'''
+        self.resolution = resolution
+        self.capacity = capacity
+        self.validate_every = validate_every
+        self.max_error = max_error
+        self.max_violations = max_violations
+        self.enabled = True
+        self.offset = np.asarray(mean, dtype=float) if mean is not None else 0.0
+        self.step = resolution * (np.asarray(scale, dtype=float) if scale is not None else 1.0)
+        self.entries = OrderedDict()
+        self.pending = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.validations = 0
+        self.violations = 0
+        self.error_sum = 0.0
+        self.error_max = 0.0
+
+    def key(self, features):
+        return np.floor((features - self.offset) / self.step).astype(np.int32).tobytes()
+
+    def get(self, features):
+        '''Cached action for raw features, or None when the model must run'''
+        if not self.enabled:
+            return None
+        key = self.key(features)
+        action = self.entries.get(key)
+        if action is None:
+            self.misses += 1
+            self.pending = (key, None)
+            return None
+        self.entries.move_to_end(key)
+        if (self.hits + self.validations + 1) % self.validate_every == 0:
+            self.validations += 1
+            self.pending = (key, action)
+            return None
+        self.hits += 1
+        return action
+
+    def put(self, action):
+        '''Store the model's action for the features of the last get()'''
+        if self.pending is None:
+            return
+        key, cached = self.pending
+        self.pending = None
+        if cached is not None:
+            error = float(np.max(np.abs(cached - action)))
+            self.error_sum += error
+            self.error_max = max(self.error_max, error)
+            if error > self.max_error:
+                self.violations += 1
+                self.entries.clear()
+                if self.violations >= self.max_violations:
+                    self.enabled = False
+                    return
+        self.entries[key] = action
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses + self.validations
+        return self.hits / lookups if lookups else 0.0
+
+    def summary(self):
+        mean_error = self.error_sum / self.validations if self.validations else 0.0
+        return (f"hit rate {100 * self.hit_rate():.1f}% ({self.hits} hits, {self.misses} misses, "
+                f"{self.evictions} evictions), {self.validations} validations: mean error {mean_error:.4f}, "
+                f"max {self.error_max:.4f}, {self.violations} over {self.max_error}"
+                f"{'' if self.enabled else ', disabled'}")
@@ -0,0 +1,66 @@
+import numpy as np
+
+# Columns whose sign flips when the track is mirrored left to right
+MIRROR_FEATURES = ['trackPos', 'angle', 'speedY', 'freeAngle', 'oppNearestAngle']
+MIRROR_TARGETS = ['steer']
+# Column pairs that trade places
+MIRROR_PAIRS = [('oppLeftGap', 'oppRightGap')]
+# Integer columns that noise would turn into nonsense
+EXACT_FEATURES = ['gear']
+
+
+class Augmenter(object):
+    '''
+    Mirror, sensor-noise and dropout augmentation of raw telemetry batches.
+
+    Called on each minibatch as it is trained on, so the augmented rows
+    only ever exist one batch at a time. Every row is mirrored with
+    probability mirror: the range finders are reversed (the default angles
+    are symmetric), the opponent gaps swap sides and trackPos, angle,
+    speedY, freeAngle, oppNearestAngle and steer change sign, so a
+    left-hand corner becomes a right-hand one. Gaussian noise
+    of noise standard deviations is then added to every sensor but the
+    gear, and each range finder reading is replaced by its mean with
+    probability dropout. Pass the scaler's mean_ and scale_ so noise and dropout are
+    sized per column; rows come back unscaled.
+    '''
+
+    def __init__(self, features, targets, mirror=0.5, noise=0.02, dropout=0.05, mean=None, scale=None, seed=0):
+        '''Constructor, features and targets are the column names of the batches'''
+        n = len(features)
+        self.mirror = mirror
+        self.noise = noise
+        self.dropout = dropout
+        self.rng = np.random.default_rng(seed)
+
+        self.track = np.array([features.index(f'track_{i}') for i in range(19) if f'track_{i}' in features], dtype=int)
+        self.perm = np.arange(n)
+        self.perm[self.track] = self.track[::-1]
+        for left, right in MIRROR_PAIRS:
+            if left in features and right in features:
+                i, j = features.index(left), features.index(right)
+                self.perm[i], self.perm[j] = j, i
+        self.sign = np.array([-1.0 if f in MIRROR_FEATURES else 1.0 for f in features])
+        self.target_sign = np.array([-1.0 if t in MIRROR_TARGETS else 1.0 for t in targets])
+
+        self.noisy = np.array([i for i, f in enumerate(features) if f not in EXACT_FEATURES], dtype=int)
+        scale = np.ones(n) if scale is None else np.asarray(scale, dtype=float)
+        self.sigma = noise * scale[self.noisy]
+        self.fill = np.zeros(len(self.track)) if mean is None else np.asarray(mean, dtype=float)[self.track]
+
+    def __call__(self, X, y):
+        '''Augmented copies of one batch of raw features X and targets y'''
+        X = np.array(X, dtype=float)
+        y = np.array(y, dtype=float)
+        n = len(X)
+        if self.mirror:
+            rows = self.rng.random(n) < self.mirror
+            X[rows] = X[rows][:, self.perm] * self.sign
+            y[rows] *= self.target_sign
+        if self.noise:
+            X[:, self.noisy] += self.rng.standard_normal((n, len(self.noisy))) * self.sigma
+        if self.dropout and len(self.track):
+            track = X[:, self.track]
+            dropped = self.rng.random(track.shape) < self.dropout
+            X[:, self.track] = np.where(dropped, self.fill, track)
+        return X, y
@@ -0,0 +1,294 @@
+'''
+Per-tick and data-loading benchmarks with stored baselines.
+
+Every benchmark runs over the same corpus of sensor messages, recorded
+once from the kinematic simulator under a fixed scripted policy (not any
+of the drivers, so changing a driver does not change its input) and kept
+in benchmark_corpus.txt. Each is timed repeat times, from freshly built
+objects so drivers that learn the track start every run alike, with the
+garbage collector off as timeit does; the best mean time per call is kept.
+
+    python benchmarks.py --save     # record a baseline on this machine
+    python benchmarks.py            # compare against it
+
+A benchmark more than threshold percent slower than its baseline is
+flagged and the exit status is 1. Baselines are only comparable on the
+machine that recorded them.
+'''
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import carControl
+import carState
+import kinematic_sim
+import msgParser
+import telemetry_archive
+import telemetry_sinks
+import training
+from driver import Driver
+from nn_driver import NNDriver
+
+CORPUS_PATH = 'benchmark_corpus.txt'
+BASELINE_PATH = 'benchmark_baseline.json'
+DEFAULT_THRESHOLD_PCT = 10.0
+
+
+def record_corpus(path, ticks=2000, track='circuit'):
+    '''Drive the simulator with a scripted policy and write one sensor message per line'''
+    sim = kinematic_sim.KinematicSim(track, 1, car_name='car1-trb1')
+    messages = []
+    for _ in range(ticks):
+        messages.append(sim.messages()[0])
+        sensors = sim.sensors()
+        speed = sensors['speedX'][0]
+        steer = (sensors['angle'][0] - 0.5 * sensors['trackPos'][0]) / sim.steer_lock
+        gear = int(np.clip(1 + speed // 45, 1, 6))
+        # Look straight ahead with the focus range finders
+        sim.focus[:] = 0.0
+        sim.step(np.array([1.0 if speed < 110 else 0.2]), np.array([0.0]), np.array([steer]), np.array([gear]))
+    with open(path, 'w') as file:
+        file.write('\n'.join(messages) + '\n')
+    return messages
+
+
+def load_corpus(path, ticks=2000):
+    if not os.path.exists(path):
+        print(f"Recording a {ticks}-tick corpus in {path}")
+        return record_corpus(path, ticks)
+    with open(path) as file:
+        return file.read().splitlines()
+
+
+def measure(setup, repeat=5):
+    '''Best mean seconds per call out of repeat runs, each on a fresh setup()'''
+    best = float('inf')
+    for _ in range(repeat):
+        fn, items, close = setup()
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            for item in items:
+                fn(item)
+            best = min(best, (time.perf_counter() - start) / len(items))
+        finally:
+            if enabled:
+                gc.enable()
+            if close is not None:
+                close()
+    return best
+
+
+def _replies(messages):
+    '''Plausible control values per tick for the CarControl and stringify benchmarks'''
+    rng = np.random.default_rng(0)
+    return [(float(a), float(b), int(g), float(s)) for a, b, g, s in
+            zip(rng.random(len(messages)), rng.random(len(messages)), rng.integers(1, 7, len(messages)),
+                rng.uniform(-1, 1, len(messages)))]
+
+
+def suite(messages, model_path, scaler_path, workdir):
+    '''
+    (name, setup) for every benchmark. setup() returns (fn, items, close),
+    close being None or what shuts down the objects fn uses.
+    '''
+    raw = [m.encode() for m in messages]
+    replies = _replies(messages)
+
+    def parser():
+        p = msgParser.MsgParser()
+        return p.parse, messages, None
+
+    def parser_bytes():
+        p = msgParser.MsgParser()
+        return p.parse, raw, None
+
+    def stringify():
+        p = msgParser.MsgParser()
+        actions = [{'accel': [a], 'brake': [b], 'gear': [g], 'steer': [s], 'clutch': [0.0], 'focus': [0], 'meta': [0]}
+                   for a, b, g, s in replies]
+        return p.stringify, actions, None
+
+    def set_from_msg():
+        return carState.CarState().setFromMsg, messages, None
+
+    def to_msg():
+        control = carControl.CarControl()
+
+        def fn(reply):
+            a, b, g, s = reply
+            control.setAccel(a)
+            control.setBrake(b)
+            control.setGear(g)
+            control.setSteer(s)
+            return control.toMsg()
+        return fn, replies, None
+
+    def drive(sinks=None):
+        d = Driver(3, sinks=sinks)
+        return d.drive, messages, d.onShutDown
+
+    def drive_csv():
+        return drive([telemetry_sinks.CsvSink(os.path.join(workdir, 'drive.csv'))])
+
+    def drive_ring():
+        return drive([telemetry_sinks.RingSink(f'torcs_benchmark_{os.getpid()}')])
+
+    def nn_driver(deadline):
+        d = NNDriver(3, model_path, scaler_path, deadline=deadline)
+
+        def close():
+            # Without the inference summary NNDriver.onShutDown prints every run
+            d.inference.close()
+            Driver.onShutDown(d)
+        return d, close
+
+    def prepare_state():
+        d, close = nn_driver(None)
+        states = [d.parse_sensors(m) for m in messages]
+        return d._prepare_state, states, close
+
+    def nn_drive(deadline=None):
+        d, close = nn_driver(deadline)
+        return d.drive, messages, close
+
+    def nn_drive_deadline():
+        return nn_drive(0.010)
+
+    table = {}
+
+    def training_table():
+        '''A training file built from the corpus, as a CSV and as an archive, and its columns'''
+        if not table:
+            path = os.path.join(workdir, 'training.csv')
+            d = Driver(3, sinks=[telemetry_sinks.CsvSink(path)])
+            for m in messages:
+                d.drive(m)
+            d.onShutDown()
+            telemetry_archive.pack(path)
+            features, target = training.select_columns(telemetry_sinks.SENSOR_COLUMNS)
+            table.update(path=path, usecols=list(dict.fromkeys(features + target)))
+        return table['path'], table['usecols']
+
+    def load_csv():
+        path, usecols = training_table()
+        return lambda p: telemetry_archive.read_table(p, usecols), [path], None
+
+    def load_archive():
+        path, usecols = training_table()
+        return lambda p: telemetry_archive.read_table(p, usecols), [os.path.splitext(path)[0] + telemetry_archive.SUFFIX], None
+
+    benchmarks = [
+        ('msgParser.parse', parser),
+        ('msgParser.parse_bytes', parser_bytes),
+        ('msgParser.stringify', stringify),
+        ('CarState.setFromMsg', set_from_msg),
+        ('CarControl.toMsg', to_msg),
+        ('Driver.drive', drive),
+        ('Driver.drive+csv', drive_csv),
+        ('Driver.drive+ring', drive_ring),
+    ]
+    if os.path.exists(model_path) and os.path.exists(scaler_path):
+        benchmarks += [
+            ('NNDriver._prepare_state', prepare_state),
+            ('NNDriver.drive', nn_drive),
+            ('NNDriver.drive+deadline', nn_drive_deadline),
+        ]
+    else:
+        print(f"No model at {model_path}, skipping the NNDriver benchmarks")
+    benchmarks += [
+        ('training.load_csv', load_csv),
+        ('training.load_archive', load_archive),
+    ]
+    return benchmarks
+
+
+def compare(baseline, results, threshold_pct):
+    '''Rows of (name, baseline, current, change %, status) and whether any regressed'''
+    rows, regressed = [], False
+    for name, seconds in results.items():
+        base = baseline.get(name)
+        if base is None:
+            rows.append((name, None, seconds, None, 'new'))
+            continue
+        change = 100.0 * (seconds - base) / base
+        if change > threshold_pct:
+            status, regressed = 'SLOWER', True
+        elif change < -threshold_pct:
+            status = 'faster'
+        else:
+            status = 'ok'
+        rows.append((name, base, seconds, change, status))
+    return rows, regressed
+
+
+def _us(seconds):
+    return '-' if seconds is None else (f'{seconds * 1e6:.2f} us' if seconds < 1e-3 else f'{seconds * 1e3:.2f} ms')
+
+
+def machine():
+    return {'platform': platform.platform(), 'processor': platform.processor() or platform.machine(),
+            'python': platform.python_version()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the per-tick path and flag regressions against a baseline.')
+    parser.add_argument('--corpus', default=CORPUS_PATH, help='Sensor message corpus, recorded if missing')
+    parser.add_argument('--ticks', type=int, default=2000, help='Corpus length when recording one')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='Baseline JSON')
+    parser.add_argument('--save', action='store_true', help='Store this run as the baseline')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD_PCT,
+                        help='Percent slowdown flagged as a regression')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per benchmark; the best is kept')
+    parser.add_argument('--only', nargs='+', default=None, help='Run benchmarks whose name contains any of these')
+    parser.add_argument('--model', default='models/nn_model.pkl', help='Model for the NNDriver benchmarks')
+    parser.add_argument('--scaler', default='models/nn_scaler.pkl', help='Scaler for the NNDriver benchmarks')
+    arguments = parser.parse_args()
+
+    messages = load_corpus(arguments.corpus, arguments.ticks)
+    baseline = {}
+    if os.path.exists(arguments.baseline):
+        with open(arguments.baseline) as file:
+            stored = json.load(file)
+        baseline = stored['results']
+        if stored.get('machine') != machine():
+            print("Warning: the baseline was recorded on a different machine or Python")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, setup in suite(messages, arguments.model, arguments.scaler, workdir):
+            if arguments.only and not any(part in name for part in arguments.only):
+                continue
+            # One untimed run warms caches and lazy imports
+            measure(setup, repeat=1)
+            results[name] = measure(setup, arguments.repeat)
+            print(f"{name:<26} {_us(results[name]):>12}", flush=True)
+
+    rows, regressed = compare(baseline, results, arguments.threshold)
+    if baseline:
+        print(f"\n{'benchmark':<26} {'baseline':>12} {'current':>12} {'change':>8}  status")
+        for name, base, seconds, change, status in rows:
+            change = '-' if change is None else f'{change:+.1f}%'
+            print(f"{name:<26} {_us(base):>12} {_us(seconds):>12} {change:>8}  {status}")
+
+    if arguments.save:
+        saved = dict(baseline, **results)
+        with open(arguments.baseline, 'w') as file:
+            json.dump({'machine': machine(), 'corpus': arguments.corpus, 'results': saved}, file, indent=2)
+        print(f"Baseline saved to {arguments.baseline}")
+        return 0
+    if not baseline:
+        print(f"No baseline at {arguments.baseline}; run with --save to record one")
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -63,6 +63,12 @@ class CarControl(object):
     def getClutch(self):
         return self.clutch
     
+    def setFocus(self, focus):
+        self.focus = focus
+    
+    def getFocus(self):
+        return self.focus
+    
     def setMeta(self, meta):
         self.meta = meta
     
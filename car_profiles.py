@@ -0,0 +1,69 @@
+'''
+Per-car parameters used by the gearbox and other car-specific controllers.
+
+Speeds per gear are given as km/h per 1000 rpm at the wheels, which folds
+the gear ratio, final drive and tyre radius into one number. The values for
+the stock TORCS cars are approximations measured from telemetry logs.
+'''
+
+PROFILES = {
+    'default': {
+        'gears': 6,
+        'kmh_per_krpm': [5.0, 8.0, 11.0, 14.0, 17.0, 20.0],
+        'rpm_idle': 1000,
+        'rpm_redline': 9000,
+        'rpm_optimal': (6000, 8500),
+        'rpm_shift_up': 8500,
+        'rpm_shift_down': 4500,
+        'wheel_radius': (0.33, 0.33, 0.33, 0.33),
+        'drive': 'rwd',
+        'tc_slip_limit': 0.15,
+        'tc_gain': 4.0,
+        'abs_slip_limit': 0.15,
+        'abs_gain': 4.0,
+    },
+    'car1-trb1': {
+        'gears': 6,
+        'kmh_per_krpm': [5.2, 8.1, 11.0, 13.8, 16.4, 19.1],
+        'rpm_idle': 1000,
+        'rpm_redline': 9500,
+        'rpm_optimal': (6500, 9000),
+        'rpm_shift_up': 9000,
+        'rpm_shift_down': 5000,
+        'wheel_radius': (0.3179, 0.3179, 0.3276, 0.3276),
+        'drive': 'rwd',
+    },
+    'car1-stock1': {
+        'gears': 6,
+        'kmh_per_krpm': [4.4, 7.0, 9.6, 12.1, 14.7, 17.3],
+        'rpm_idle': 1000,
+        'rpm_redline': 8000,
+        'rpm_optimal': (5500, 7500),
+        'rpm_shift_up': 7500,
+        'rpm_shift_down': 4000,
+        'wheel_radius': (0.3302, 0.3302, 0.3302, 0.3302),
+        'drive': 'rwd',
+    },
+    'p406': {
+        'gears': 5,
+        'kmh_per_krpm': [6.5, 11.4, 16.6, 21.7, 27.0],
+        'rpm_idle': 800,
+        'rpm_redline': 7000,
+        'rpm_optimal': (4500, 6500),
+        'rpm_shift_up': 6500,
+        'rpm_shift_down': 3000,
+        'wheel_radius': (0.3048, 0.3048, 0.3048, 0.3048),
+        'drive': 'fwd',
+        'tc_slip_limit': 0.1,
+        'abs_slip_limit': 0.2,
+    },
+}
+
+
+def get_profile(car_name):
+    '''Return the profile for car_name, falling back to the default one'''
+    profile = dict(PROFILES['default'])
+    if car_name in PROFILES:
+        profile.update(PROFILES[car_name])
+    profile['name'] = car_name if car_name in PROFILES else 'default'
+    return profile
@@ -0,0 +1,147 @@
+'''
+Coreset selection for driving telemetry.
+
+Logs are dominated by near-identical ticks: waiting on the grid, long
+straights at constant speed, repeated laps of the same line. select()
+reduces a training set in three steps:
+
+1. Rows are snapped to a grid of resolution standard deviations per
+   column (features and targets) and hashed; each occupied cell keeps one
+   representative row and remembers how many rows it stood for.
+2. Cells are stratified by track curvature (from the range finders) and
+   control regime (brake/throttle/lift crossed with steering direction).
+3. Each stratum gets a share of the budget in proportion to the square
+   root of its size, so rare strata such as hard braking into a corner
+   keep most of their rows while the long straights are thinned.
+
+The weight of a kept row is the number of original rows it represents,
+so a weighted fit still follows the original data distribution. Weights
+are normalised to a mean of 1 and capped at max_weight, so that one long
+wait on the grid cannot dominate a minibatch.
+'''
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import mean_squared_error, r2_score
+
+import track_geometry
+
+# Curvature in 1/m, positive curves right
+CURVATURE_EDGES = [-0.02, -0.005, 0.005, 0.02]
+STEER_EDGES = [-0.3, -0.05, 0.05, 0.3]
+
+
+def cell_ids(values, resolution=0.05, scale=None):
+    '''Cell id per row; rows within resolution*scale of each other in every column share one'''
+    values = np.asarray(values, dtype=float)
+    if scale is None:
+        scale = values.std(axis=0)
+    step = resolution * np.where(scale > 0, scale, 1.0)
+    cells = np.floor(values / step).astype(np.int64)
+    hashes = pd.util.hash_pandas_object(pd.DataFrame(cells), index=False).to_numpy()
+    return pd.factorize(hashes)[0]
+
+
+def curvature_bins(X, angles=None):
+    '''Curvature band per row, with an extra band for rows taken off track'''
+    columns = [f'track_{i}' for i in range(19)]
+    if not all(c in X.columns for c in columns):
+        return np.zeros(len(X), dtype=int)
+    track = X[columns].to_numpy(dtype=float)
+    geometry = track_geometry.RangefinderGeometry(angles or track_geometry.default_angles())
+    bins = np.digitize(geometry.features(track)[:, 0], CURVATURE_EDGES)
+    bins[track[:, 0] < 0] = len(CURVATURE_EDGES) + 1
+    return bins
+
+
+def regime_bins(y):
+    '''Control regime per row: brake, throttle or lift, times steering direction'''
+    pedal = np.where(y['brake'].to_numpy() > 0.1, 2, (y['accel'].to_numpy() > 0.5).astype(int))
+    steer = np.digitize(y['steer'].to_numpy(), STEER_EDGES)
+    return pedal * (len(STEER_EDGES) + 1) + steer
+
+
+def strata(X, y, angles=None):
+    '''Stratum id per row from curvature band and control regime'''
+    return curvature_bins(X, angles) * 100 + regime_bins(y)
+
+
+def select(X, y, resolution=0.05, fraction=1.0, min_per_stratum=20, max_weight=20.0, seed=0, angles=None):
+    '''
+    Pick a weighted coreset of the rows of X (features) and y (targets).
+
+    X and y are DataFrames with the usual telemetry column names.
+    fraction is the share of distinct cells to keep; 1.0 only removes
+    near-duplicates. Returns positional row indices, in order, and one
+    sample weight per kept row.
+    '''
+    ids = cell_ids(np.hstack((X.to_numpy(dtype=float), y.to_numpy(dtype=float))), resolution)
+    _, first, counts = np.unique(ids, return_index=True, return_counts=True)
+    groups = strata(X, y, angles)[first]
+    labels, sizes = np.unique(groups, return_counts=True)
+
+    if fraction >= 1.0:
+        quotas = sizes
+    else:
+        share = np.sqrt(sizes)
+        quotas = np.round(fraction * len(first) * share / share.sum()).astype(int)
+        quotas = np.minimum(sizes, np.maximum(quotas, min_per_stratum))
+
+    rng = np.random.default_rng(seed)
+    keep, weights = [], []
+    for label, size, quota in zip(labels, sizes, quotas):
+        members = np.flatnonzero(groups == label)
+        chosen = members if quota >= size else rng.choice(members, quota, replace=False)
+        # Kept cells stand in for the dropped cells of their stratum too
+        keep.append(first[chosen])
+        weights.append(counts[chosen] * (counts[members].sum() / counts[chosen].sum()))
+
+    keep = np.concatenate(keep)
+    weights = np.concatenate(weights)
+    order = np.argsort(keep)
+    keep, weights = keep[order], weights[order].astype(float)
+    # Renormalising lifts capped rows over the cap again, so repeat until
+    # every capped row sits at the cap and the rest share the remaining mass
+    weights = weights / weights.mean()
+    while weights.max() > max_weight * (1.0 + 1e-9) and max_weight >= 1.0:
+        capped = weights >= max_weight
+        weights[capped] = max_weight
+        free = ~capped
+        weights[free] *= (len(weights) - max_weight * capped.sum()) / weights[free].sum()
+    return keep, weights
+
+
+def compare(make_model, full, core, X_test, y_test):
+    '''
+    Train one model on the full training set and one on the coreset.
+
+    full is (X, y) and core is (X, y, weights). Both models are timed and
+    scored on the same, unreduced test set. Prints the speed-up and the
+    per-target change in MSE and R2, and returns the numbers as a dict.
+    '''
+    targets = list(y_test.columns)
+    y_test = np.asarray(y_test)
+    results = {}
+    for name, (X, y, w) in (('full', full + (None,)), ('coreset', core)):
+        model = make_model()
+        start = time.perf_counter()
+        model.fit(X, y, sample_weight=w)
+        seconds = time.perf_counter() - start
+        pred = model.predict(X_test)
+        results[name] = {
+            'rows': len(X),
+            'seconds': seconds,
+            'targets': {t: {'MSE': mean_squared_error(y_test[:, i], pred[:, i]), 'R2': r2_score(y_test[:, i], pred[:, i])}
+                        for i, t in enumerate(targets)},
+        }
+
+    full, core = results['full'], results['coreset']
+    results['speedup'] = full['seconds'] / max(core['seconds'], 1e-9)
+    print(f"\nFull: {full['rows']} rows in {full['seconds']:.1f}s, coreset: {core['rows']} rows "
+          f"in {core['seconds']:.1f}s ({results['speedup']:.1f}x faster)")
+    print(f"{'target':>8} {'MSE full':>10} {'MSE core':>10} {'R2 full':>8} {'R2 core':>8} {'R2 delta':>9}")
+    for t in targets:
+        f, c = full['targets'][t], core['targets'][t]
+        print(f"{t:>8} {f['MSE']:10.4f} {c['MSE']:10.4f} {f['R2']:8.4f} {c['R2']:8.4f} {c['R2'] - f['R2']:+9.4f}")
+    return results
@@ -1,17 +1,27 @@
 import msgParser
 import carState
 import carControl
-import csv
-import os
-import pygame
-from datetime import datetime
+import track_geometry
+import focus_scheduler
+import track_map
+import speed_planner
+import car_profiles
+import gearbox
+import traction
+import opponents
+import recovery
+import input_sampler
+import input_trace
+import telemetry_sinks
+import math
 
 class Driver(object):
     '''
     A driver object for the SCRC with optional Pygame-based control
     '''
 
-    def __init__(self, stage, logfile=None, track_name=None, car_name=None, enable_logging=False, control_mode='ai'):
+    def __init__(self, stage, logfile=None, track_name=None, car_name=None, enable_logging=False, control_mode='ai',
+                 input_trace_path=None, record_inputs=None, headless=False, sinks=None):
         '''Constructor'''
         self.WARM_UP = 0
         self.QUALIFYING = 1
@@ -27,305 +37,240 @@ class Driver(object):
         self.control = carControl.CarControl()
         
         self.steer_lock = 0.785398
-        self.max_speed = 100
-        self.prev_rpm = None
+        self.max_speed = 300
+        
+        # Shift tables for the car chosen with --car
+        self.car_profile = car_profiles.get_profile(car_name)
+        self.gearbox = gearbox.Gearbox(self.car_profile)
+        self.traction = traction.TractionControl(self.car_profile)
+        
+        # Range finder geometry, precomputed once for the init angles
+        self.angles = track_geometry.default_angles()
+        self.geometry = track_geometry.RangefinderGeometry(self.angles)
+        self.edges = None
+        self.lookahead_gain = 0.3
+        
+        # Points the focus range finders at the end of the visible track
+        self.focus = focus_scheduler.FocusScheduler()
+        
+        # Opponent handling: start moving aside inside threat_dist metres
+        self.opponent_view = None
+        self.threat_dist = 40.0
+        self.pass_offset = 0.5
+        self.follow_dist = 10.0
+        
+        # Per-track map learned from earlier laps and races
+        if track_name and track_name != 'Unknown':
+            self.track_map = track_map.TrackMap.load(track_name)
+        else:
+            self.track_map = None
+        
+        # Target speed from corner geometry, tracked by a pedal controller
+        self.planner = speed_planner.SpeedPlanner(max_speed=self.max_speed)
+        self.speed_controller = speed_planner.SpeedController()
+        
+        # Takes over when the car is stuck, off track or facing backwards
+        self.recovery = recovery.Recovery(self.steer_lock)
         
         # Control mode selection
-        self.control_modes = ['ai', 'kb', 'controller']
+        self.control_modes = ['ai', 'kb', 'controller', 'replay']
         if control_mode not in self.control_modes:
             raise ValueError(f"Control mode must be one of {self.control_modes}")
         self.control_mode = control_mode
         
-        # Pygame initialization for human control
-        if self.control_mode in ['kb', 'controller']:
-            pygame.init()
-            pygame.display.set_mode((400, 300))  # Always needed for key/controller
-            pygame.display.set_caption("TORCS Control")
-
+        # Human input is sampled on its own thread; drive() only reads
+        # the latest snapshot. Replay feeds a recorded trace instead and
+        # needs neither pygame nor a display.
+        self.sampler = None
+        if self.control_mode == 'replay':
+            if input_trace_path is None:
+                raise ValueError("Replay control mode needs an input trace")
+            self.sampler = input_trace.ReplaySampler(input_trace_path)
+        elif self.control_mode in ['kb', 'controller']:
+            self.sampler = input_sampler.InputSampler(self.control_mode, headless=headless)
+            self.sampler.start()
             if self.control_mode == 'controller':
-                pygame.joystick.init()
-                if pygame.joystick.get_count() > 0:
-                    self.joystick = pygame.joystick.Joystick(0)
-                    self.joystick.init()
-                    print(f"Controller detected: {self.joystick.get_name()}")
+                if self.sampler.joystick_name is not None:
+                    print(f"Controller detected: {self.sampler.joystick_name}")
                 else:
                     print("No controller detected, falling back to keyboard")
                     self.control_mode = 'kb'
+        self.gear_up_seen = 0
+        self.gear_down_seen = 0
+        self.trace_recorder = input_trace.TraceRecorder(record_inputs) if record_inputs and self.sampler is not None else None
 
+        # For keypress/controller input logging
+        self.current_inputs = set()
         
+        # Telemetry sinks. With none configured, drive() is left untouched
+        # so the unlogged path carries no per-tick check at all.
+        self.sinks = list(sinks) if sinks else []
         self.enable_logging = enable_logging
         if self.enable_logging:
-            # Create logs directory if it doesn't exist
-            self.logs_dir = "logs"
-            os.makedirs(self.logs_dir, exist_ok=True)
-            
-            # Generate filename with current timestamp and control mode
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            if(self.control_mode in ['kb', 'controller']):
-                self.log_file = os.path.join(self.logs_dir, f"sensor_log_{timestamp}_human.csv")
-            else:
-                self.log_file = os.path.join(self.logs_dir, f"sensor_log_{timestamp}_ai.csv")
-            self.init_log()
-            
-            # For keypress/controller input logging
-            self.current_inputs = set()
+            self.sinks.append(telemetry_sinks.CsvSink(logfile or telemetry_sinks.log_path("logs", self.control_mode)))
+        if self.sinks:
+            self.drive = self._logged(self.drive)
 
-    def init_log(self):
-        '''Initialize the CSV log file with headers for all sensors and keypresses'''
-        with open(self.log_file, mode='w', newline='') as file:
-            writer = csv.writer(file)
-            # Write headers for all available sensors
-            writer.writerow([
-                'timestamp',
-                'angle',
-                'curLapTime',
-                'damage',
-                'distFromStart',
-                'distRaced',
-                'fuel',
-                'gear',
-                'lastLapTime',
-                'racePos',
-                'rpm',
-                'speedX',
-                'speedY',
-                'speedZ',
-                'trackPos',
-                'z',
-                # Array-type sensors will be flattened
-                *[f'focus_{i}' for i in range(5)],
-                *[f'opponent_{i}' for i in range(36)],
-                *[f'track_{i}' for i in range(19)],
-                *[f'wheelSpinVel_{i}' for i in range(4)],
-                # Control outputs
-                'accel',
-                'brake',
-                'clutch',
-                'steer',
-                # Inputs
-                'inputs'
-            ])
+    @property
+    def quit_requested(self):
+        '''Whether the control window was closed; the client loop then shuts down'''
+        return self.sampler is not None and self.sampler.quit_requested
 
-    def log_sensors(self):
-        '''Log all sensor data to the CSV file'''
-        with open(self.log_file, mode='a', newline='') as file:
-            writer = csv.writer(file)
-            
-            # Flatten array-type sensors
-            focus = self.state.focus if self.state.focus is not None else [None]*5
-            opponents = self.state.opponents if self.state.opponents is not None else [None]*36
-            track = self.state.track if self.state.track is not None else [None]*19
-            wheelSpinVel = self.state.wheelSpinVel if self.state.wheelSpinVel is not None else [None]*4
-            
-            # Convert current inputs to string representation
-            input_str = ','.join(sorted(self.current_inputs)) if self.current_inputs else 'None'
-            
-            # Write all sensor data
-            writer.writerow([
-                datetime.now().isoformat(),
-                self.state.angle,
-                self.state.curLapTime,
-                self.state.damage,
-                self.state.distFromStart,
-                self.state.distRaced,
-                self.state.fuel,
-                self.state.gear,
-                self.state.lastLapTime,
-                self.state.racePos,
-                self.state.rpm,
-                self.state.speedX,
-                self.state.speedY,
-                self.state.speedZ,
-                self.state.trackPos,
-                self.state.z,
-                # Flatten array sensors
-                *focus,
-                *opponents,
-                *track,
-                *wheelSpinVel,
-                # Control outputs
-                self.control.getAccel(),
-                self.control.getBrake(),
-                self.control.getClutch(),
-                self.control.getSteer(),
-                # Inputs
-                input_str
-            ])
-            
-            # Reset inputs for next frame
-            self.current_inputs = set()
+    def _logged(self, drive):
+        '''Wrap a bound drive method so every tick is passed to the sinks'''
+        sinks = self.sinks
+        capture = self.capture
+        
+        def logged_drive(msg):
+            reply = drive(msg)
+            capture(msg, reply)
+            for sink in sinks:
+                sink.write(self)
+            return reply
+        
+        return logged_drive
+
+    def capture(self, msg, reply):
+        '''Make state and control reflect this tick for the sinks'''
+        pass
 
     def init(self):
         '''Return init string with rangefinder angles'''
-        self.angles = [0 for x in range(19)]
-        
-        for i in range(5):
-            self.angles[i] = -90 + i * 15
-            self.angles[18 - i] = 90 - i * 15
-        
-        for i in range(5, 9):
-            self.angles[i] = -20 + (i-5) * 5
-            self.angles[18 - i] = 20 - (i-5) * 5
-        
         return self.parser.stringify({'init': self.angles})
     
     def human_control(self):
-        '''Handle human keyboard controls using Pygame'''
-
-
-        pygame.event.pump()
-        # Get pressed keys
-        keys = pygame.key.get_pressed()
-        
-        # Track inputs for logging
-        self.current_inputs = set()
+        '''Apply the latest keyboard, controller or replayed snapshot'''
+        snapshot = self.sampler.read()
+        if self.trace_recorder is not None:
+            self.trace_recorder.write(snapshot)
         
-        # Steering
-        if keys[pygame.K_LEFT]:
-            self.control.setSteer(1.0)  # Full left
-            self.current_inputs.add('LEFT')
-        elif keys[pygame.K_RIGHT]:
-            self.control.setSteer(-1.0)  # Full right
-            self.current_inputs.add('RIGHT')
-        else:
-            self.control.setSteer(0)  # Neutral steering
-        
-        # Acceleration
-        if keys[pygame.K_UP]:
-            self.control.setAccel(1.0)  # Full acceleration
-            self.control.setBrake(0)
-            self.current_inputs.add('UP')
-        elif keys[pygame.K_DOWN]:
-            self.control.setAccel(0)
-            self.control.setBrake(1.0)  # Full brake
-            self.current_inputs.add('DOWN')
-        else:
-            self.control.setAccel(0)
-            self.control.setBrake(0)
+        self.control.setSteer(snapshot.steer)
+        self.control.setAccel(snapshot.accel)
+        self.control.setBrake(snapshot.brake)
         
-        # Gear shifting
-        if keys[pygame.K_z]:
-            self.control.setGear(self.state.getGear() - 1)  # Shift down
-            self.current_inputs.add('Z')
-        elif keys[pygame.K_x]:
-            self.control.setGear(self.state.getGear() + 1)  # Shift up
-            self.current_inputs.add('X')
+        # Each press shifts once, however many ticks it is held for
+        gear = self.state.getGear()
+        if snapshot.gear_up != self.gear_up_seen or snapshot.gear_down != self.gear_down_seen:
+            gear += (snapshot.gear_up - self.gear_up_seen) - (snapshot.gear_down - self.gear_down_seen)
+            self.control.setGear(gear)
+            self.gear_up_seen = snapshot.gear_up
+            self.gear_down_seen = snapshot.gear_down
         
-        # Event handling to allow quitting
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-            elif event.type == pygame.KEYDOWN:
-                # Add any other keypresses we want to track
-                if event.key == pygame.K_SPACE:
-                    self.current_inputs.add('SPACE')
-                elif event.key == pygame.K_ESCAPE:
-                    self.current_inputs.add('ESC')
+        # Track inputs for logging
+        self.current_inputs = set(snapshot.inputs)
     
     def controller_control(self):
         '''Handle Xbox 360 controller input'''
-        # Process events to keep the controller state updated
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-        
-        # Track inputs for logging
-        self.current_inputs = set()
-        
-        if pygame.joystick.get_count() > 0:
-            # Left stick (axis 0) for steering
-            steer_axis = -self.joystick.get_axis(0)
-            self.control.setSteer(steer_axis)
-            if abs(steer_axis) > 0.1:
-                self.current_inputs.add(f'STEER_{steer_axis:.2f}')
-            
-            # Right trigger (axis 5) for acceleration
-            # Note: Xbox 360 triggers range from -1 (released) to 1 (pressed)
-            # But some systems might report them as 0 to 1
-            accel = (self.joystick.get_axis(5) + 1) / 2  # Normalize to 0-1
-            self.control.setAccel(accel)
-            if accel > 0.1:
-                self.current_inputs.add(f'ACCEL_{accel:.2f}')
-            
-            # Left trigger (axis 4) for brake
-            brake = (self.joystick.get_axis(4) + 1) / 2  # Normalize to 0-1
-            self.control.setBrake(brake)
-            if brake > 0.1:
-                self.current_inputs.add(f'BRAKE_{brake:.2f}')
-            
-            # A button (button 0) for gear up
-            if self.joystick.get_button(0):
-                self.control.setGear(self.state.getGear() + 1)
-                self.current_inputs.add('GEAR_UP')
-            
-            # B button (button 1) for gear down
-            if self.joystick.get_button(1):
-                self.control.setGear(self.state.getGear() - 1)
-                self.current_inputs.add('GEAR_DOWN')
-            
-            
+        # Axes are smoothed by the sampler, so both devices share one path
+        self.human_control()
+    
+    def sense(self, track, focus, speed_x):
+        '''Track edges for this tick, refined by the focus readings, and the next focus request'''
+        edges = self.geometry.compute(track) if track else None
+        self.focus.update(focus, speed_x)
+        self.edges = self.focus.refine(edges)
+        self.control.setFocus(self.focus.aim(self.edges))
     
     def drive(self, msg):
         self.state.setFromMsg(msg)
-        if self.control_mode == 'kb':
+        # In every mode, so human logs carry the refined edges too
+        self.sense(self.state.track, self.state.focus, self.state.speedX)
+        if self.control_mode in ['kb', 'replay']:
             self.human_control()
             
         elif self.control_mode == 'controller':
             self.controller_control()
+        elif self.recovery.update(self.state.angle, self.state.trackPos, self.state.speedX):
+            self.recovery.apply(self.control, self.state.angle, self.state.trackPos)
         else:
             # Original AI driving logic
+            self.opponent_view = opponents.view(self.state.opponents)
+            if self.track_map is not None:
+                self.track_map.update(self.state, self.edges)
             self.steer()
             self.gear()
             self.speed()
         
-        if self.enable_logging:
-            self.log_sensors()
+        # Traction control and ABS on whatever was decided above
+        accel, brake = self.traction.apply(self.control.getAccel(), self.control.getBrake(), self.state.getSpeedX(), self.state.getWheelSpinVel())
+        self.control.setAccel(accel)
+        self.control.setBrake(brake)
         
         return self.control.toMsg()
     
     def steer(self):
         angle = self.state.angle
         dist = self.state.trackPos
-        self.control.setSteer((angle - dist*0.5)/self.steer_lock)
+        
+        # Follow the line of the fastest lap where the map knows one
+        if self.track_map is not None:
+            entry = self.track_map.lookup(self.state.distFromStart)
+            if entry is not None and not math.isnan(entry[3]):
+                dist -= entry[3]
+        
+        # Move over to the side with the larger gap when closing on a car
+        view = self.opponent_view
+        if view is not None and view.front_dist < self.threat_dist:
+            dist -= view.pass_side() * self.pass_offset * (1.0 - view.front_dist/self.threat_dist)
+        
+        steer = (angle - dist*0.5)/self.steer_lock
+        
+        # Lookahead: lean toward the free space direction (negative is left)
+        if self.edges is not None:
+            steer -= self.lookahead_gain * self.edges.free_angle/self.steer_lock
+        
+        self.control.setSteer(steer)
     
     def gear(self):
         rpm = self.state.getRpm()
         gear = self.state.getGear()
+        speed = self.state.getSpeedX()
         
-        if self.prev_rpm == None:
-            up = True
-        else:
-            if (self.prev_rpm - rpm) < 0:
-                up = True
-            else:
-                up = False
-        
-        if up and rpm > 7000:
-            gear += 1
-        
-        if not up and rpm < 3000:
-            gear -= 1
-        
-        self.control.setGear(gear)
+        self.control.setGear(self.gearbox.select(gear, rpm, speed))
     
     def speed(self):
         speed = self.state.getSpeedX()
-        accel = self.control.getAccel()
+        target = self.planner.target(self.state, self.edges, self.track_map)
         
-        if speed < self.max_speed:
-            accel += 0.1
-            if accel > 1:
-                accel = 1.0
-        else:
-            accel -= 0.1
-            if accel < 0:
-                accel = 0.0
+        # Back off rather than run into a car directly ahead
+        view = self.opponent_view
+        if view is not None and view.front_dist < self.follow_dist:
+            target = min(target, speed * view.front_dist/self.follow_dist)
         
+        accel, brake = self.speed_controller.update(target, speed)
         self.control.setAccel(accel)
+        self.control.setBrake(brake)
             
+    def set_track(self, track_name):
+        '''Switch to another track between episodes'''
+        if self.track_map is not None:
+            self.track_map.save()
+        self.track_name = track_name
+        if track_name and track_name != 'Unknown':
+            self.track_map = track_map.TrackMap.load(track_name)
+        else:
+            self.track_map = None
+        self.planner = speed_planner.SpeedPlanner(max_speed=self.max_speed)
+    
+    def onIdle(self):
+        '''Called after each reply is sent, in the gap before the next tick'''
+        pass
+    
     def onShutDown(self):
-        if self.control_mode in ['kb', 'controller']:
-            pygame.quit()
+        for sink in self.sinks:
+            sink.close()
+        if self.track_map is not None:
+            self.track_map.save()
+        if self.trace_recorder is not None:
+            self.trace_recorder.close()
+        if self.sampler is not None:
+            self.sampler.stop()
     
     def onRestart(self):
-        pass
\ No newline at end of file
+        self.speed_controller.reset()
+        self.gearbox.reset()
+        self.recovery.reset()
+        self.focus.reset()
+        self.control.setMeta(0)
+        if self.track_map is not None:
+            self.track_map.save()
\ No newline at end of file
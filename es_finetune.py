@@ -0,0 +1,325 @@
+import argparse
+import copy
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import joblib
+import numpy as np
+
+import fleet_runner
+import kinematic_sim
+import model_registry
+import nn_driver
+import pyclient
+import telemetry_sinks
+
+
+def get_params(model):
+    '''All MLP weights and biases as one flat vector'''
+    return np.concatenate([w.ravel() for w in model.coefs_ + model.intercepts_])
+
+
+def set_params(model, theta):
+    '''Write a flat vector from get_params back into the model, in place'''
+    offset = 0
+    for w in model.coefs_ + model.intercepts_:
+        w[...] = theta[offset:offset + w.size].reshape(w.shape)
+        offset += w.size
+    return model
+
+
+def use_params(d, theta):
+    '''Drive d with theta, on its own copy of the (shared, cached) model'''
+    d.set_model(model_registry.CompiledModel(set_params(copy.deepcopy(d.model), theta), d.scaler))
+
+
+def save_model(model, theta, path):
+    '''Write theta as an MLP pickle that NNDriver can load'''
+    tuned = set_params(copy.deepcopy(model), theta)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    joblib.dump(tuned, path)
+
+
+def reward(summary, off_track_weight=1.0, damage_weight=0.1):
+    '''Distance covered, less penalties for ticks off track and damage taken'''
+    return (summary['dist_raced'] - off_track_weight * summary['off_track_ticks']
+            - damage_weight * summary['damage'])
+
+
+def centred_ranks(values):
+    '''Fitness shaping: ranks scaled to [-0.5, 0.5], robust to outliers'''
+    ranks = np.empty(len(values))
+    ranks[np.argsort(values)] = np.arange(len(values))
+    return ranks / max(len(values) - 1, 1) - 0.5
+
+
+class EvolutionStrategy(object):
+    '''
+    OpenAI-style evolution strategy over a flat parameter vector.
+
+    ask() returns antithetic pairs theta + sigma*eps and theta - sigma*eps,
+    so the population must be even. tell() takes one reward per candidate,
+    shapes them by rank and takes an Adam step along the estimated
+    gradient. Only rewards cross process boundaries, so any number of
+    workers or a vectorised backend can score a population.
+    '''
+
+    def __init__(self, theta, population=32, sigma=0.02, learning_rate=0.01, weight_decay=0.005, seed=0):
+        '''Constructor'''
+        if population % 2:
+            raise ValueError("Population must be even for antithetic sampling")
+        self.theta = np.array(theta, dtype=np.float64)
+        self.population = population
+        self.sigma = sigma
+        self.learning_rate = learning_rate
+        self.weight_decay = weight_decay
+        self.rng = np.random.default_rng(seed)
+        self.eps = None
+        self.m = np.zeros_like(self.theta)
+        self.v = np.zeros_like(self.theta)
+        self.t = 0
+
+    def ask(self):
+        self.eps = self.rng.standard_normal((self.population // 2, self.theta.size))
+        noise = np.concatenate([self.eps, -self.eps])
+        return self.theta + self.sigma * noise
+
+    def tell(self, rewards):
+        shaped = centred_ranks(np.asarray(rewards, dtype=np.float64))
+        half = self.population // 2
+        grad = (shaped[:half] - shaped[half:]) @ self.eps / (self.population * self.sigma)
+        grad -= self.weight_decay * self.theta
+
+        # Adam ascent step
+        self.t += 1
+        self.m = 0.9 * self.m + 0.1 * grad
+        self.v = 0.999 * self.v + 0.001 * grad * grad
+        m_hat = self.m / (1 - 0.9 ** self.t)
+        v_hat = self.v / (1 - 0.999 ** self.t)
+        self.theta += self.learning_rate * m_hat / (np.sqrt(v_hat) + 1e-8)
+        return self.theta
+
+
+_slot = None
+
+
+def _init_worker(slots):
+    global _slot
+    _slot = slots.get()
+    sys.stdout = sys.stderr = open(os.devnull, 'w')
+
+
+def _server_rollout(task):
+    '''Worker body: drive one episode with theta on this worker's port'''
+    theta, track, config = task
+    port = config['base_port'] + _slot
+    argv = ['--port', str(port), '--track', track, '--car', config['car'], '--driver', 'nn',
+            '--model', config['model_path'], '--scaler', config['scaler_path'],
+            '--maxEpisodes', '1', '--maxSteps', str(config['max_steps']),
+            '--connectTimeout', str(config.get('connect_timeout', 0.0))]
+    arguments = pyclient.build_parser().parse_args(argv)
+    laps = telemetry_sinks.LapSink()
+    server = fleet_runner.launch_server(config, port, track, config['car'])
+    try:
+        if server is not None:
+            time.sleep(config.get('server_warmup', 2.0))
+        d = pyclient.make_driver(arguments, extra_sinks=[laps])
+        use_params(d, theta)
+        try:
+            pyclient.run(arguments, d)
+        except SystemExit:
+            # A worker that exits is replaced without its slot and the map never returns
+            raise RuntimeError(f"No server answered on port {port}")
+    finally:
+        fleet_runner.stop_server(server)
+    return reward(laps.summary(), config['off_track_weight'], config['damage_weight'])
+
+
+class ServerRollouts(object):
+    '''
+    Scores candidates against TORCS servers, one worker process per port.
+
+    Worker i talks to base_port + i, on a server that is already running
+    or that the worker launches from server_cmd before each rollout and
+    stops after it. Each candidate drives one episode of max_steps ticks
+    per track and scores the mean reward. A rollout whose server does not
+    answer within connect_timeout seconds fails the generation.
+    '''
+
+    def __init__(self, config, workers):
+        '''Constructor'''
+        self.config = config
+        ctx = multiprocessing.get_context('spawn')
+        slots = ctx.Queue()
+        for slot in range(workers):
+            slots.put(slot)
+        self.pool = ctx.Pool(workers, initializer=_init_worker, initargs=(slots,))
+
+    def evaluate(self, candidates):
+        tracks = self.config['tracks']
+        tasks = [(theta, track, self.config) for theta in candidates for track in tracks]
+        rewards = np.array(self.pool.map(_server_rollout, tasks, chunksize=1))
+        return rewards.reshape(len(candidates), len(tracks)).mean(axis=1)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+
+def _sim_rollout(task):
+    '''Worker body: drive a batch of candidates side by side in one simulation'''
+    thetas, track, config = task
+    drivers = []
+    for theta in thetas:
+        # Inline inference: a deadline would make scores depend on machine load
+        d = nn_driver.NNDriver(3, config['model_path'], config['scaler_path'], car_name=config['car'], deadline=None)
+        use_params(d, theta)
+        drivers.append(d)
+    sim = kinematic_sim.KinematicSim(track, len(drivers), drivers[0].angles, config['car'])
+
+    # A car that asks for a restart has given up; freeze its score there
+    done = np.zeros(len(drivers), dtype=bool)
+    summaries = [None] * len(drivers)
+    messages = sim.messages()
+    for tick in range(config['max_steps']):
+        replies = [d.drive(msg) if not done[i] else '(accel 0)(brake 1)' for i, (d, msg) in enumerate(zip(drivers, messages))]
+        for i in sim.apply(replies):
+            if not done[i]:
+                done[i] = True
+                summaries[i] = _sim_summary(sim, i)
+        if done.all():
+            break
+        messages = sim.messages()
+    summaries = [s if s is not None else _sim_summary(sim, i) for i, s in enumerate(summaries)]
+    return [reward(s, config['off_track_weight'], config['damage_weight']) for s in summaries]
+
+
+def _sim_summary(sim, i):
+    return {'dist_raced': sim.dist_raced[i], 'off_track_ticks': sim.off_track_ticks[i], 'damage': sim.damage[i]}
+
+
+class SimRollouts(object):
+    '''
+    Scores candidates in the kinematic simulator, much faster than real time.
+
+    The population is split into one batch per worker. Each batch is a
+    single vectorised simulation with one NNDriver per car, so the drivers
+    see exactly the messages a server would send. tracks must name
+    simulator presets.
+    '''
+
+    def __init__(self, config, workers):
+        '''Constructor'''
+        self.config = config
+        self.workers = workers
+        for track in config['tracks']:
+            kinematic_sim.Track.preset(track)
+        self.pool = multiprocessing.get_context('spawn').Pool(workers)
+
+    def evaluate(self, candidates):
+        batches = np.array_split(np.asarray(candidates), min(self.workers, len(candidates)))
+        tracks = self.config['tracks']
+        tasks = [(batch, track, self.config) for track in tracks for batch in batches]
+        results = self.pool.map(_sim_rollout, tasks, chunksize=1)
+        rewards = np.array([r for batch in results for r in batch]).reshape(len(tracks), len(candidates))
+        return rewards.mean(axis=0)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+
+BACKENDS = {
+    'server': ServerRollouts,
+    'sim': SimRollouts,
+}
+
+
+def finetune(config, backend, generations, population, sigma, learning_rate, seed=0, out='models/nn_model_es.pkl'):
+    '''
+    Run the evolution strategy and save the best weights seen.
+
+    The current mean is scored alongside each population, so the saved
+    model is one that was actually driven, never an untested step.
+    '''
+    model = joblib.load(config['model_path'])
+    es = EvolutionStrategy(get_params(model), population, sigma, learning_rate, seed=seed)
+    rollouts = BACKENDS[backend](config, config['workers'])
+    best_reward, history = -np.inf, []
+    try:
+        for generation in range(generations):
+            candidates = es.ask()
+            rewards = rollouts.evaluate(np.vstack([candidates, es.theta]))
+            mean_reward = rewards[-1]
+            if mean_reward > best_reward:
+                best_reward = mean_reward
+                save_model(model, es.theta, out)
+            es.tell(rewards[:-1])
+            history.append({'generation': generation, 'mean_reward': float(mean_reward),
+                            'population_mean': float(rewards[:-1].mean()), 'population_max': float(rewards[:-1].max())})
+            print(f"gen {generation}: mean {mean_reward:.1f}, population {rewards[:-1].mean():.1f} "
+                  f"(max {rewards[:-1].max():.1f}), best {best_reward:.1f}")
+    except KeyboardInterrupt:
+        print("Interrupted, keeping the best model so far")
+    finally:
+        rollouts.close()
+    with open(os.path.splitext(out)[0] + '_history.json', 'w') as file:
+        json.dump(history, file, indent=2)
+    return best_reward
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fine-tune the NNDriver MLP with evolution strategies.')
+    parser.add_argument('--model', default='models/nn_model.pkl', help='Starting model')
+    parser.add_argument('--scaler', default='models/nn_scaler.pkl', help='Scaler the model was trained with')
+    parser.add_argument('--out', default='models/nn_model_es.pkl', help='Where to write the best model')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='server', help='Rollout backend')
+    parser.add_argument('--tracks', nargs='+', default=None,
+                        help='Tracks every candidate is scored on (default: Unknown, or circuit in the sim)')
+    parser.add_argument('--car', default='Unknown', help='Car name')
+    parser.add_argument('--generations', type=int, default=50, help='ES generations')
+    parser.add_argument('--population', type=int, default=32, help='Candidates per generation (even)')
+    parser.add_argument('--sigma', type=float, default=0.02, help='Parameter noise scale')
+    parser.add_argument('--lr', type=float, default=0.01, help='Adam learning rate')
+    parser.add_argument('--maxSteps', type=int, default=2000, help='Ticks per rollout')
+    parser.add_argument('--offTrackWeight', type=float, default=1.0, help='Reward penalty per tick off track')
+    parser.add_argument('--damageWeight', type=float, default=0.1, help='Reward penalty per damage point')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Parallel rollout workers')
+    parser.add_argument('--basePort', type=int, default=3001, help='Port of worker 0; worker i uses basePort + i')
+    parser.add_argument('--serverCmd', default=None,
+                        help='Command each worker runs to launch its server before every rollout, '
+                             'with {port}, {track} and {car} placeholders')
+    parser.add_argument('--serverWarmup', type=float, default=2.0,
+                        help='Seconds to wait for a launched server before connecting')
+    parser.add_argument('--connectTimeout', type=float, default=30.0,
+                        help='Seconds a rollout waits for its server before failing, 0 to wait forever')
+    parser.add_argument('--seed', type=int, default=0, help='Noise seed')
+    arguments = parser.parse_args()
+
+    config = {
+        'model_path': arguments.model,
+        'scaler_path': arguments.scaler,
+        'tracks': arguments.tracks or (['circuit'] if arguments.backend == 'sim' else ['Unknown']),
+        'car': arguments.car,
+        'max_steps': arguments.maxSteps,
+        'off_track_weight': arguments.offTrackWeight,
+        'damage_weight': arguments.damageWeight,
+        'workers': arguments.workers,
+        'base_port': arguments.basePort,
+        'backend': arguments.backend,
+        'server_cmd': arguments.serverCmd,
+        'server_warmup': arguments.serverWarmup,
+        'connect_timeout': arguments.connectTimeout,
+    }
+    best = finetune(config, arguments.backend, arguments.generations, arguments.population, arguments.sigma,
+                    arguments.lr, arguments.seed, arguments.out)
+    print(f"Best mean reward {best:.1f}, model in {arguments.out} (use with --scaler {arguments.scaler})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+import numpy as np
+import fleet_runner
+
+# Allowed change of a candidate against the baseline before it is flagged
+DEFAULT_THRESHOLDS = {
+    'best_lap_pct': 1.0,          # % slower mean best lap
+    'damage_abs': 100.0,          # extra mean damage points
+    'off_track_pct_abs': 1.0,     # extra % of ticks off track
+    'latency_p99_ms_abs': 5.0,    # extra ms on the p99 tick latency
+    'completion_abs': 0.0,        # fewer jobs finishing with a lap
+}
+
+
+def load_results(path):
+    '''Job results from a results.jsonl, keeping the latest entry per job'''
+    results = {}
+    with open(path) as file:
+        for line in file:
+            result = json.loads(line)
+            results[result['id']] = result
+    return list(results.values())
+
+
+def _mean(values):
+    values = [v for v in values if v is not None]
+    return float(np.mean(values)) if values else None
+
+
+def aggregate(results):
+    '''Summarise one variant's job results into comparable metrics'''
+    ok = [r for r in results if r.get('status') == 'ok']
+    ticks = sum(r['ticks'] for r in ok)
+    return {
+        'jobs': len(results),
+        'failed': len(results) - len(ok),
+        'completion': sum(1 for r in ok if r['best_lap'] is not None) / max(len(results), 1),
+        'best_lap': _mean([r['best_lap'] for r in ok]),
+        'damage': _mean([r['damage'] for r in ok]),
+        'off_track_pct': 100.0 * sum(r['off_track_ticks'] for r in ok) / ticks if ticks else None,
+        'latency_p50_ms': _mean([r.get('latency_p50_ms') for r in ok]),
+        'latency_p99_ms': max([r['latency_p99_ms'] for r in ok if r.get('latency_p99_ms') is not None], default=None),
+        'per_job': {r['id']: {k: r.get(k) for k in ('best_lap', 'damage', 'off_track_ticks', 'latency_p99_ms')} for r in ok},
+    }
+
+
+def compare(baseline, candidate, thresholds):
+    '''Return a list of regression messages; empty means the gate passes'''
+    failures = []
+
+    def check(name, base, cand, limit, pct=False):
+        if base is None or cand is None:
+            return
+        delta = 100.0 * (cand - base) / base if pct and base else cand - base
+        if delta > limit:
+            unit = '%' if pct else ''
+            failures.append(f"{name}: {base:.3f} -> {cand:.3f} ({delta:+.2f}{unit}, limit {limit}{unit})")
+
+    check('best_lap', baseline['best_lap'], candidate['best_lap'], thresholds['best_lap_pct'], pct=True)
+    check('damage', baseline['damage'], candidate['damage'], thresholds['damage_abs'])
+    check('off_track_pct', baseline['off_track_pct'], candidate['off_track_pct'], thresholds['off_track_pct_abs'])
+    check('latency_p99_ms', baseline['latency_p99_ms'], candidate['latency_p99_ms'], thresholds['latency_p99_ms_abs'])
+    # Completion is better when higher, so compare it the other way round
+    check('completion_drop', -baseline['completion'], -candidate['completion'], thresholds['completion_abs'])
+    if candidate['failed'] > baseline['failed']:
+        failures.append(f"failed jobs: {baseline['failed']} -> {candidate['failed']}")
+    return failures
+
+
+def run_suite(suite, out):
+    '''
+    Run every variant in the suite over its tracks and cars.
+
+    Each call gets a fresh run directory under out, so the fleet runner
+    never resumes from, and the report never includes, an earlier run.
+    '''
+    report = {}
+    jobs = fleet_runner.make_jobs(suite['tracks'], suite['cars'], suite.get('repeats', 1))
+    os.makedirs(out, exist_ok=True)
+    run_dir = tempfile.mkdtemp(prefix=datetime.now().strftime('%Y%m%d_%H%M%S_'), dir=out)
+    print(f"Evaluation run in {run_dir}")
+    for variant in suite['variants']:
+        config = {
+            'out': os.path.join(run_dir, variant['name']),
+            'base_port': suite.get('base_port', 3001),
+            'backend': suite.get('backend', 'server'),
+            'server_cmd': suite.get('server_cmd'),
+            'replay_log': suite.get('replay_log'),
+            'laps': suite.get('laps', 1),
+            'driver': variant.get('driver', 'rule'),
+            'model_path': variant.get('model'),
+            'scaler_path': variant.get('scaler'),
+            'episodes': suite.get('episodes', 1),
+            'max_steps': suite.get('max_steps', 0),
+            'sinks': [],
+        }
+        runner = fleet_runner.FleetRunner(config, suite.get('workers', os.cpu_count()), suite.get('retries', 1),
+                                          suite.get('timeout', 3600.0))
+        runner.run(jobs)
+        report[variant['name']] = aggregate(load_results(runner.results_path))
+    return report
+
+
+def print_report(report):
+    print(f"{'variant':<16} {'jobs':>5} {'fail':>5} {'done %':>7} {'best lap':>9} {'damage':>8} {'off %':>7} {'p50 ms':>7} {'p99 ms':>7}")
+    fmt = lambda v, f: format(v, f) if v is not None else '-'
+    for name, m in report.items():
+        print(f"{name:<16} {m['jobs']:>5} {m['failed']:>5} {100 * m['completion']:>7.1f} {fmt(m['best_lap'], '9.3f'):>9} "
+              f"{fmt(m['damage'], '8.1f'):>8} {fmt(m['off_track_pct'], '7.2f'):>7} {fmt(m['latency_p50_ms'], '7.3f'):>7} "
+              f"{fmt(m['latency_p99_ms'], '7.3f'):>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare driver variants on lap time, damage and latency.')
+    parser.add_argument('suite', help='Suite JSON: tracks, cars, variants, backend and optional thresholds')
+    parser.add_argument('--out', default='evaluation_runs', help='Output directory')
+    parser.add_argument('--baseline', default=None,
+                        help='Variant name, or a previous report JSON, to gate the other variants against')
+    parser.add_argument('--report', default=None, help='Write the report JSON here')
+    arguments = parser.parse_args()
+
+    with open(arguments.suite) as file:
+        suite = json.load(file)
+    thresholds = dict(DEFAULT_THRESHOLDS, **suite.get('thresholds', {}))
+
+    report = run_suite(suite, arguments.out)
+    print_report(report)
+    if arguments.report:
+        with open(arguments.report, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    if arguments.baseline is None:
+        return 0
+    if arguments.baseline in report:
+        baseline = report[arguments.baseline]
+        candidates = {k: v for k, v in report.items() if k != arguments.baseline}
+    else:
+        with open(arguments.baseline) as file:
+            stored = json.load(file)
+        candidates = report
+        baseline = None
+
+    status = 0
+    for name, metrics in candidates.items():
+        base = baseline if baseline is not None else stored.get(name)
+        if base is None:
+            print(f"{name}: no baseline, skipped")
+            continue
+        failures = compare(base, metrics, thresholds)
+        if failures:
+            status = 1
+            print(f"{name}: REGRESSION")
+            for failure in failures:
+                print(f"  {failure}")
+        else:
+            print(f"{name}: ok")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,272 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+
+import pyclient
+import telemetry_sinks
+
+
+def make_jobs(tracks, cars, repeats=1):
+    '''Every track/car pair, repeated, as a list of job dicts'''
+    jobs = []
+    for track, car, rep in itertools.product(tracks, cars, range(repeats)):
+        jobs.append({'id': f'{track}__{car}__{rep}', 'track': track, 'car': car, 'rep': rep})
+    return jobs
+
+
+def timed(drive, latencies):
+    '''Wrap a drive method to record each tick's latency in seconds'''
+    clock = time.perf_counter
+
+    def timed_drive(msg):
+        start = clock()
+        reply = drive(msg)
+        latencies.append(clock() - start)
+        return reply
+
+    return timed_drive
+
+
+def latency_summary(latencies):
+    if not latencies:
+        return {'latency_p50_ms': None, 'latency_p99_ms': None, 'latency_max_ms': None}
+    ordered = sorted(latencies)
+    pick = lambda q: 1000.0 * ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {'latency_p50_ms': pick(0.5), 'latency_p99_ms': pick(0.99), 'latency_max_ms': 1000.0 * ordered[-1]}
+
+
+def start_server(config, port, track, car):
+    '''
+    Start an in-process server for one run on port, as configured.
+
+    With the replay or sim backend a ReplayServer or SimServer thread is
+    started in the worker and dies with it. Otherwise a server must be
+    listening already, either external or launched by the parent with
+    launch_server, and None is returned.
+    '''
+    if config['backend'] == 'replay':
+        import replay_server
+        replay = replay_server.ReplayServer(port, replay_server.log_messages(config['replay_log']),
+                                            episodes=config['episodes'])
+        server = threading.Thread(target=replay.serve, daemon=True)
+        server.start()
+        return server
+    if config['backend'] == 'sim':
+        import kinematic_sim
+        sim = kinematic_sim.SimServer(port, track, car, episodes=config['episodes'], laps=config.get('laps', 1))
+        server = threading.Thread(target=sim.serve, daemon=True)
+        server.start()
+        return server
+    return None
+
+
+def launch_server(config, port, track, car):
+    '''
+    Launch the server command for one run on port, or return None.
+
+    FleetRunner calls it from the parent, not the worker, so a worker killed
+    on timeout or Ctrl-C cannot leave its server holding the slot's port.
+    '''
+    if config['backend'] != 'server' or not config.get('server_cmd'):
+        return None
+    cmd = config['server_cmd'].format(port=port, track=track, car=car)
+    return subprocess.Popen(shlex.split(cmd), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def stop_server(server, timeout=5.0):
+    if server is None:
+        return
+    server.terminate()
+    try:
+        server.wait(timeout)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+def run_job(job, slot, config):
+    '''
+    Worker process body: one client episode against the server for slot,
+    which listens on base_port + slot (see start_server).
+    '''
+    job_dir = os.path.join(config['out'], job['id'])
+    os.makedirs(job_dir, exist_ok=True)
+    port = config['base_port'] + slot
+    sys.stdout = sys.stderr = open(os.path.join(job_dir, 'client.log'), 'w', buffering=1)
+
+    start_server(config, port, job['track'], job['car'])
+    if config['backend'] == 'server' and config.get('server_cmd'):
+        # The parent launched it just before this process
+        time.sleep(config.get('server_warmup', 2.0))
+
+    argv = ['--port', str(port), '--track', job['track'], '--car', job['car'],
+            '--driver', config['driver'], '--maxEpisodes', str(config['episodes']),
+            '--maxSteps', str(config['max_steps']), '--connectTimeout', str(config.get('connect_timeout', 0.0)),
+            '--logdir', job_dir]
+    for sink in config['sinks']:
+        argv += ['--sink', sink]
+    if config.get('model_path'):
+        argv += ['--model', config['model_path']]
+    if config.get('scaler_path'):
+        argv += ['--scaler', config['scaler_path']]
+    arguments = pyclient.build_parser().parse_args(argv)
+
+    laps = telemetry_sinks.LapSink()
+    start = time.time()
+    latencies = []
+    d = pyclient.make_driver(arguments, extra_sinks=[laps])
+    d.drive = timed(d.drive, latencies)
+    pyclient.run(arguments, d)
+
+    result = dict(job, slot=slot, wall_time=time.time() - start, **laps.summary(), **latency_summary(latencies))
+    with open(os.path.join(job_dir, 'result.json'), 'w') as file:
+        json.dump(result, file)
+
+
+class FleetRunner(object):
+    '''
+    Runs jobs on M worker processes, one server port per worker slot.
+
+    Each attempt is a fresh process, so a crashed or hung client cannot
+    take the others down. Servers from a server command are launched and
+    stopped here, around each attempt. Failed attempts are retried up to retries times.
+    Results are appended to results.jsonl as they arrive. Jobs already in
+    that file are skipped, so an interrupted run picks up where it stopped.
+    '''
+
+    def __init__(self, config, workers, retries=2, job_timeout=3600.0):
+        '''Constructor'''
+        self.config = config
+        self.workers = workers
+        self.retries = retries
+        self.job_timeout = job_timeout
+        self.results_path = os.path.join(config['out'], 'results.jsonl')
+        os.makedirs(config['out'], exist_ok=True)
+
+    def completed(self):
+        done = set()
+        if os.path.exists(self.results_path):
+            with open(self.results_path) as file:
+                for line in file:
+                    try:
+                        result = json.loads(line)
+                    except ValueError:
+                        continue
+                    if result.get('status') == 'ok':
+                        done.add(result['id'])
+        return done
+
+    def _record(self, result):
+        with open(self.results_path, 'a') as file:
+            file.write(json.dumps(result) + '\n')
+
+    def _finish(self, job, slot, attempt, status, pending):
+        result_file = os.path.join(self.config['out'], job['id'], 'result.json')
+        if status == 'ok' and os.path.exists(result_file):
+            with open(result_file) as file:
+                result = json.load(file)
+            result.update(status='ok', attempts=attempt)
+            self._record(result)
+            print(f"[slot {slot}] {job['id']} done: best lap {result['best_lap']}")
+        elif attempt <= self.retries:
+            print(f"[slot {slot}] {job['id']} {status}, retrying ({attempt}/{self.retries})")
+            pending.appendleft((job, attempt + 1))
+        else:
+            self._record(dict(job, status=status, attempts=attempt))
+            print(f"[slot {slot}] {job['id']} {status}, giving up")
+
+    def run(self, jobs):
+        done = self.completed()
+        pending = deque((job, 1) for job in jobs if job['id'] not in done)
+        running = {}
+        ctx = multiprocessing.get_context('spawn')
+        try:
+            while pending or running:
+                for slot in range(self.workers):
+                    if slot not in running and pending:
+                        job, attempt = pending.popleft()
+                        port = self.config['base_port'] + slot
+                        server = launch_server(self.config, port, job['track'], job['car'])
+                        proc = ctx.Process(target=run_job, args=(job, slot, self.config), daemon=True)
+                        proc.start()
+                        running[slot] = (proc, server, job, attempt, time.time())
+
+                for slot, (proc, server, job, attempt, started) in list(running.items()):
+                    if proc.is_alive():
+                        if time.time() - started > self.job_timeout:
+                            proc.terminate()
+                            proc.join()
+                            stop_server(server)
+                            del running[slot]
+                            self._finish(job, slot, attempt, 'timeout', pending)
+                        continue
+                    proc.join()
+                    stop_server(server)
+                    del running[slot]
+                    self._finish(job, slot, attempt, 'ok' if proc.exitcode == 0 else f'exit {proc.exitcode}', pending)
+                time.sleep(0.2)
+        except KeyboardInterrupt:
+            # Completed jobs are already in results.jsonl; rerun to resume
+            print("Interrupted, stopping workers")
+            for proc, server, job, attempt, started in running.values():
+                proc.terminate()
+                proc.join()
+                stop_server(server)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run many headless client episodes in parallel.')
+    parser.add_argument('--tracks', nargs='+', required=True, help='Track names')
+    parser.add_argument('--cars', nargs='+', default=['Unknown'], help='Car names')
+    parser.add_argument('--repeats', type=int, default=1, help='Episodes per track/car pair')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Parallel workers (default: all cores)')
+    parser.add_argument('--basePort', type=int, default=3001, help='Port of slot 0; slot i uses basePort + i')
+    parser.add_argument('--backend', choices=['server', 'replay', 'sim'], default='server',
+                        help='Real servers, log replay or the kinematic simulator')
+    parser.add_argument('--serverCmd', default=None,
+                        help='Command to launch a server per job, with {port}, {track} and {car} placeholders')
+    parser.add_argument('--replayLog', default=None, help='Sensor log served by the replay backend')
+    parser.add_argument('--laps', type=int, default=1, help='Laps per episode with the sim backend')
+    parser.add_argument('--driver', choices=pyclient.DRIVERS, default='rule', help='Driver to run')
+    parser.add_argument('--episodes', type=int, default=1, help='Episodes per job')
+    parser.add_argument('--maxSteps', type=int, default=0, help='Steps per episode (default: unlimited)')
+    parser.add_argument('--sink', action='append', dest='sinks', default=[], choices=sorted(telemetry_sinks.SINKS),
+                        help='Telemetry sink per job, may be repeated (default: none, lap results only)')
+    parser.add_argument('--retries', type=int, default=2, help='Retries per failed job')
+    parser.add_argument('--timeout', type=float, default=3600.0, help='Seconds before a job is killed')
+    parser.add_argument('--connectTimeout', type=float, default=30.0,
+                        help='Seconds a client waits for its server before the attempt fails, 0 to wait forever')
+    parser.add_argument('--out', default='fleet_runs', help='Output directory for telemetry and results')
+    arguments = parser.parse_args()
+
+    if arguments.backend == 'replay' and arguments.replayLog is None:
+        parser.error('--backend replay needs --replayLog')
+
+    config = {
+        'out': arguments.out,
+        'base_port': arguments.basePort,
+        'backend': arguments.backend,
+        'server_cmd': arguments.serverCmd,
+        'replay_log': arguments.replayLog,
+        'laps': arguments.laps,
+        'driver': arguments.driver,
+        'episodes': arguments.episodes,
+        'max_steps': arguments.maxSteps,
+        'connect_timeout': arguments.connectTimeout,
+        'sinks': list(dict.fromkeys(arguments.sinks)),
+    }
+    runner = FleetRunner(config, arguments.workers, arguments.retries, arguments.timeout)
+    runner.run(make_jobs(arguments.tracks, arguments.cars, arguments.repeats))
+    print(f"Results in {runner.results_path}")
+
+
+if __name__ == "__main__":
+    main()
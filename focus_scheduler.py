@@ -0,0 +1,79 @@
+import math
+import numpy as np
+import track_geometry
+
+# The five focus range finders sit one degree apart around the requested direction
+OFFSETS = np.array([-2.0, -1.0, 0.0, 1.0, 2.0])
+MAX_FOCUS = 90.0
+KMH = 3.6
+
+# Refined free space as extra NN features, in this order
+FEATURE_NAMES = ['freeAngle', 'freeDist']
+
+
+def features(edges):
+    '''Free-space angle and distance in FEATURE_NAMES order; zeros off track'''
+    if edges is None:
+        return [0.0, 0.0]
+    return [float(edges.free_angle), float(edges.free_dist)]
+
+
+class FocusScheduler(object):
+    '''
+    Aims the focus range finders and folds their readings into the track edges.
+
+    The server answers a focus request at most once per second of game
+    time, returning -1 in between, and the answer arrives on the tick after
+    the request. So a direction is sent every tick and the server decides
+    when to answer. The aim is the free-space direction, where the visible
+    track ends and the next corner begins, which is where the 5 to 15
+    degree spacing of the track range finders is coarsest. A reading is
+    kept for max_age ticks with its distance shortened by the distance
+    driven since, and refine() substitutes it for the free-space estimate
+    while both still point within tolerance degrees of each other.
+    '''
+
+    def __init__(self, max_age=50, tolerance=3.0, dt=0.02):
+        '''Constructor, dt is the server's tick in seconds'''
+        self.max_age = max_age
+        self.tolerance = math.radians(tolerance)
+        self.dt = dt
+        self.readings = 0
+        self.reset()
+
+    def reset(self):
+        self.sent = None
+        self.angle = None
+        self.dist = None
+        self.age = 0
+
+    def update(self, focus, speed_x):
+        '''Take this tick's focus readings, the answer to the previous request'''
+        if self.angle is not None:
+            self.age += 1
+            self.dist -= max(speed_x or 0.0, 0.0) / KMH * self.dt
+            if self.age > self.max_age or self.dist <= 0.0:
+                self.angle = None
+        if focus is None or self.sent is None or len(focus) != len(OFFSETS) or min(focus) < 0:
+            return
+        d = np.minimum(np.asarray(focus, dtype=float), track_geometry.MAX_RANGE)
+        # Ties (all saturated) resolve toward the requested direction
+        best = int(np.argmax(d - 1e-6 * np.abs(OFFSETS)))
+        self.angle = math.radians(self.sent + OFFSETS[best])
+        self.dist = float(d[best])
+        self.age = 0
+        self.readings += 1
+
+    def refine(self, edges):
+        '''Track edges with the free space taken from a fresh focus reading'''
+        if edges is None or self.angle is None or abs(self.angle - edges.free_angle) > self.tolerance:
+            return edges
+        curvature = 2.0 * math.sin(self.angle) / max(self.dist, 1.0)
+        return track_geometry.TrackEdges(edges.points, curvature, self.angle, self.dist, edges.width)
+
+    def aim(self, edges):
+        '''Focus direction in whole degrees to request with this tick's reply'''
+        angle = math.degrees(edges.free_angle) if edges is not None else 0.0
+        limit = MAX_FOCUS - OFFSETS[-1]
+        self.sent = int(round(max(-limit, min(limit, angle))))
+        return self.sent
@@ -0,0 +1,98 @@
+import numpy as np
+
+KEEP = 0
+UP = 1
+DOWN = -1
+
+
+class Gearbox(object):
+    '''
+    Table-driven gear selection for one car profile.
+
+    A shift table indexed by [gear, rpm band] holds the wanted shift, using
+    separate up and down rpm thresholds for hysteresis. Per-gear speed
+    limits then veto shifts that would land outside the usable rpm range of
+    the next gear. A shift is only made once the same request has held for
+    debounce_ticks, and never sooner than min_shift_interval ticks after the
+    previous one.
+    '''
+
+    def __init__(self, profile, band_size=250, debounce_ticks=3, min_shift_interval=25):
+        '''Constructor'''
+        self.profile = profile
+        self.gears = profile['gears']
+        self.band_size = band_size
+        self.debounce_ticks = debounce_ticks
+        self.min_shift_interval = min_shift_interval
+
+        self.kmh_per_rpm = np.array([0.0] + list(profile['kmh_per_krpm'])) / 1000.0
+        self.table = self._build_table()
+        self.up_min_speed, self.down_max_speed = self._build_speed_limits()
+
+        self.pending = KEEP
+        self.pending_ticks = 0
+        self.ticks_since_shift = min_shift_interval
+
+    def _build_table(self):
+        n_bands = int(self.profile['rpm_redline'] / self.band_size) + 2
+        rpm = (np.arange(n_bands) + 0.5) * self.band_size
+        table = np.zeros((self.gears + 1, n_bands), dtype=np.int8)
+        table[1:, rpm >= self.profile['rpm_shift_up']] = UP
+        table[1:, rpm < self.profile['rpm_shift_down']] = DOWN
+        table[1, :][table[1, :] == DOWN] = KEEP
+        table[self.gears, :][table[self.gears, :] == UP] = KEEP
+        return table
+
+    def _build_speed_limits(self):
+        up_min = np.full(self.gears + 1, np.inf)
+        down_max = np.zeros(self.gears + 1)
+        for g in range(1, self.gears + 1):
+            if g < self.gears:
+                # After an upshift the engine must stay above the down threshold
+                up_min[g] = self.profile['rpm_shift_down'] * self.kmh_per_rpm[g + 1]
+            if g > 1:
+                # After a downshift the engine must stay below the up threshold
+                down_max[g] = self.profile['rpm_shift_up'] * self.kmh_per_rpm[g - 1]
+        return up_min, down_max
+
+    def reset(self):
+        self.pending = KEEP
+        self.pending_ticks = 0
+        self.ticks_since_shift = self.min_shift_interval
+
+    def lookup(self, gear, rpm, speed):
+        '''Shift wanted by the table for this gear, rpm and speed, without state'''
+        if gear < 1 or gear > self.gears:
+            return KEEP
+        band = min(int(rpm / self.band_size), self.table.shape[1] - 1)
+        want = int(self.table[gear, band])
+        if want == UP and speed < self.up_min_speed[gear]:
+            return KEEP
+        if want == DOWN and speed > self.down_max_speed[gear]:
+            return KEEP
+        return want
+
+    def select(self, gear, rpm, speed):
+        '''Return the gear to command this tick'''
+        self.ticks_since_shift += 1
+        if gear is None or rpm is None:
+            return 1
+        # Neutral at the start, or reverse left over from a recovery
+        if gear < 1:
+            return 1
+
+        want = self.lookup(gear, rpm, speed or 0.0)
+        if want != self.pending:
+            self.pending = want
+            self.pending_ticks = 0
+        self.pending_ticks += 1
+
+        if want == KEEP or self.pending_ticks < self.debounce_ticks:
+            return gear
+        if self.ticks_since_shift < self.min_shift_interval:
+            return gear
+
+        self.ticks_since_shift = 0
+        self.pending = KEEP
+        self.pending_ticks = 0
+        return gear + want
@@ -0,0 +1,83 @@
+import argparse
+import numpy as np
+import car_profiles
+import gearbox
+import telemetry_archive
+
+
+def legacy_shift(gear, rpm, prev_rpm):
+    '''The original Driver.gear rule, including prev_rpm never being updated'''
+    if prev_rpm is None:
+        up = True
+    else:
+        up = (prev_rpm - rpm) < 0
+    if up and rpm > 7000:
+        gear += 1
+    if not up and rpm < 3000:
+        gear -= 1
+    return gear
+
+
+def replay(speeds, profile, controller):
+    '''
+    Drive the recorded speed trace through a gear controller.
+
+    The recorded rpm only holds for the recorded gear, so engine speed is
+    re-derived from speedX and the profile's km/h per rpm for whichever gear
+    the controller has selected.
+    '''
+    kmh_per_rpm = np.array(profile['kmh_per_krpm']) / 1000.0
+    gears = profile['gears']
+    gear = 1
+    rpms = np.empty(len(speeds))
+    shifts = 0
+    for i, speed in enumerate(speeds):
+        rpm = max(abs(speed) / kmh_per_rpm[gear - 1], profile['rpm_idle'])
+        rpm = min(rpm, profile['rpm_redline'])
+        rpms[i] = rpm
+        new_gear = max(1, min(gears, controller(gear, rpm, speed)))
+        if new_gear != gear:
+            shifts += 1
+            gear = new_gear
+    return rpms, shifts
+
+
+def summarise(name, rpms, shifts, profile):
+    lo, hi = profile['rpm_optimal']
+    return {
+        'controller': name,
+        'optimal_rpm_pct': 100.0 * np.mean((rpms >= lo) & (rpms <= hi)),
+        'redline_pct': 100.0 * np.mean(rpms >= profile['rpm_redline']),
+        'mean_rpm': float(np.mean(rpms)),
+        'shifts': shifts,
+    }
+
+
+def benchmark(paths, car_name):
+    profile = car_profiles.get_profile(car_name)
+    speeds = np.concatenate([telemetry_archive.read_table(p, usecols=['speedX'])['speedX'].to_numpy(dtype=float) for p in paths])
+    speeds = speeds[~np.isnan(speeds)]
+
+    results = []
+    rpms, shifts = replay(speeds, profile, lambda gear, rpm, speed: legacy_shift(gear, rpm, None))
+    results.append(summarise('legacy', rpms, shifts, profile))
+
+    box = gearbox.Gearbox(profile)
+    rpms, shifts = replay(speeds, profile, box.select)
+    results.append(summarise('gearbox', rpms, shifts, profile))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare gear controllers on replayed telemetry.')
+    parser.add_argument('logs', nargs='+', help='sensor_log_*.csv files with a speedX column')
+    parser.add_argument('--car', default='default', help='Car profile name')
+    arguments = parser.parse_args()
+
+    print(f"{'controller':<10} {'optimal %':>10} {'redline %':>10} {'mean rpm':>10} {'shifts':>7}")
+    for r in benchmark(arguments.logs, arguments.car):
+        print(f"{r['controller']:<10} {r['optimal_rpm_pct']:>10.1f} {r['redline_pct']:>10.1f} {r['mean_rpm']:>10.0f} {r['shifts']:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,10 @@
-import pandas as pd
+import telemetry_schema
 
-# Load the cleaned dataset
+# Read only the header of the cleaned dataset
 cleaned_data_path = 'logs/cleaned_telemetry_data.csv'
-cleaned_data = pd.read_csv(cleaned_data_path)
 
 # Get the column names
-column_names = cleaned_data.columns.tolist()
+column_names = telemetry_schema.columns(cleaned_data_path)
 
 # Print the column names
 print("Column names in the cleaned dataset:")
@@ -0,0 +1,205 @@
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+
+try:
+    import pygame
+except ImportError:
+    pygame = None
+
+# gear_up/gear_down are running counts of presses, so a reader that misses
+# a snapshot still sees every shift request exactly once
+InputSnapshot = namedtuple('InputSnapshot', ['time', 'steer', 'accel', 'brake', 'gear_up', 'gear_down', 'inputs'])
+
+EMPTY_SNAPSHOT = InputSnapshot(0.0, 0.0, 0.0, 0.0, 0, 0, frozenset())
+
+
+def approach(value, target, max_step):
+    '''Move value toward target by at most max_step'''
+    if target > value:
+        return min(target, value + max_step)
+    return max(target, value - max_step)
+
+
+class InputSampler(threading.Thread):
+    '''
+    Polls keyboard or joystick on its own thread and publishes snapshots.
+
+    All pygame calls, including creating the window, happen on this thread,
+    so the drive loop never waits on SDL. The latest InputSnapshot is
+    published by replacing a single attribute, which readers pick up
+    without locking. Keyboard steering, throttle and brake are rate limited
+    toward their digital targets and joystick axes are low-pass filtered, so
+    recorded demonstrations are smooth. One-shot keys (SPACE, ESC) are
+    counted like gear presses and appear in the first snapshot read after
+    the press, however briefly the key was down.
+
+    SDL only allows windows and event pumping on the main thread on macOS.
+    There, unless headless, nothing runs in the background: the window is
+    created by start() and each read() polls the devices once, on the
+    caller's thread, before returning the snapshot.
+    '''
+
+    def __init__(self, mode='kb', rate=250.0, steer_rate=4.0, steer_return_rate=6.0, pedal_rate=8.0, axis_time_constant=0.03, headless=False):
+        '''Constructor, rates in full-scale units per second'''
+        if pygame is None:
+            raise ImportError("pygame is required for the kb and controller control modes")
+        if headless and mode == 'kb':
+            raise ValueError("Keyboard input needs a focused window and cannot run headless")
+        super().__init__(name='InputSampler', daemon=True)
+        self.mode = mode
+        self.period = 1.0 / rate
+        self.steer_rate = steer_rate
+        self.steer_return_rate = steer_return_rate
+        self.pedal_rate = pedal_rate
+        self.axis_time_constant = axis_time_constant
+        self.headless = headless
+        self.threaded = headless or sys.platform != 'darwin'
+
+        self.snapshot = EMPTY_SNAPSHOT
+        self.presses = {}
+        self.seen = {}
+        self.joystick = None
+        self.joystick_name = None
+        self.quit_requested = False
+        self.error = None
+        self.ready = threading.Event()
+        self.running = True
+
+        self.steer = self.accel = self.brake = 0.0
+        self.gear_up = self.gear_down = 0
+        self.last = None
+
+    def start(self):
+        '''Start polling and wait until pygame and the devices are set up'''
+        if not self.threaded:
+            self._setup()
+            return
+        super().start()
+        self.ready.wait()
+        if self.error is not None:
+            raise self.error
+
+    def read(self):
+        '''Latest published snapshot, with one-shot keys pressed since the last read'''
+        if not self.threaded:
+            self._poll()
+        # presses is replaced, never modified, so a press is seen exactly once
+        snapshot, presses = self.snapshot, self.presses
+        fresh = [key for key, count in presses.items() if count > self.seen.get(key, 0)]
+        self.seen = presses
+        if fresh:
+            snapshot = snapshot._replace(inputs=snapshot.inputs | frozenset(fresh))
+        return snapshot
+
+    def stop(self):
+        self.running = False
+        if not self.threaded:
+            pygame.quit()
+        elif self.is_alive():
+            self.join(timeout=1.0)
+
+    def _setup(self):
+        if self.headless:
+            # Joysticks work without a window; keep SDL off the display
+            os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        pygame.init()
+        if not self.headless:
+            pygame.display.set_mode((400, 300))  # Always needed for key/controller
+            pygame.display.set_caption("TORCS Control")
+        if self.mode == 'controller':
+            pygame.joystick.init()
+            if pygame.joystick.get_count() > 0:
+                self.joystick = pygame.joystick.Joystick(0)
+                self.joystick.init()
+                self.joystick_name = self.joystick.get_name()
+            elif self.headless:
+                raise ValueError("No controller detected, and keyboard input cannot run headless")
+            else:
+                self.mode = 'kb'
+
+    def run(self):
+        try:
+            self._setup()
+        except Exception as e:
+            self.error = e
+            return
+        finally:
+            self.ready.set()
+
+        while self.running:
+            now = self._poll()
+            time.sleep(max(0.0, self.period - (time.perf_counter() - now)))
+
+        pygame.quit()
+
+    def _poll(self):
+        '''Pump events, update the filtered inputs and publish a snapshot'''
+        now = time.perf_counter()
+        dt = now - self.last if self.last is not None else 0.0
+        self.last = now
+        steer, accel, brake = self.steer, self.accel, self.brake
+        inputs = set()
+        pressed = []
+
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                self.quit_requested = True
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_x:
+                    self.gear_up += 1
+                elif event.key == pygame.K_z:
+                    self.gear_down += 1
+                elif event.key == pygame.K_SPACE:
+                    pressed.append('SPACE')
+                elif event.key == pygame.K_ESCAPE:
+                    pressed.append('ESC')
+            elif event.type == pygame.JOYBUTTONDOWN:
+                if event.button == 0:
+                    self.gear_up += 1
+                elif event.button == 1:
+                    self.gear_down += 1
+
+        if self.joystick is not None:
+            alpha = min(1.0, dt / self.axis_time_constant)
+            # Triggers report -1 released to 1 pressed; normalise to 0-1
+            steer += alpha * (-self.joystick.get_axis(0) - steer)
+            accel += alpha * ((self.joystick.get_axis(5) + 1) / 2 - accel)
+            brake += alpha * ((self.joystick.get_axis(4) + 1) / 2 - brake)
+            if abs(steer) > 0.1:
+                inputs.add(f'STEER_{steer:.2f}')
+            if accel > 0.1:
+                inputs.add(f'ACCEL_{accel:.2f}')
+            if brake > 0.1:
+                inputs.add(f'BRAKE_{brake:.2f}')
+        else:
+            keys = pygame.key.get_pressed()
+            if keys[pygame.K_LEFT]:
+                steer = approach(steer, 1.0, self.steer_rate * dt)
+                inputs.add('LEFT')
+            elif keys[pygame.K_RIGHT]:
+                steer = approach(steer, -1.0, self.steer_rate * dt)
+                inputs.add('RIGHT')
+            else:
+                steer = approach(steer, 0.0, self.steer_return_rate * dt)
+            if keys[pygame.K_UP]:
+                inputs.add('UP')
+            if keys[pygame.K_DOWN]:
+                inputs.add('DOWN')
+            accel = approach(accel, 1.0 if keys[pygame.K_UP] and not keys[pygame.K_DOWN] else 0.0, self.pedal_rate * dt)
+            brake = approach(brake, 1.0 if keys[pygame.K_DOWN] else 0.0, self.pedal_rate * dt)
+            if keys[pygame.K_z]:
+                inputs.add('Z')
+            if keys[pygame.K_x]:
+                inputs.add('X')
+
+        self.steer, self.accel, self.brake = steer, accel, brake
+        if pressed:
+            presses = dict(self.presses)
+            for key in pressed:
+                presses[key] = presses.get(key, 0) + 1
+            self.presses = presses
+        self.snapshot = InputSnapshot(now, steer, accel, brake, self.gear_up, self.gear_down, frozenset(inputs))
+        return now
@@ -0,0 +1,107 @@
+import struct
+import numpy as np
+from input_sampler import InputSnapshot, EMPTY_SNAPSHOT
+
+MAGIC = b'TRCI'
+VERSION = 1
+HEADER = struct.Struct('<4sHH')
+
+# One record per drive tick: time, steer, accel, brake, gear press counts
+# and a bit set of the keys that were down
+RECORD = np.dtype([
+    ('time', '<f8'),
+    ('steer', '<f4'),
+    ('accel', '<f4'),
+    ('brake', '<f4'),
+    ('gear_up', '<u4'),
+    ('gear_down', '<u4'),
+    ('keys', '<u2'),
+])
+
+KEY_NAMES = ['LEFT', 'RIGHT', 'UP', 'DOWN', 'Z', 'X', 'SPACE', 'ESC']
+KEY_BITS = {name: 1 << i for i, name in enumerate(KEY_NAMES)}
+
+
+def encode_keys(inputs):
+    bits = 0
+    for name in inputs:
+        bits |= KEY_BITS.get(name, 0)
+    return bits
+
+
+def decode_keys(bits):
+    return frozenset(name for name, bit in KEY_BITS.items() if bits & bit)
+
+
+class TraceRecorder(object):
+    '''Appends InputSnapshots to a compact binary trace, one per tick'''
+
+    def __init__(self, path):
+        '''Constructor'''
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, RECORD.itemsize))
+        self.record = np.zeros(1, dtype=RECORD)
+        self.start = None
+
+    def write(self, snapshot):
+        if self.start is None:
+            self.start = snapshot.time
+        r = self.record[0]
+        r['time'] = snapshot.time - self.start
+        r['steer'] = snapshot.steer
+        r['accel'] = snapshot.accel
+        r['brake'] = snapshot.brake
+        r['gear_up'] = snapshot.gear_up
+        r['gear_down'] = snapshot.gear_down
+        r['keys'] = encode_keys(snapshot.inputs)
+        self.file.write(self.record.tobytes())
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+def read_trace(path):
+    '''Load a whole trace as a structured NumPy array'''
+    with open(path, 'rb') as file:
+        magic, version, itemsize = HEADER.unpack(file.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"Not an input trace: {path}")
+        if version != VERSION or itemsize != RECORD.itemsize:
+            raise ValueError(f"Unsupported input trace version {version} in {path}")
+        return np.frombuffer(file.read(), dtype=RECORD)
+
+
+class ReplaySampler(object):
+    '''
+    Stand-in for InputSampler that plays back a recorded trace.
+
+    Each read() returns the next tick's snapshot, so replaying through
+    Driver.drive reproduces the recorded inputs tick for tick without
+    pygame or a display. After the end of the trace the inputs are
+    released and finished is set.
+    '''
+
+    def __init__(self, path):
+        '''Constructor'''
+        self.records = read_trace(path)
+        self.index = 0
+        self.finished = len(self.records) == 0
+        self.joystick_name = None
+        self.quit_requested = False
+        self.last = EMPTY_SNAPSHOT
+
+    def read(self):
+        if self.index >= len(self.records):
+            self.finished = True
+            self.last = self.last._replace(steer=0.0, accel=0.0, brake=0.0, inputs=frozenset())
+            return self.last
+        r = self.records[self.index]
+        self.index += 1
+        self.last = InputSnapshot(float(r['time']), float(r['steer']), float(r['accel']), float(r['brake']),
+                                  int(r['gear_up']), int(r['gear_down']), decode_keys(int(r['keys'])))
+        return self.last
+
+    def stop(self):
+        pass
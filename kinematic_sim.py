@@ -0,0 +1,458 @@
+'''
+Approximate vehicle and track simulator for fast offline rollouts.
+
+Cars are kinematic bicycles with a grip limit, driven through the same
+CarControl messages the TORCS server takes, and they report CarState
+sensor strings that the drivers parse unchanged. Every array holds one
+entry per car, so a single step moves a whole population. The physics is
+deliberately crude: it is for screening models and controller changes
+before spending real simulator time, not for lap-time predictions.
+
+Tracks are closed chains of straights and constant-radius arcs. Their
+edges are lines and circles, so the range finders are exact ray
+intersections instead of marched samples.
+'''
+import argparse
+import socket
+
+import numpy as np
+
+import car_profiles
+import msgParser
+import track_geometry
+
+MAX_RANGE = track_geometry.MAX_RANGE
+GRAVITY = 9.81
+# Focus range finders: five rays one degree apart, answered once a second
+FOCUS_OFFSETS = np.array([-2.0, -1.0, 0.0, 1.0, 2.0])
+FOCUS_PERIOD = 1.0
+
+# Segments are ('straight', length) or ('arc', radius, degrees), with
+# positive degrees turning left. Each preset closes on itself.
+TRACKS = {
+    'oval': [('straight', 400.0), ('arc', 100.0, 180.0), ('straight', 400.0), ('arc', 100.0, 180.0)],
+    'circuit': [('straight', 600.0), ('arc', 60.0, 90.0), ('straight', 250.0), ('arc', 40.0, 90.0),
+                ('straight', 100.0), ('arc', 150.0, -30.0), ('arc', 150.0, 30.0), ('straight', 340.0),
+                ('arc', 80.0, 90.0), ('straight', 260.19238), ('arc', 50.0, 90.0)],
+}
+
+
+def _wrap(a):
+    return (a + np.pi) % (2 * np.pi) - np.pi
+
+
+class Track(object):
+    '''
+    Centre line of straights and arcs, laid out from the origin heading
+    along +x, with a constant width and walls a little way outside it.
+    '''
+
+    def __init__(self, segments, width=12.0, wall=3.0, name=None):
+        '''Constructor'''
+        self.name = name
+        self.width = width
+        self.half = width / 2.0
+        self.wall = wall
+        straights, arcs = [], []
+        pos, heading, station = np.zeros(2), 0.0, 0.0
+        for segment in segments:
+            direction = np.array([np.cos(heading), np.sin(heading)])
+            if segment[0] == 'straight':
+                length = segment[1]
+                straights.append((pos[0], pos[1], direction[0], direction[1], length, station))
+                pos = pos + length * direction
+            else:
+                radius, sweep = segment[1], np.radians(segment[2])
+                if abs(sweep) > np.pi:
+                    raise ValueError("Split arcs of more than 180 degrees into two segments")
+                turn = np.sign(sweep)
+                left = np.array([-direction[1], direction[0]])
+                centre = pos + turn * radius * left
+                phi0 = np.arctan2(pos[1] - centre[1], pos[0] - centre[0])
+                length = radius * abs(sweep)
+                arcs.append((centre[0], centre[1], radius, phi0, turn, abs(sweep), station))
+                heading += sweep
+                pos = centre + radius * np.array([np.cos(phi0 + sweep), np.sin(phi0 + sweep)])
+            station += length
+        if np.hypot(*pos) > 0.5:
+            raise ValueError(f"Track does not close: ends {np.hypot(*pos):.2f} m from the start")
+        self.length = station
+
+        s = np.array(straights, dtype=float).reshape(-1, 6)
+        self.p0, self.d, self.seg_len, self.s_start = s[:, 0:2], s[:, 2:4], s[:, 4], s[:, 5]
+        self.seg_heading = np.arctan2(self.d[:, 1], self.d[:, 0])
+        a = np.array(arcs, dtype=float).reshape(-1, 7)
+        self.centre, self.radius, self.phi0 = a[:, 0:2], a[:, 2], a[:, 3]
+        self.turn, self.sweep, self.a_start = a[:, 4], a[:, 5], a[:, 6]
+
+        # Edges: each straight gives two lines, each arc two circles
+        normal = np.stack((-self.d[:, 1], self.d[:, 0]), axis=1)
+        self.line_a = np.concatenate((self.p0 + self.half * normal, self.p0 - self.half * normal))
+        self.line_d = np.concatenate((self.d, self.d))
+        self.line_len = np.concatenate((self.seg_len, self.seg_len))
+        self.circle_c = np.concatenate((self.centre, self.centre))
+        self.circle_r = np.concatenate((self.radius - self.half, self.radius + self.half))
+        self.circle_phi0 = np.concatenate((self.phi0, self.phi0))
+        self.circle_turn = np.concatenate((self.turn, self.turn))
+        self.circle_start = np.cos(self.circle_phi0), np.sin(self.circle_phi0)
+        end = self.circle_phi0 + self.circle_turn * np.concatenate((self.sweep, self.sweep))
+        self.circle_end = np.cos(end), np.sin(end)
+
+    @classmethod
+    def preset(cls, name, width=12.0):
+        if name not in TRACKS:
+            raise ValueError(f"Simulated track must be one of {sorted(TRACKS)}")
+        return cls(TRACKS[name], width=width, name=name)
+
+    def locate(self, pos):
+        '''
+        Project car positions (n, 2) onto the centre line.
+
+        Returns station along the track, lateral offset (positive left) and
+        the track heading at the projected point.
+        '''
+        px, py = pos[:, 0, None], pos[:, 1, None]
+
+        # Straights
+        dx, dy = self.d[:, 0], self.d[:, 1]
+        rx, ry = px - self.p0[:, 0], py - self.p0[:, 1]
+        t = np.clip(rx * dx + ry * dy, 0.0, self.seg_len)
+        dist_s = np.hypot(rx - t * dx, ry - t * dy)
+        lat_s = dx * ry - dy * rx
+        station_s = self.s_start + t
+        heading_s = np.broadcast_to(self.seg_heading, t.shape)
+
+        # Arcs: clamp the angle to the nearer end of the sweep
+        vx, vy = px - self.centre[:, 0], py - self.centre[:, 1]
+        r = np.hypot(vx, vy)
+        delta = ((np.arctan2(vy, vx) - self.phi0) * self.turn) % (2 * np.pi)
+        beyond = delta > self.sweep
+        delta = np.where(beyond, np.where(delta > (self.sweep + np.pi), 0.0, self.sweep), delta)
+        phi = self.phi0 + self.turn * delta
+        dist_a = np.hypot(vx - self.radius * np.cos(phi), vy - self.radius * np.sin(phi))
+        lat_a = self.turn * (self.radius - r)
+        station_a = self.a_start + self.radius * delta
+        heading_a = phi + self.turn * np.pi / 2
+
+        dist = np.concatenate((dist_s, dist_a), axis=1)
+        pick = np.argmin(dist, axis=1)[:, None]
+        take = lambda a, b: np.take_along_axis(np.concatenate((a, b), axis=1), pick, axis=1)[:, 0]
+        return take(station_s, station_a) % self.length, take(lat_s, lat_a), take(heading_s, heading_a)
+
+    def rangefinders(self, pos, headings):
+        '''
+        Exact distance to the nearest edge along each ray.
+
+        headings is (n, k) world ray directions; the result is (n, k) and
+        capped at the sensor range.
+        '''
+        # Work on separate x and y arrays shaped (car, ray, edge)
+        ux, uy = np.cos(headings)[..., None], np.sin(headings)[..., None]
+        ox, oy = pos[:, 0, None, None], pos[:, 1, None, None]
+        best = np.full(headings.shape, MAX_RANGE)
+
+        # Lines: solve o + t*u = a + s*d
+        dx, dy = self.line_d[:, 0], self.line_d[:, 1]
+        wx, wy = self.line_a[:, 0] - ox, self.line_a[:, 1] - oy
+        denom = ux * dy - uy * dx
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (wx * dy - wy * dx) / denom
+            s = (wx * uy - wy * ux) / denom
+        ok = (np.abs(denom) > 1e-9) & (t > 1e-6) & (s >= 0.0) & (s <= self.line_len)
+        best = np.minimum(best, np.where(ok, t, MAX_RANGE).min(axis=2))
+
+        # Circles: |o + t*u - c| = r, with the hit inside the arc's sweep
+        cx, cy = ox - self.circle_c[:, 0], oy - self.circle_c[:, 1]
+        b = ux * cx + uy * cy
+        disc = b * b - (cx * cx + cy * cy - self.circle_r ** 2)
+        root = np.sqrt(np.maximum(disc, 0.0))
+        (s0x, s0y), (s1x, s1y), turn = self.circle_start, self.circle_end, self.circle_turn
+        for t in (-b - root, -b + root):
+            # Arcs span at most half a turn, so the hit lies within the sweep
+            # when it is past the start radius and short of the end radius
+            hx, hy = cx + t * ux, cy + t * uy
+            inside = (turn * (s0x * hy - s0y * hx) >= -1e-9) & (turn * (hx * s1y - hy * s1x) >= -1e-9)
+            ok = (disc >= 0.0) & (t > 1e-6) & inside
+            best = np.minimum(best, np.where(ok, t, MAX_RANGE).min(axis=2))
+        return best
+
+
+class KinematicSim(object):
+    '''
+    n cars on one track, each stepped as a grip-limited kinematic bicycle.
+
+    Speeds are stored in m/s and reported in km/h like the server. Gear
+    ratios, redline and wheel radii come from the car profile, so the
+    gearbox and traction control see plausible rpm and wheel spin. Focus
+    requests are answered like the server's: on the next tick, at most
+    once per FOCUS_PERIOD, and with -1 otherwise.
+    '''
+
+    def __init__(self, track, n_cars=1, angles=None, car_name=None, dt=0.02, steer_lock=0.366,
+                 wheelbase=2.6, grip=1.2, downforce=0.005, max_accel=10.0, max_brake=12.0, top_speed=85.0):
+        '''Constructor, angles are the range finder angles in degrees from the init string'''
+        self.track = Track.preset(track) if isinstance(track, str) else track
+        self.n = n_cars
+        self.angles = np.radians(np.asarray(angles if angles is not None else track_geometry.default_angles(), dtype=float))
+        self.profile = car_profiles.get_profile(car_name)
+        self.ratios = np.asarray(self.profile['kmh_per_krpm'], dtype=float)
+        self.wheel_radius = np.asarray(self.profile['wheel_radius'], dtype=float)
+        self.rear_drive = self.profile['drive'] != 'fwd'
+        self.dt = dt
+        self.steer_lock = steer_lock
+        self.wheelbase = wheelbase
+        self.grip = grip * GRAVITY
+        self.downforce = downforce
+        self.max_accel = max_accel
+        self.max_brake = max_brake
+        # Drag that balances top-gear thrust at top_speed
+        self.drag = max_accel * self.ratios[0] / self.ratios[-1] / top_speed ** 2
+        self.parser = msgParser.MsgParser()
+        self.template = self._template(len(self.angles))
+        self.reset()
+
+    def reset(self, cars=None):
+        '''Put cars (default: all) back on the start line, at rest'''
+        if cars is None:
+            cars = np.arange(self.n)
+            z = lambda: np.zeros(self.n)
+            self.pos = np.zeros((self.n, 2))
+            self.heading, self.v, self.vy, self.damage = z(), z(), z(), z()
+            self.dist_raced, self.cur_lap_time, self.last_lap_time = z(), z(), z()
+            self.off_track_ticks = np.zeros(self.n, dtype=int)
+            self.laps = np.zeros(self.n, dtype=int)
+            self.gear = np.zeros(self.n, dtype=int)
+            self.wheel_slip = np.zeros((self.n, 4))
+            self.focus = np.full(self.n, np.nan)
+            self.focus_wait = np.zeros(self.n, dtype=int)
+            self.focus_ranges = np.full((self.n, len(FOCUS_OFFSETS)), -1.0)
+        for name in ('heading', 'v', 'vy', 'damage', 'dist_raced', 'cur_lap_time', 'last_lap_time',
+                     'off_track_ticks', 'laps', 'gear'):
+            getattr(self, name)[cars] = 0
+        self.pos[cars] = 0.0
+        self.wheel_slip[cars] = 0.0
+        self.focus[cars] = np.nan
+        self.focus_wait[cars] = 0
+        self.focus_ranges[cars] = -1.0
+        self.station, self.lateral, self.track_heading = self.track.locate(self.pos)
+
+    def rpm(self):
+        gear = np.clip(np.abs(self.gear), 1, len(self.ratios))
+        rpm = np.abs(self.v) * 3.6 / self.ratios[gear - 1] * 1000.0
+        rpm = np.where(self.gear == 0, self.profile['rpm_idle'], rpm)
+        return np.maximum(rpm, self.profile['rpm_idle'])
+
+    def step(self, accel, brake, steer, gear):
+        '''Advance every car one tick under the given control arrays'''
+        dt = self.dt
+        accel = np.clip(accel, 0.0, 1.0)
+        brake = np.clip(brake, 0.0, 1.0)
+        steer = np.clip(steer, -1.0, 1.0)
+        self.gear = np.clip(np.asarray(gear, dtype=int), -1, len(self.ratios))
+
+        off_track = np.abs(self.lateral) > self.track.half
+        grip = self.grip + self.downforce * self.v ** 2
+        grip = np.where(off_track, 0.5 * grip, grip)
+
+        # Longitudinal: engine thrust falls with gear and is cut at redline
+        idx = np.clip(np.abs(self.gear), 1, len(self.ratios)) - 1
+        thrust = accel * self.max_accel * self.ratios[0] / self.ratios[idx]
+        thrust = np.where((self.gear == 0) | (self.rpm() >= self.profile['rpm_redline']), 0.0, thrust)
+        thrust = np.where(self.gear < 0, -thrust, thrust)
+        spin = np.maximum(np.abs(thrust) - grip, 0.0) / grip
+        thrust = np.clip(thrust, -grip, grip)
+        lock = np.maximum(brake * self.max_brake - grip, 0.0) / grip
+        retard = np.minimum(brake * self.max_brake, grip) + self.drag * self.v ** 2 + 0.1 + off_track * 3.0
+        v = self.v + thrust * dt
+        self.v = np.where(np.abs(v) <= retard * dt, 0.0, v - np.sign(v) * retard * dt)
+
+        # Lateral: the bicycle's path curvature, limited by grip
+        curvature = np.tan(steer * self.steer_lock) / self.wheelbase
+        limit = grip / np.maximum(self.v ** 2, 1e-3)
+        slide = np.maximum(np.abs(curvature) - limit, 0.0) * np.sign(curvature)
+        curvature = curvature - slide
+        self.vy = -0.2 * slide * self.v ** 2
+        self.heading = _wrap(self.heading + self.v * curvature * dt)
+        c, s = np.cos(self.heading), np.sin(self.heading)
+        self.pos += np.stack((self.v * c - self.vy * s, self.v * s + self.vy * c), axis=1) * dt
+
+        # Wheels: drive wheels spin under excess thrust, all lock under excess brake
+        driven = np.array([0, 0, 1, 1]) if self.rear_drive else np.array([1, 1, 0, 0])
+        self.wheel_slip = spin[:, None] * driven - np.minimum(lock, 1.0)[:, None]
+
+        # Progress, laps and walls
+        station, lateral, track_heading = self.track.locate(self.pos)
+        progress = (station - self.station + self.track.length / 2) % self.track.length - self.track.length / 2
+        self.dist_raced += progress
+        crossed = (progress > 0) & (station < self.station)
+        self.cur_lap_time += dt
+        self.last_lap_time = np.where(crossed, self.cur_lap_time, self.last_lap_time)
+        self.cur_lap_time = np.where(crossed, 0.0, self.cur_lap_time)
+        self.laps += crossed
+
+        wall = self.track.half + self.track.wall
+        hit = np.abs(lateral) > wall
+        if hit.any():
+            # Lose the speed into the wall and scrape along it
+            relative = self.heading - track_heading
+            self.damage += np.where(hit, 20.0 * np.abs(self.v * np.sin(relative)), 0.0)
+            self.v = np.where(hit, 0.8 * self.v * np.cos(relative), self.v)
+            self.heading = np.where(hit, track_heading, self.heading)
+            back = np.sign(lateral) * (np.abs(lateral) - wall)
+            left = np.stack((-np.sin(track_heading), np.cos(track_heading)), axis=1)
+            self.pos -= np.where(hit, back, 0.0)[:, None] * left
+            station, lateral, track_heading = self.track.locate(self.pos)
+        self.station, self.lateral, self.track_heading = station, lateral, track_heading
+        self.off_track_ticks += np.abs(lateral) > self.track.half
+        self._focus()
+
+    def _focus(self):
+        '''Answer the focus requests of cars that are on track and not rate limited'''
+        self.focus_wait -= 1
+        self.focus_ranges[:] = -1.0
+        ready = (np.abs(self.focus) <= 90.0) & (self.focus_wait <= 0) & (np.abs(self.lateral) <= self.track.half)
+        if ready.any():
+            cars = np.flatnonzero(ready)
+            headings = self.heading[cars, None] - np.radians(self.focus[cars, None] + FOCUS_OFFSETS)
+            self.focus_ranges[cars] = self.track.rangefinders(self.pos[cars], headings)
+            self.focus_wait[cars] = int(round(FOCUS_PERIOD / self.dt))
+
+    def sensors(self):
+        '''Sensor arrays for every car, in server units'''
+        track_pos = self.lateral / self.track.half
+        ranges = self.track.rangefinders(self.pos, self.heading[:, None] - self.angles[None])
+        ranges[np.abs(track_pos) > 1.0] = -1.0
+        speed = self.v[:, None] * (1.0 + self.wheel_slip)
+        return {
+            'angle': _wrap(self.track_heading - self.heading),
+            'curLapTime': self.cur_lap_time,
+            'damage': self.damage,
+            'distFromStart': self.station,
+            'distRaced': self.dist_raced,
+            'focus': self.focus_ranges,
+            'gear': self.gear,
+            'lastLapTime': self.last_lap_time,
+            'rpm': self.rpm(),
+            'speedX': self.v * 3.6,
+            'speedY': self.vy * 3.6,
+            'track': ranges,
+            'trackPos': track_pos,
+            'wheelSpinVel': speed / self.wheel_radius,
+        }
+
+    def _template(self, n_track):
+        '''printf template of a sensor message, in the server's field order'''
+        parts = {
+            'angle': '%.6f', 'curLapTime': '%.3f', 'damage': '%.0f', 'distFromStart': '%.3f',
+            'distRaced': '%.3f', 'fuel': '94', 'gear': '%d', 'lastLapTime': '%.3f',
+            'opponents': ' '.join(['200'] * 36), 'racePos': '1', 'rpm': '%.2f', 'speedX': '%.4f',
+            'speedY': '%.4f', 'speedZ': '0', 'track': ' '.join(['%.4f'] * n_track), 'trackPos': '%.6f',
+            'wheelSpinVel': '%.4f %.4f %.4f %.4f', 'z': '0.345', 'focus': ' '.join(['%.4f'] * len(FOCUS_OFFSETS)),
+        }
+        return ''.join(f'({k} {v})' for k, v in parts.items())
+
+    def messages(self):
+        '''One CarState sensor string per car'''
+        sensors = self.sensors()
+        columns = np.column_stack([
+            sensors['angle'], sensors['curLapTime'], sensors['damage'], sensors['distFromStart'],
+            sensors['distRaced'], sensors['gear'], sensors['lastLapTime'], sensors['rpm'], sensors['speedX'],
+            sensors['speedY'], sensors['track'], sensors['trackPos'], sensors['wheelSpinVel'], sensors['focus'],
+        ])
+        template = self.template
+        return [template % tuple(row) for row in columns.tolist()]
+
+    def apply(self, replies):
+        '''
+        Step every car with its CarControl reply string.
+
+        Returns the indices of cars that asked for a restart with meta 1;
+        the caller decides whether to reset or retire them.
+        '''
+        accel, brake, steer, gear, restart = (np.zeros(self.n) for _ in range(5))
+        focus = np.full(self.n, np.nan)
+        for i, reply in enumerate(replies):
+            control = self.parser.parse(reply)
+            accel[i] = float(control['accel'][0]) if 'accel' in control else 0.0
+            brake[i] = float(control['brake'][0]) if 'brake' in control else 0.0
+            steer[i] = float(control['steer'][0]) if 'steer' in control else 0.0
+            gear[i] = int(float(control['gear'][0])) if 'gear' in control else self.gear[i]
+            focus[i] = float(control['focus'][0]) if 'focus' in control else np.nan
+            restart[i] = 'meta' in control and float(control['meta'][0]) == 1
+        self.focus = focus
+        self.step(accel, brake, steer, gear)
+        return np.flatnonzero(restart)
+
+
+class SimServer(object):
+    '''
+    Serves one simulated car over the TORCS UDP protocol.
+
+    The range finder angles are taken from the client's init string.
+    An episode ends after max_ticks ticks or laps laps, or when the
+    client sends meta 1, with ***restart*** between episodes and
+    ***shutdown*** after the last.
+    '''
+
+    def __init__(self, port, track='circuit', car_name=None, host='localhost', episodes=1, laps=1,
+                 max_ticks=50000, timeout=5.0):
+        '''Constructor'''
+        self.track = Track.preset(track) if isinstance(track, str) else track
+        self.car_name = car_name
+        self.episodes = episodes
+        self.laps = laps
+        self.max_ticks = max_ticks
+        self.parser = msgParser.MsgParser()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.sock.settimeout(timeout)
+        self.ticks = 0
+
+    def _identify(self):
+        while True:
+            data, addr = self.sock.recvfrom(1000)
+            if b'(init' in data:
+                self.sock.sendto(b'***identified***', addr)
+                angles = [float(a) for a in self.parser.parse(data)['init']]
+                return addr, angles
+
+    def serve(self):
+        try:
+            for episode in range(self.episodes):
+                addr, angles = self._identify()
+                sim = KinematicSim(self.track, 1, angles, self.car_name)
+                for tick in range(self.max_ticks):
+                    self.sock.sendto(sim.messages()[0].encode(), addr)
+                    # Let the client see the finished lap before ending
+                    if sim.laps[0] >= self.laps:
+                        break
+                    reply, _ = self.sock.recvfrom(1000)
+                    self.ticks += 1
+                    if len(sim.apply([reply])):
+                        break
+                last = episode == self.episodes - 1
+                self.sock.sendto(b'***shutdown***' if last else b'***restart***', addr)
+        except socket.timeout:
+            print("Sim server: client went away")
+        finally:
+            self.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a kinematic stand-in simulator over the TORCS protocol.')
+    parser.add_argument('--port', type=int, default=3001, help='UDP port (default: 3001)')
+    parser.add_argument('--track', choices=sorted(TRACKS), default='circuit', help='Track layout')
+    parser.add_argument('--car', default=None, help='Car profile name')
+    parser.add_argument('--episodes', type=int, default=1, help='Number of episodes (default: 1)')
+    parser.add_argument('--laps', type=int, default=1, help='Laps per episode (default: 1)')
+    parser.add_argument('--maxTicks', type=int, default=50000, help='Tick limit per episode')
+    arguments = parser.parse_args()
+
+    server = SimServer(arguments.port, arguments.track, arguments.car, episodes=arguments.episodes,
+                       laps=arguments.laps, max_ticks=arguments.maxTicks)
+    server.serve()
+    print(f"Simulation complete, {server.ticks} ticks served")
+
+
+if __name__ == "__main__":
+    main()
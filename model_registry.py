@@ -0,0 +1,139 @@
+'''
+Per-track and per-car model selection with a process-wide cache.
+
+A registry JSON lists model/scaler pairs for (track, car) combinations,
+where either may be '*':
+
+    {"entries": [
+        {"track": "g-track-1", "car": "car1-trb1", "model": "models/g1_trb1.pkl", "scaler": "models/g1_scaler.pkl"},
+        {"track": "*", "car": "car1-trb1", "model": "models/trb1.pkl", "scaler": "models/trb1_scaler.pkl"}
+    ]}
+
+Paths are relative to the registry file. Lookups fall back from the
+exact pair to the track, then the car, then '*'/'*', then the registry's
+defaults. Loaded models are compiled to a plain NumPy forward pass and
+kept in an LRU shared by every driver in the process, so restarts and
+extra cars never unpickle the same file twice.
+'''
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import joblib
+import numpy as np
+
+CAPACITY = 8
+
+ACTIVATIONS = {
+    'identity': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0.0, out=x),
+    'tanh': lambda x: np.tanh(x, out=x),
+    'logistic': lambda x: 1.0 / (1.0 + np.exp(-x)),
+}
+
+
+def _flush(a):
+    a = np.array(a, dtype=np.float64, order='C')
+    a[np.abs(a) < np.finfo(np.float64).tiny] = 0.0
+    return a
+
+
+class CompiledModel(object):
+    '''
+    An MLPRegressor and its StandardScaler folded into NumPy arrays.
+
+    predict() takes raw, unscaled features and returns what
+    model.predict(scaler.transform(x)) would, without sklearn's per-call
+    validation. Weights that L2 decay has shrunk to subnormal floats are
+    flushed to zero: they change no output, but each one sends the
+    matrix products down a slow path in the CPU. The sklearn objects are
+    kept for anything else that needs them.
+    '''
+
+    def __init__(self, model, scaler):
+        '''Constructor'''
+        self.model = model
+        self.scaler = scaler
+        self.mean = np.asarray(scaler.mean_, dtype=np.float64)
+        self.scale = np.asarray(scaler.scale_, dtype=np.float64)
+        self.weights = [_flush(w) for w in model.coefs_]
+        self.biases = [_flush(b) for b in model.intercepts_]
+        self.hidden = ACTIVATIONS[model.activation]
+        self.output = ACTIVATIONS[model.out_activation_]
+
+    def predict(self, features):
+        x = (features - self.mean) / self.scale
+        last = len(self.weights) - 1
+        for i, (w, b) in enumerate(zip(self.weights, self.biases)):
+            x = x @ w
+            x += b
+            x = self.output(x) if i == last else self.hidden(x)
+        return x
+
+
+_lock = threading.Lock()
+_loaded = OrderedDict()
+_prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='model-prefetch')
+
+
+def _key(model_path, scaler_path):
+    # Keyed by modification time too, so a retrained file is picked up
+    paths = (os.path.abspath(model_path), os.path.abspath(scaler_path))
+    return paths + tuple(os.stat(p).st_mtime_ns for p in paths)
+
+
+def load(model_path, scaler_path):
+    '''CompiledModel for the pair, from the process-wide LRU when possible'''
+    key = _key(model_path, scaler_path)
+    with _lock:
+        if key in _loaded:
+            _loaded.move_to_end(key)
+            return _loaded[key]
+    compiled = CompiledModel(joblib.load(model_path), joblib.load(scaler_path))
+    with _lock:
+        _loaded[key] = compiled
+        _loaded.move_to_end(key)
+        while len(_loaded) > CAPACITY:
+            _loaded.popitem(last=False)
+    return compiled
+
+
+def prefetch(model_path, scaler_path):
+    '''Load the pair on a background thread; returns a Future of the model'''
+    return _prefetcher.submit(load, model_path, scaler_path)
+
+
+def clear():
+    with _lock:
+        _loaded.clear()
+
+
+class ModelRegistry(object):
+    '''Maps (track, car) to model and scaler files, with fallbacks'''
+
+    def __init__(self, path=None, default_model='models/nn_model.pkl', default_scaler='models/nn_scaler.pkl'):
+        '''Constructor, path is a registry JSON; without one only the defaults are known'''
+        self.path = path
+        self.entries = {}
+        self.default = (default_model, default_scaler)
+        if path is not None:
+            with open(path) as file:
+                registry = json.load(file)
+            base = os.path.dirname(os.path.abspath(path))
+            for entry in registry.get('entries', []):
+                files = tuple(os.path.join(base, entry[k]) for k in ('model', 'scaler'))
+                self.entries[(entry.get('track', '*'), entry.get('car', '*'))] = files
+
+    def resolve(self, track, car):
+        for key in ((track, car), (track, '*'), ('*', car), ('*', '*')):
+            if key in self.entries:
+                return self.entries[key]
+        return self.default
+
+    def load(self, track, car):
+        return load(*self.resolve(track, car))
+
+    def prefetch(self, track, car):
+        return prefetch(*self.resolve(track, car))
@@ -1,8 +1,23 @@
+import re
+
+# One (name values...) group of a message, matched straight off a buffer
+GROUP = re.compile(rb'\((\S+) ([^)]*)\)')
+
+# Byte keys of every sensor and control, mapped to interned str keys
+KEYS = {name.encode(): name for name in [
+    'angle', 'curLapTime', 'damage', 'distFromStart', 'distRaced', 'focus', 'fuel', 'gear', 'lastLapTime',
+    'opponents', 'racePos', 'rpm', 'speedX', 'speedY', 'speedZ', 'track', 'trackPos', 'wheelSpinVel', 'z',
+    'accel', 'brake', 'clutch', 'steer', 'meta', 'init',
+]}
+
+
 class MsgParser:
     def __init__(self):
         pass
 
     def parse(self, str_sensors):
+        if not isinstance(str_sensors, str):
+            return self.parse_bytes(str_sensors)
         sensors = {}
         b_open = str_sensors.find('(')
 
@@ -17,6 +32,20 @@ class MsgParser:
                 b_open = str_sensors.find('(', b_close)
         return sensors
 
+    def parse_bytes(self, data):
+        '''
+        Parse a message held in bytes, a bytearray or a memoryview of one,
+        without decoding it. Values stay as bytes, which float() and int()
+        accept directly.
+        '''
+        sensors = {}
+        for match in GROUP.finditer(data):
+            values = match.group(2).split()
+            if values:
+                key = match.group(1)
+                sensors[KEYS.get(key) or key.decode()] = values
+        return sensors
+
     def stringify(self, dictionary):
         msg = ''
         for key, value in dictionary.items():
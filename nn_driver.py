@@ -6,8 +6,16 @@ from sklearn.metrics import mean_squared_error, r2_score
 from sklearn.neural_network import MLPRegressor
 import os
 import joblib
+import opponents
+import realtime
+import action_cache
+import model_registry
+import focus_scheduler
 from driver import Driver
 
+# track_0..18, trackPos, angle, speedX, speedY, speedZ, rpm, gear
+BASE_FEATURES = 26
+
 def load_and_preprocess_data():
     # Create models directory if it doesn't exist
     os.makedirs('models', exist_ok=True)
@@ -104,54 +112,87 @@ def evaluate_model(model, X_test, y_test):
     return metrics
 
 class NNDriver(Driver):
-    def __init__(self, stage, model_path="models/nn_model.pkl", scaler_path="models/nn_scaler.pkl"):
-        super().__init__(stage)
-        self.model = self._load_model(model_path)
-        self.scaler = self._load_scaler(scaler_path)
+    def __init__(self, stage, model_path="models/nn_model.pkl", scaler_path="models/nn_scaler.pkl", car_name=None,
+                 deadline=0.010, cache_resolution=None, cache_max_error=0.05, cache_validate_every=50,
+                 registry=None, **kwargs):
+        super().__init__(stage, car_name=car_name, **kwargs)
+        self.cache_resolution = cache_resolution
+        self.cache_max_error = cache_max_error
+        self.cache_validate_every = cache_validate_every
+        self.action_cache = None
+        
+        # With a registry the model follows the track and car; models come
+        # compiled from a cache shared by every driver in the process
+        self.registry = registry
+        self.pending_model = None
+        if registry is not None:
+            model_path, scaler_path = registry.resolve(self.track_name, car_name)
+        self.set_model(self._load(model_path, scaler_path))
         self.last_gear = 1  # Start in first gear
         self.initialized = False
+        
+        # Prediction runs under a per-tick deadline; a missed one is
+        # answered by the rule-based driver from the same CarState
+        self.inference = realtime.DeadlineExecutor(deadline)
 
-    def _load_model(self, model_path):
+    def _load(self, model_path, scaler_path):
         try:
-            return joblib.load(model_path)
+            return model_registry.load(model_path, scaler_path)
         except Exception as e:
             print(f"Error loading model: {e}")
             return None
 
-    def _load_scaler(self, scaler_path):
-        try:
-            return joblib.load(scaler_path)
-        except Exception as e:
-            print(f"Error loading scaler: {e}")
-            return None
+    def set_model(self, compiled):
+        '''Drive with a CompiledModel from now on; None falls back to rules'''
+        self.compiled = compiled
+        self.model = compiled.model if compiled is not None else None
+        self.scaler = compiled.scaler if compiled is not None else None
+        # Models trained on logs with the refined free space or the opponent
+        # features take them as extra inputs, in that order
+        extra = compiled.mean.size - BASE_FEATURES if compiled is not None else 0
+        n_focus, n_opponents = len(focus_scheduler.FEATURE_NAMES), len(opponents.FEATURE_NAMES)
+        self.use_focus = extra in (n_focus, n_focus + n_opponents)
+        self.use_opponents = extra in (n_opponents, n_focus + n_opponents)
+        
+        # Optional cache of actions for near-identical feature vectors
+        self.action_cache = None
+        if self.cache_resolution and compiled is not None:
+            self.action_cache = action_cache.ActionCache(self.cache_resolution, validate_every=self.cache_validate_every,
+                                                         max_error=self.cache_max_error,
+                                                         mean=compiled.mean, scale=compiled.scale)
+
+    def set_track(self, track_name):
+        '''Switch track between episodes; the next model loads in the background'''
+        super().set_track(track_name)
+        if self.registry is not None:
+            self.pending_model = self.registry.prefetch(track_name, self.car_name)
 
     def parse_sensors(self, msg):
-        """Parse the sensor message from TORCS"""
+        """Parse the sensor message from TORCS, given as str or bytes"""
+        sensors = self.parser.parse(msg)
         state = {}
-        parts = msg.strip('()').split(')(')
-        
-        for part in parts:
-            if part.startswith('angle'):
-                state['angle'] = float(part.split(' ')[1])
-            elif part.startswith('track '):
-                track_values = part.split(' ')[1:]
-                state['track'] = [float(x) for x in track_values]
-            elif part.startswith('trackPos'):
-                state['trackPos'] = float(part.split(' ')[1])
-            elif part.startswith('speedX'):
-                state['speedX'] = float(part.split(' ')[1])
-            elif part.startswith('speedY'):
-                state['speedY'] = float(part.split(' ')[1])
-            elif part.startswith('speedZ'):
-                state['speedZ'] = float(part.split(' ')[1])
-            elif part.startswith('rpm'):
-                state['rpm'] = float(part.split(' ')[1])
-            elif part.startswith('gear'):
-                state['gear'] = int(part.split(' ')[1])
+        for name in ('angle', 'trackPos', 'speedX', 'speedY', 'speedZ', 'rpm'):
+            if name in sensors:
+                state[name] = float(sensors[name][0])
+        if 'gear' in sensors:
+            state['gear'] = int(sensors['gear'][0])
+        for name in ('track', 'wheelSpinVel', 'focus', 'opponents'):
+            if name in sensors:
+                state[name] = [float(x) for x in sensors[name]]
         
         return state
 
-    def _prepare_state(self, state):
+    def capture(self, msg, reply):
+        '''Fill state and control for the sinks; only runs when logging'''
+        self.state.setFromMsg(msg)
+        actions = self.parser.parse(reply)
+        for name, setter in (('accel', self.control.setAccel), ('brake', self.control.setBrake), ('steer', self.control.setSteer)):
+            if name in actions:
+                setter(float(actions[name][0]))
+        if 'gear' in actions:
+            self.control.setGear(int(actions['gear'][0]))
+
+    def _features(self, state):
         # Extract features in the same order as training
         features = []
         
@@ -172,9 +213,16 @@ class NNDriver(Driver):
             state.get('rpm', 0.0),
             state.get('gear', 1)
         ])
+        if self.use_focus:
+            features.extend(focus_scheduler.features(self.edges))
+        if self.use_opponents:
+            features.extend(opponents.tick_features(state.get('opponents')))
         
         # Convert to numpy array and reshape
-        features = np.array(features).reshape(1, -1)
+        return np.array(features).reshape(1, -1)
+
+    def _prepare_state(self, state):
+        features = self._features(state)
         
         # Scale features
         if self.scaler is not None:
@@ -182,36 +230,89 @@ class NNDriver(Driver):
         
         return features
 
+    def _predict(self, features):
+        return self.compiled.predict(features)[0]
+
+    def _rule_action(self, msg, sensed=False):
+        '''Steer, gear and speed from the rule-based Driver for this tick'''
+        self.state.setFromMsg(msg)
+        if not sensed:
+            self.sense(self.state.track, self.state.focus, self.state.speedX)
+        self.opponent_view = opponents.view(self.state.opponents)
+        self.steer()
+        self.gear()
+        self.speed()
+        accel, brake = self.traction.apply(self.control.getAccel(), self.control.getBrake(), self.state.getSpeedX(), self.state.getWheelSpinVel())
+        self.control.setAccel(accel)
+        self.control.setBrake(brake)
+        self.last_gear = self.control.getGear()
+        return self.control.toMsg()
+
     def drive(self, msg):
-        if self.model is None or self.scaler is None:
-            return '(accel 0) (brake 0) (steer 0) (gear 1)'
+        # Normally loaded during the restart handshake already; until it
+        # is, keep driving with the current model rather than wait on it
+        if self.pending_model is not None and self.pending_model.done():
+            try:
+                self.set_model(self.pending_model.result())
+            except Exception as e:
+                print(f"Error loading model for {self.track_name}, keeping the current one: {e}")
+            self.pending_model = None
+        if self.compiled is None:
+            self.inference.stats['no_model'] += 1
+            return self._rule_action(msg)
         
         # Parse the message
         state = self.parse_sensors(msg)
+        self.sense(state.get('track'), state.get('focus'), state.get('speedX'))
+        focus = self.control.getFocus()
         
         # Initialize gear if not done
         if not self.initialized:
             self.last_gear = 1
             self.initialized = True
-            return f'(accel 0.5) (brake 0) (steer 0) (gear 1)'
+            return f'(accel 0.5) (brake 0) (steer 0) (gear 1) (focus {focus})'
+        
+        # Stuck, off track or facing backwards: reverse out instead
+        angle, track_pos = state.get('angle'), state.get('trackPos')
+        if self.recovery.update(angle, track_pos, state.get('speedX')):
+            self.recovery.apply(self.control, angle, track_pos)
+            return self.control.toMsg()
         
         # Prepare state for prediction
-        features = self._prepare_state(state)
+        features = self._features(state)
         
-        # Get prediction
-        prediction = self.model.predict(features)[0]
+        # Reuse the action of a near-identical tick where the cache has one
+        prediction = self.action_cache.get(features[0]) if self.action_cache is not None else None
+        if prediction is None:
+            # Get prediction, or drive by the rules if it misses the deadline
+            on_time, prediction = self.inference.run(self._predict, features)
+            if not on_time:
+                return self._rule_action(msg, sensed=True)
+            if self.action_cache is not None:
+                self.action_cache.put(prediction)
         
         # Extract control values in the same order as training targets
         acceleration = float(prediction[0])  # accel
         braking = float(prediction[1])      # brake
         steering = float(prediction[2])     # steer
-        gear = int(prediction[3])           # gear
         
-        # Ensure gear is within valid range
-        gear = max(1, min(6, gear))
+        # Traction control and ABS
+        acceleration, braking = self.traction.apply(acceleration, braking, state.get('speedX'), state.get('wheelSpinVel'))
+        
+        # The gear output is a regression value, so leave shifting to the
+        # table-driven gearbox and only use the state the model saw
+        gear = self.gearbox.select(state.get('gear', self.last_gear), state.get('rpm', 0.0), state.get('speedX', 0.0))
+        self.last_gear = gear
         
         # Create control string
-        return f'(accel {acceleration:.3f}) (brake {braking:.3f}) (steer {steering:.3f}) (gear {gear})'
+        return f'(accel {acceleration:.3f}) (brake {braking:.3f}) (steer {steering:.3f}) (gear {gear}) (focus {focus})'
+
+    def onShutDown(self):
+        print(f"Inference: {self.inference.summary()}, {self.inference.stats['no_model']} ticks without a model")
+        if self.action_cache is not None:
+            print(f"Action cache: {self.action_cache.summary()}")
+        self.inference.close()
+        super().onShutDown()
 
 def main():
     # Load and preprocess data
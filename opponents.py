@@ -0,0 +1,79 @@
+import numpy as np
+
+# Opponent sensors report 200 m when nothing is in range
+MAX_RANGE = 200.0
+N_SECTORS = 36
+
+FEATURE_NAMES = ['oppNearestDist', 'oppNearestAngle', 'oppFrontDist', 'oppLeftGap', 'oppRightGap']
+
+# Sectors are 10 degrees wide and sweep clockwise from -180 degrees, so
+# sector i is centred on -175 + 10 i and negative angles are on the left
+SECTOR_ANGLES = np.radians(-175.0 + 10.0 * np.arange(N_SECTORS))
+FRONT = np.flatnonzero(np.abs(SECTOR_ANGLES) < np.radians(30))
+LEFT = np.flatnonzero((SECTOR_ANGLES < 0) & (SECTOR_ANGLES > np.radians(-120)))
+RIGHT = np.flatnonzero((SECTOR_ANGLES > 0) & (SECTOR_ANGLES < np.radians(120)))
+
+FEATURE_SCALE = np.array([MAX_RANGE, np.pi, MAX_RANGE, MAX_RANGE, MAX_RANGE])
+
+
+class OpponentView(object):
+    '''Nearest threat and free gaps around the car for one tick'''
+
+    def __init__(self, nearest_dist, nearest_angle, front_dist, left_gap, right_gap):
+        self.nearest_dist = nearest_dist
+        self.nearest_angle = nearest_angle
+        self.front_dist = front_dist
+        self.left_gap = left_gap
+        self.right_gap = right_gap
+
+    def pass_side(self):
+        '''+1 to pass on the left (positive trackPos), -1 on the right'''
+        return 1 if self.left_gap >= self.right_gap else -1
+
+    def features(self):
+        return np.array([self.nearest_dist, self.nearest_angle, self.front_dist, self.left_gap, self.right_gap]) / FEATURE_SCALE
+
+
+def view(opponents):
+    '''Summarise one tick of the 36 opponent readings, or None if missing'''
+    if opponents is None or len(opponents) != N_SECTORS:
+        return None
+    d = np.asarray(opponents, dtype=float)
+    nearest = int(np.argmin(d))
+    return OpponentView(
+        float(d[nearest]),
+        float(SECTOR_ANGLES[nearest]),
+        float(d[FRONT].min()),
+        float(d[LEFT].min()),
+        float(d[RIGHT].min())
+    )
+
+
+def features(opponents):
+    '''Feature matrix (m, 5) in FEATURE_NAMES order for a batch of readings'''
+    d = np.atleast_2d(np.asarray(opponents, dtype=float))
+    nearest = np.argmin(d, axis=1)
+    out = np.stack((
+        d[np.arange(len(d)), nearest],
+        SECTOR_ANGLES[nearest],
+        d[:, FRONT].min(axis=1),
+        d[:, LEFT].min(axis=1),
+        d[:, RIGHT].min(axis=1)
+    ), axis=1)
+    return out / FEATURE_SCALE
+
+
+# What every tick without opponent readings looks like: nothing in range
+NO_OPPONENT = features(np.full(N_SECTORS, MAX_RANGE))[0].tolist()
+
+
+def tick_features(opponents):
+    '''Features of one tick in FEATURE_NAMES order, as logged and fed to the NN'''
+    if opponents is None or len(opponents) != N_SECTORS:
+        return NO_OPPONENT
+    return features(opponents)[0].tolist()
+
+
+def frame_features(data):
+    '''Features for a logged DataFrame with opponent_0 .. opponent_35 columns'''
+    return features(data[[f'opponent_{i}' for i in range(N_SECTORS)]].to_numpy(dtype=float))
@@ -1,15 +1,66 @@
 import sys
 import argparse
 import socket
+import time
 import driver
+import realtime
+import telemetry_ring
+import telemetry_sinks
 import os
 from datetime import datetime
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='Python client to connect to the TORCS SCRC server.')
+DRIVERS = ['rule', 'nn']
 
-    sys.stdout = sys.stderr  # Force prints to show even if output is buffered
-    print("=== DEBUG: Script started ===")
+# Largest datagram accepted; a full-grid sensor message is about 1 kB
+BUFFER_SIZE = 4096
+# Windows reports a datagram larger than the buffer as this error
+WSAEMSGSIZE = 10040
+
+
+class Receiver(object):
+    '''
+    Receives datagrams into one preallocated buffer.
+
+    recv() returns a memoryview of the packet in the buffer, valid until
+    the next call, so the drive loop allocates no bytes or str per tick.
+    A datagram that did not fit is counted in truncated and returned as
+    None instead of being parsed as a silently shortened message.
+    '''
+
+    def __init__(self, sock, size=BUFFER_SIZE):
+        '''Constructor'''
+        self.sock = sock
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.packets = 0
+        self.truncated = 0
+        self.use_recvmsg = hasattr(sock, 'recvmsg_into')
+
+    def recv(self):
+        if self.use_recvmsg:
+            nbytes, _, flags, _ = self.sock.recvmsg_into([self.view])
+            cut = flags & socket.MSG_TRUNC
+        else:
+            try:
+                nbytes = self.sock.recv_into(self.view)
+                cut = False
+            except OSError as e:
+                if getattr(e, 'winerror', None) != WSAEMSGSIZE:
+                    raise
+                nbytes, cut = len(self.buffer), True
+        self.packets += 1
+        if cut:
+            self.truncated += 1
+            return None
+        return self.view[:nbytes]
+
+    def contains(self, packet, token):
+        '''Whether a control token such as b'***shutdown***' is in the packet'''
+        return self.buffer.find(token, 0, len(packet)) >= 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Python client to connect to the TORCS SCRC server.')
 
     parser.add_argument('--host', action='store', dest='host_ip', default='localhost',
                         help='Host IP address (default: localhost)')
@@ -21,6 +72,8 @@ if __name__ == '__main__':
                         help='Maximum number of learning episodes (default: 1)')
     parser.add_argument('--maxSteps', action='store', dest='max_steps', type=int, default=0,
                         help='Maximum number of steps (default: 0)')
+    parser.add_argument('--connectTimeout', action='store', dest='connect_timeout', type=float, default=0.0,
+                        help='Seconds to wait for the server to identify the client, 0 to wait forever (default: 0)')
     parser.add_argument('--track', action='store', dest='track', default='Unknown',
                         help='Name of the track')
     parser.add_argument('--car', action='store', dest='car', default='Unknown',
@@ -29,18 +82,80 @@ if __name__ == '__main__':
                         help='Stage (0 - Warm-Up, 1 - Qualifying, 2 - Race, 3 - Unknown)')
     parser.add_argument('--logdir', action='store', dest='logdir', default='logs',
                         help='Directory to store log files (default: logs)')
+    parser.add_argument('--driver', action='store', dest='driver', default='rule', choices=DRIVERS,
+                        help='Driver: rule-based or neural network (default: rule)')
+    parser.add_argument('--control', action='store', dest='control_mode', default='ai',
+                        choices=['ai', 'kb', 'controller', 'replay'],
+                        help='Control mode (default: ai)')
+    parser.add_argument('--model', action='store', dest='model_path', default='models/nn_model.pkl',
+                        help='Model file for the nn driver')
+    parser.add_argument('--scaler', action='store', dest='scaler_path', default='models/nn_scaler.pkl',
+                        help='Scaler file for the nn driver')
+    parser.add_argument('--deadline', action='store', dest='deadline', type=float, default=10.0,
+                        help='Inference deadline in ms before the nn driver falls back to rules, 0 to wait (default: 10)')
+    parser.add_argument('--actionCache', action='store', dest='cache_resolution', type=float, default=0.0,
+                        help='Cache nn actions on features quantised to this many standard deviations, 0 for off')
+    parser.add_argument('--actionCacheMaxError', action='store', dest='cache_max_error', type=float, default=0.05,
+                        help='Largest action error a validated cache hit may have before the cache is flushed (default: 0.05)')
+    parser.add_argument('--actionCacheValidate', action='store', dest='cache_validate_every', type=int, default=50,
+                        help='Check every Nth cache hit against the model (default: 50)')
+    parser.add_argument('--registry', action='store', dest='registry', default=None,
+                        help='Model registry JSON choosing the nn model by track and car')
+    parser.add_argument('--nextTracks', action='store', dest='next_tracks', nargs='*', default=[],
+                        help='Tracks of the episodes after the first, in order')
+    parser.add_argument('--inputTrace', action='store', dest='input_trace', default=None,
+                        help='Input trace to play back in replay control mode')
+    parser.add_argument('--recordInputs', action='store', dest='record_inputs', default=None,
+                        help='Record human inputs to this trace file')
+    parser.add_argument('--headless', action='store_true', dest='headless',
+                        help='Do not open a window for controller input')
+    parser.add_argument('--sink', action='append', dest='sinks', default=[],
+                        choices=sorted(telemetry_sinks.SINKS),
+                        help='Telemetry sink, may be repeated (default: none, logging off)')
+    parser.add_argument('--ringName', action='store', dest='ring_name', default=None,
+                        help='Shared-memory name of the ring sink (default: torcs_telemetry_<port>)')
+    parser.add_argument('--verbose', action='store_true', dest='verbose',
+                        help='Print every message sent and received')
+    return parser
 
-    arguments = parser.parse_args()
 
-    os.makedirs(arguments.logdir, exist_ok=True)
-    logfile = os.path.join(arguments.logdir, 'telemetry_data.csv')
+def make_driver(arguments, extra_sinks=None):
+    '''Build the selected driver with its telemetry sinks'''
+    ring_name = arguments.ring_name or telemetry_ring.ring_name(arguments.host_port)
+    sinks = telemetry_sinks.make_sinks(arguments.sinks, arguments.logdir, arguments.control_mode, ring_name)
+    sinks.extend(extra_sinks or [])
+    kwargs = dict(
+        track_name=arguments.track,
+        control_mode=arguments.control_mode,
+        input_trace_path=arguments.input_trace,
+        record_inputs=arguments.record_inputs,
+        headless=arguments.headless,
+        sinks=sinks
+    )
+    if arguments.driver == 'nn':
+        import nn_driver
+        import model_registry
+        registry = None
+        if arguments.registry:
+            registry = model_registry.ModelRegistry(arguments.registry, arguments.model_path, arguments.scaler_path)
+        return nn_driver.NNDriver(arguments.stage, arguments.model_path, arguments.scaler_path,
+                                  car_name=arguments.car, deadline=arguments.deadline / 1000.0 or None,
+                                  cache_resolution=arguments.cache_resolution, cache_max_error=arguments.cache_max_error,
+                                  cache_validate_every=arguments.cache_validate_every, registry=registry, **kwargs)
+    return driver.Driver(arguments.stage, car_name=arguments.car, **kwargs)
+
+
+def run(arguments, d=None):
+    '''Run the client loop until shutdown or max_episodes'''
+    verbose = arguments.verbose
 
     print('Connecting to server host ip:', arguments.host_ip, '@ port:', arguments.host_port)
     print('Bot ID:', arguments.id)
     print('Track:', arguments.track)
     print('Car:', arguments.car)
     print('Stage:', arguments.stage)
-    print('Log file:', logfile)
+    print('Driver:', arguments.driver, '/', arguments.control_mode)
+    print('Sinks:', ', '.join(arguments.sinks) if arguments.sinks else 'none', '@', arguments.logdir)
 
     try:
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -51,14 +166,27 @@ if __name__ == '__main__':
         sys.exit(-1)
 
     shutdownClient = False
+    serverShutdown = False
     curEpisode = 0
-    verbose = True
 
-    d = driver.Driver(arguments.stage, logfile, arguments.track, arguments.car)
+    if d is None:
+        d = make_driver(arguments)
+
+    receiver = Receiver(sock)
+    # Collector state is process-wide, so the client loop schedules it
+    scheduler = realtime.GC_SCHEDULER
+    scheduler.start()
 
     while not shutdownClient:
         print('Starting connection...')
+        connect_start = time.time()
         while True:
+            if arguments.connect_timeout and time.time() - connect_start > arguments.connect_timeout:
+                print(f"No server identified the client within {arguments.connect_timeout:g} s...Exiting...")
+                d.onShutDown()
+                scheduler.close()
+                sys.exit(-1)
+
             print('Sending ID to server: ', arguments.id)
             buf = arguments.id + d.init()
 
@@ -71,59 +199,100 @@ if __name__ == '__main__':
                 sys.exit(-1)
 
             try:
-                buf, addr = sock.recvfrom(1000)
-                buf = buf.decode()
-                print("Received data from server:", buf)
+                packet = receiver.recv()
+                print("Received data from server:", bytes(packet) if packet is not None else 'truncated packet')
             except socket.error as msg:
                 print("Did not get a response from server...")
                 print(f"Error: {msg}")
+                continue
 
-            if '***identified***' in buf:
-                print('Received: ', buf)
+            if packet is not None and receiver.contains(packet, b'***identified***'):
+                print('Received: ', bytes(packet))
                 break
 
         currentStep = 0
 
         while True:
+            # Closing the control window ends the session, even while the server is silent
+            if d.quit_requested:
+                d.onShutDown()
+                shutdownClient = True
+                serverShutdown = True
+                print('Control window closed, client shutdown')
+                break
+
             try:
-                buf, addr = sock.recvfrom(1000)
-                buf = buf.decode()
-                print("Received drive data: ", buf)
+                packet = receiver.recv()
             except socket.error:
                 print("No response... Retrying...")
                 continue
 
-            if buf and '***shutdown***' in buf:
+            # Never drive on a cut-off message; the server reuses the last controls
+            if packet is None:
+                print(f"Truncated packet dropped ({receiver.truncated} so far)")
+                continue
+            if verbose:
+                print("Received drive data: ", bytes(packet))
+
+            if receiver.contains(packet, b'***shutdown***'):
                 d.onShutDown()
                 shutdownClient = True
+                serverShutdown = True
                 print('Client Shutdown')
                 break
 
-            if buf and '***restart***' in buf:
+            if receiver.contains(packet, b'***restart***'):
                 d.onRestart()
+                # The next track's model loads while the server restarts
+                if curEpisode < len(arguments.next_tracks):
+                    d.set_track(arguments.next_tracks[curEpisode])
                 print('Client Restart')
                 break
 
             currentStep += 1
 
+            buf = None
             if currentStep != arguments.max_steps:
-                if buf:
-                    buf = d.drive(buf)
+                if len(packet):
+                    scheduler.tick()
+                    buf = d.drive(packet)
             else:
                 buf = '(meta 1)'
 
             if buf:
                 try:
                     sock.sendto(buf.encode(), (arguments.host_ip, arguments.host_port))
-                    print("Command sent to server.")
+                    if verbose:
+                        print("Command sent to server.")
                 except socket.error:
                     print('Failed to send data...Exiting...')
                     sys.exit(-1)
+                d.onIdle()
+                scheduler.idle()
 
         curEpisode += 1
 
         if curEpisode == arguments.max_episodes:
             shutdownClient = True
 
+    # Stopping at max_episodes still has to flush sinks and save maps
+    if not serverShutdown:
+        d.onShutDown()
+    scheduler.close()
+
     sock.close()
+    if receiver.truncated:
+        print(f"Dropped {receiver.truncated} of {receiver.packets} packets as truncated")
     print("Client shutdown complete")
+    return d
+
+
+if __name__ == '__main__':
+    parser = build_parser()
+
+    sys.stdout = sys.stderr  # Force prints to show even if output is buffered
+    print("=== DEBUG: Script started ===")
+
+    arguments = parser.parse_args()
+    os.makedirs(arguments.logdir, exist_ok=True)
+    run(arguments)
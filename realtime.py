@@ -0,0 +1,132 @@
+'''
+Helpers that keep the per-tick path inside the server's time budget.
+'''
+import gc
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+
+class DeadlineExecutor(object):
+    '''
+    Runs a call on a worker thread and waits at most deadline seconds.
+
+    run() returns (True, result) when the call finished in time and
+    (False, None) when it did not or raised. A call that overruns keeps
+    the worker busy, so later ticks give up straight away until it is done
+    instead of queueing behind it. With deadline None the call runs inline.
+    Outcomes are counted in stats.
+    '''
+
+    def __init__(self, deadline=0.010):
+        '''Constructor, deadline in seconds'''
+        self.deadline = deadline
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='inference') if deadline else None
+        self.pending = None
+        self.stats = Counter()
+        self.last_error = None
+
+    def run(self, fn, *args):
+        self.stats['calls'] += 1
+        try:
+            if self.executor is None:
+                result = fn(*args)
+            else:
+                if self.pending is not None and not self.pending.done():
+                    self.stats['busy'] += 1
+                    return False, None
+                self.pending = self.executor.submit(fn, *args)
+                result = self.pending.result(timeout=self.deadline)
+        except TimeoutError:
+            self.stats['late'] += 1
+            return False, None
+        except Exception as e:
+            if self.last_error is None:
+                print(f"Inference failed, falling back: {e}")
+            self.last_error = e
+            self.stats['error'] += 1
+            return False, None
+        self.stats['on_time'] += 1
+        return True, result
+
+    def summary(self):
+        missed = self.stats['late'] + self.stats['busy'] + self.stats['error']
+        return (f"{self.stats['calls']} calls, {missed} missed "
+                f"(late {self.stats['late']}, busy {self.stats['busy']}, error {self.stats['error']})")
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class GcScheduler(object):
+    '''
+    Keeps the cyclic garbage collector out of the tick.
+
+    Collector state is process-wide, so there is one scheduler per process,
+    GC_SCHEDULER, driven by the client loop rather than by drivers. start()
+    does one full collection and freezes everything allocated so far
+    (models, tables, modules) out of later collections; call it before
+    connecting, as a full pass can take tens of milliseconds. After warmup
+    ticks, whatever the first predictions allocated is frozen too and
+    automatic collection is switched off. idle(), called in the gap after
+    a reply is sent, then collects the young generation, the middle one
+    every full_every calls and all of them every oldest_every calls, so
+    cyclic garbage that reached the oldest generation is still freed.
+    Should idle() never be called, tick() still collects once limit
+    allocations have piled up. Every start() needs a close(); automatic
+    collection comes back on with the last one.
+    '''
+
+    def __init__(self, warmup_ticks=100, full_every=500, oldest_every=5000, young=700, limit=20000):
+        '''Constructor'''
+        self.warmup_ticks = warmup_ticks
+        self.full_every = full_every
+        self.oldest_every = oldest_every
+        self.young = young
+        self.limit = limit
+        self.users = 0
+        self.ticks = 0
+        self.idles = 0
+        self.active = False
+        self.collections = 0
+
+    def start(self):
+        self.users += 1
+        if self.users == 1:
+            gc.collect()
+            gc.freeze()
+
+    def tick(self):
+        self.ticks += 1
+        if not self.active:
+            if self.ticks == self.warmup_ticks:
+                gc.freeze()
+                gc.disable()
+                self.active = True
+        elif gc.get_count()[0] > self.limit:
+            gc.collect(0)
+            self.collections += 1
+
+    def idle(self):
+        if not self.active:
+            return
+        self.idles += 1
+        if self.idles % self.oldest_every == 0:
+            gc.collect()
+            self.collections += 1
+        elif self.idles % self.full_every == 0:
+            gc.collect(1)
+            self.collections += 1
+        elif gc.get_count()[0] > self.young:
+            gc.collect(0)
+            self.collections += 1
+
+    def close(self):
+        self.users = max(self.users - 1, 0)
+        if self.users == 0 and self.active:
+            gc.enable()
+            self.active = False
+            self.ticks = 0
+
+
+GC_SCHEDULER = GcScheduler()
@@ -0,0 +1,105 @@
+import math
+import numpy as np
+
+NORMAL = 0
+RECOVERING = 1
+FAILED = 2
+
+
+class Recovery(object):
+    '''
+    Stuck, off-track and wrong-way detection with a reverse-out maneuver.
+
+    The last few ticks of angle, trackPos and speedX are kept in a ring
+    buffer. When the whole window shows the car slow and either badly
+    misaligned or off the track, recovery takes over: reverse with the
+    wheels turned to swing the nose back toward the track axis (or drive
+    forward if the car already points back onto the track), until the car
+    is realigned. After max_attempts failed maneuvers a restart is
+    requested with (meta 1).
+    '''
+
+    def __init__(self, steer_lock, window=25, stuck_speed=5.0, stuck_angle=math.radians(45),
+                 max_recovery_ticks=250, max_attempts=3):
+        '''Constructor'''
+        self.steer_lock = steer_lock
+        self.window = window
+        self.stuck_speed = stuck_speed
+        self.stuck_angle = stuck_angle
+        self.max_recovery_ticks = max_recovery_ticks
+        self.max_attempts = max_attempts
+
+        # Columns: angle, trackPos, speedX
+        self.history = np.zeros((window, 3))
+        self.reset()
+
+    def reset(self):
+        self.history[:] = 0.0
+        self.filled = 0
+        self.pos = 0
+        self.mode = NORMAL
+        self.recovery_ticks = 0
+        self.attempts = 0
+
+    def _stuck(self):
+        if self.filled < self.window:
+            return False
+        h = self.history
+        slow = np.all(np.abs(h[:, 2]) < self.stuck_speed)
+        misaligned = np.all(np.abs(h[:, 0]) > self.stuck_angle)
+        off_track = np.all(np.abs(h[:, 1]) > 1.0)
+        # Facing the wrong way is a problem even at speed
+        backwards = np.all(np.abs(h[:, 0]) > math.pi / 2) and np.all(h[:, 2] > 0)
+        return (slow and (misaligned or off_track)) or backwards
+
+    def _realigned(self, angle, track_pos):
+        return abs(angle) < self.stuck_angle / 2 and abs(track_pos) < 0.9
+
+    def update(self, angle, track_pos, speed_x):
+        '''Record a tick; return True while recovery should drive the car'''
+        if angle is None or track_pos is None or speed_x is None:
+            return False
+        self.history[self.pos] = (angle, track_pos, speed_x)
+        self.pos = (self.pos + 1) % self.window
+        self.filled = min(self.filled + 1, self.window)
+
+        if self.mode == NORMAL:
+            if self._stuck():
+                self.mode = RECOVERING
+                self.recovery_ticks = 0
+        elif self.mode == RECOVERING:
+            self.recovery_ticks += 1
+            if self._realigned(angle, track_pos):
+                self.mode = NORMAL
+                self.attempts = 0
+                self.filled = 0
+            elif self.recovery_ticks > self.max_recovery_ticks:
+                self.attempts += 1
+                self.recovery_ticks = 0
+                if self.attempts >= self.max_attempts:
+                    self.mode = FAILED
+        return self.mode != NORMAL
+
+    def apply(self, control, angle, track_pos):
+        '''Write the recovery action for this tick into a CarControl'''
+        if self.mode == FAILED:
+            control.setAccel(0.0)
+            control.setBrake(1.0)
+            control.setMeta(1)
+            return
+
+        steer = -angle / self.steer_lock
+        gear = -1
+        # Nose already points back toward the track: drive out forwards
+        if angle * track_pos > 0:
+            gear = 1
+            steer = -steer
+        # Alternate direction on each failed attempt to unwedge the car
+        if self.attempts % 2 == 1:
+            gear = -gear
+            steer = -steer
+        control.setGear(gear)
+        control.setSteer(max(-1.0, min(1.0, steer)))
+        control.setAccel(0.5)
+        control.setBrake(0.0)
+        control.setClutch(0.0)
@@ -0,0 +1,98 @@
+import argparse
+import socket
+import pandas as pd
+import msgParser
+import telemetry_archive
+
+SENSORS = ['angle', 'curLapTime', 'damage', 'distFromStart', 'distRaced', 'fuel', 'gear', 'lastLapTime',
+           'racePos', 'rpm', 'speedX', 'speedY', 'speedZ', 'trackPos', 'z']
+ARRAYS = {'focus': 5, 'opponents': 36, 'track': 19, 'wheelSpinVel': 4}
+# The sensor log names opponent columns in the singular
+ARRAY_PREFIX = {'focus': 'focus', 'opponents': 'opponent', 'track': 'track', 'wheelSpinVel': 'wheelSpinVel'}
+
+
+def log_messages(path, episode=None, lap=None):
+    '''Rebuild the server's sensor messages from a sensor log CSV or archive'''
+    parser = msgParser.MsgParser()
+    data = telemetry_archive.read_table(path, episode=episode, lap=lap)
+    columns = set(data.columns)
+    messages = []
+    for row in data.itertuples(index=False):
+        row = row._asdict()
+        sensors = {}
+        for name in SENSORS:
+            if name in columns and not pd.isna(row[name]):
+                value = row[name]
+                sensors[name] = [int(value) if name in ('gear', 'racePos') else value]
+        for name, size in ARRAYS.items():
+            cols = [f'{ARRAY_PREFIX[name]}_{i}' for i in range(size)]
+            if all(c in columns for c in cols) and not pd.isna(row[cols[0]]):
+                sensors[name] = [row[c] for c in cols]
+        messages.append(parser.stringify(sensors))
+    return messages
+
+
+class ReplayServer(object):
+    '''
+    Stand-in for a TORCS server that plays recorded sensor messages.
+
+    It speaks the same UDP protocol as the real server: it answers the
+    client's init with ***identified***, sends one sensor message per tick
+    and waits for the reply, then ends with ***shutdown***. The car does
+    not respond to the controls, so this exercises clients, sinks and
+    orchestration rather than driving quality.
+    '''
+
+    def __init__(self, port, messages, host='localhost', episodes=1, timeout=5.0):
+        '''Constructor'''
+        self.port = port
+        self.messages = messages
+        self.episodes = episodes
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.sock.settimeout(timeout)
+        self.replies = 0
+
+    def _identify(self):
+        while True:
+            data, addr = self.sock.recvfrom(1000)
+            if b'(init' in data:
+                self.sock.sendto(b'***identified***', addr)
+                return addr
+
+    def serve(self):
+        try:
+            for episode in range(self.episodes):
+                addr = self._identify()
+                for msg in self.messages:
+                    self.sock.sendto(msg.encode(), addr)
+                    try:
+                        self.sock.recvfrom(1000)
+                        self.replies += 1
+                    except socket.timeout:
+                        pass
+                last = episode == self.episodes - 1
+                self.sock.sendto(b'***shutdown***' if last else b'***restart***', addr)
+        except socket.timeout:
+            print("Replay server: client went away")
+        finally:
+            self.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a sensor log as a stand-in TORCS server.')
+    parser.add_argument('log', help='sensor_log_*.csv file or .tlz archive to replay')
+    parser.add_argument('--port', type=int, default=3001, help='UDP port (default: 3001)')
+    parser.add_argument('--episodes', type=int, default=1, help='Number of episodes (default: 1)')
+    parser.add_argument('--logEpisode', type=int, default=None, help='Replay only this episode of an archive')
+    parser.add_argument('--logLap', type=int, default=None, help='Replay only this lap of an archive')
+    arguments = parser.parse_args()
+
+    messages = log_messages(arguments.log, arguments.logEpisode, arguments.logLap)
+    server = ReplayServer(arguments.port, messages, episodes=arguments.episodes)
+    server.serve()
+    print(f"Replay complete, {server.replies} replies received")
+
+
+if __name__ == "__main__":
+    main()
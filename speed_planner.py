@@ -0,0 +1,140 @@
+import math
+import numpy as np
+import track_geometry
+
+KMH = 3.6
+
+
+class SpeedPlanner(object):
+    '''
+    Target speed from corner geometry and braking distance.
+
+    Two limits are combined each tick. The range finders give the arc to
+    the end of the free space ahead; the car must be able to drive that arc
+    and to brake from the target speed down to a safe speed at its end.
+    When a track map is available, a full-lap profile is built with a
+    backward (braking) and forward (traction) pass over its curvature bins
+    and cached until the map changes, so the per-tick cost is one array
+    index.
+    '''
+
+    def __init__(self, max_speed=300.0, lateral_accel=9.0, brake_decel=8.0, drive_accel=5.0, min_speed=40.0):
+        '''Constructor, speeds in km/h and accelerations in m/s^2'''
+        self.max_speed = max_speed
+        self.lateral_accel = lateral_accel
+        self.brake_decel = brake_decel
+        self.drive_accel = drive_accel
+        self.min_speed = min_speed
+
+        self.profile = None
+        self.profile_map = None
+        self.profile_version = None
+
+    def corner_speed(self, curvature):
+        '''Highest speed (km/h) through a bend of the given curvature (1/m)'''
+        k = np.maximum(np.abs(curvature), 1e-6)
+        return np.minimum(np.sqrt(self.lateral_accel / k) * KMH, self.max_speed)
+
+    def end_speed(self, edges):
+        '''
+        Speed (km/h) to plan for at the end of the visible free space.
+
+        Approaching a bend the longest ray runs into the outside wall almost
+        straight ahead, so the arc curvature reads near zero there. A ray
+        that ends short of the sensor range means the track turns or stops
+        beyond what can be seen, so plan to be slow enough for any corner.
+        '''
+        if edges.free_dist < track_geometry.MAX_RANGE:
+            return self.min_speed
+        return max(float(self.corner_speed(edges.curvature)), self.min_speed)
+
+    def braking_speed(self, end_speed, distance):
+        '''Highest speed (km/h) that can still brake to end_speed within distance (m)'''
+        v = end_speed / KMH
+        return math.sqrt(v * v + 2.0 * self.brake_decel * max(distance, 0.0)) * KMH
+
+    def build_profile(self, curvature, bin_size):
+        '''Forward-backward pass over a lap of curvature bins'''
+        limit = self.corner_speed(curvature) / KMH
+        n = len(limit)
+        v = limit.copy()
+        brake = 2.0 * self.brake_decel * bin_size
+        drive = 2.0 * self.drive_accel * bin_size
+        # Two sweeps each way so the limits propagate across the start line
+        for _ in range(2):
+            for i in range(n - 1, -1, -1):
+                nxt = v[(i + 1) % n]
+                v[i] = min(v[i], math.sqrt(nxt * nxt + brake))
+        for _ in range(2):
+            for i in range(n):
+                prev = v[i - 1]
+                v[i] = min(v[i], math.sqrt(prev * prev + drive))
+        return np.maximum(v * KMH, self.min_speed)
+
+    def _profile_for(self, track_map):
+        if track_map.version != self.profile_version or track_map is not self.profile_map:
+            visited = np.flatnonzero(track_map.samples)
+            if len(visited) == 0:
+                self.profile = None
+            else:
+                n = int(visited[-1]) + 1
+                self.profile = self.build_profile(track_map.curvature[:n], track_map.bin_size)
+            self.profile_map = track_map
+            self.profile_version = track_map.version
+        return self.profile
+
+    def target(self, state, edges=None, track_map=None):
+        '''Target speed (km/h) for the current tick'''
+        target = self.max_speed
+
+        if edges is not None:
+            # The arc to the free space point is driven now, its end braked for
+            target = min(target, float(self.corner_speed(edges.curvature)),
+                         self.braking_speed(self.end_speed(edges), edges.free_dist))
+
+        # The map profile only applies once a full lap has been seen
+        if track_map is not None and track_map.best_lap_time < np.inf and state.distFromStart is not None:
+            profile = self._profile_for(track_map)
+            if profile is not None:
+                i = int(state.distFromStart / track_map.bin_size)
+                if 0 <= i < len(profile):
+                    target = min(target, profile[i])
+
+        return max(target, self.min_speed)
+
+
+class SpeedController(object):
+    '''
+    Feed-forward plus PID controller driving accel and brake together.
+
+    The output is a single pedal command in [-1, 1]; positive values are
+    throttle and negative values brake, so the two are never applied at the
+    same time.
+    '''
+
+    def __init__(self, kp=0.1, ki=0.01, kd=0.02, feed_forward=0.002, integral_limit=20.0):
+        '''Constructor'''
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.feed_forward = feed_forward
+        self.integral_limit = integral_limit
+        self.integral = 0.0
+        self.prev_error = None
+
+    def reset(self):
+        self.integral = 0.0
+        self.prev_error = None
+
+    def update(self, target, speed):
+        '''Return (accel, brake) for the target and current speed in km/h'''
+        error = target - speed
+        self.integral = max(-self.integral_limit, min(self.integral_limit, self.integral + error))
+        derivative = 0.0 if self.prev_error is None else error - self.prev_error
+        self.prev_error = error
+
+        # Holding speed needs throttle roughly proportional to it
+        pedal = self.feed_forward * target + self.kp * error + self.ki * self.integral + self.kd * derivative
+        if pedal >= 0:
+            return min(pedal, 1.0), 0.0
+        return 0.0, min(-pedal, 1.0)
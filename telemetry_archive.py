@@ -0,0 +1,387 @@
+'''
+Compressed, seekable archive format for sensor logs.
+
+Rows are stored in chunks of at most chunk_rows ticks that never span two
+laps, and each column of a chunk is encoded and compressed on its own:
+
+    int columns        delta from the previous row
+    float columns      bit pattern XOR the previous row's (lossless)
+    timestamp          nanoseconds since the epoch, delta encoded
+    anything else      newline-joined text
+
+The encoded words are byte-transposed before zlib, so the long runs of
+zero high bytes that slowly changing columns produce compress well. A
+compressed JSON footer indexes every chunk by episode, lap, row and time
+range with the byte range of each column, so reading one lap or a few
+columns touches only those blobs. Episodes start where distRaced drops
+and laps where lastLapTime changes, as the server reports them.
+
+    MAGIC | blobs ... | footer | footer offset (uint64) | MAGIC
+
+The writer also leaves a telemetry_schema sidecar, so columns, dtypes and
+statistics are known without opening the archive. read_table() and
+read_chunks() accept either an archive or a CSV.
+'''
+import argparse
+import json
+import os
+import struct
+import zlib
+
+import numpy as np
+import pandas as pd
+
+import telemetry_schema
+
+MAGIC = b'TLZ1'
+SUFFIX = '.tlz'
+TRAILER = struct.Struct('<Q4s')
+MISSING = '\x00'
+DTYPES = {'int': 'int64', 'float': 'float64', 'time': 'object', 'str': 'object'}
+
+
+def _shuffle(words):
+    return np.ascontiguousarray(words.view(np.uint8).reshape(-1, 8).T).tobytes()
+
+
+def _unshuffle(data, n):
+    return np.frombuffer(data, dtype=np.uint8).reshape(8, n).T.copy().view(np.uint64).ravel()
+
+
+def _kind(name, values):
+    if pd.api.types.is_bool_dtype(values) or pd.api.types.is_integer_dtype(values):
+        return 'int'
+    if pd.api.types.is_float_dtype(values):
+        return 'float'
+    if name == 'timestamp':
+        try:
+            pd.to_datetime(values, format='ISO8601')
+            return 'time'
+        except (ValueError, TypeError):
+            pass
+    return 'str'
+
+
+def encode(values, kind, level=6):
+    '''Compressed blob for one column of one chunk'''
+    if kind == 'int':
+        words = np.diff(np.asarray(values, dtype=np.int64), prepend=np.int64(0))
+    elif kind == 'time':
+        stamps = pd.to_datetime(values, format='ISO8601').to_numpy(dtype='datetime64[ns]').view(np.int64)
+        words = np.diff(stamps, prepend=np.int64(0))
+    elif kind == 'float':
+        bits = np.ascontiguousarray(values, dtype=np.float64).view(np.uint64)
+        words = bits ^ np.concatenate((np.zeros(1, dtype=np.uint64), bits[:-1]))
+    else:
+        text = '\n'.join(MISSING if pd.isna(v) else str(v) for v in values)
+        return zlib.compress(text.encode(), level)
+    return zlib.compress(_shuffle(words), level)
+
+
+def decode(data, kind, n):
+    '''Column values from a blob made by encode()'''
+    raw = zlib.decompress(data)
+    if kind == 'str':
+        return np.array([None if v == MISSING else v for v in raw.decode().split('\n')], dtype=object)
+    words = _unshuffle(raw, n)
+    if kind == 'float':
+        return np.bitwise_xor.accumulate(words).view(np.float64)
+    values = np.cumsum(words.view(np.int64))
+    if kind == 'time':
+        return np.datetime_as_string(values.view('datetime64[ns]'), unit='us').astype(object)
+    return values
+
+
+def update_stats(stats, kinds, name, kind, values):
+    '''Fold one chunk of a column into its running kind and min/max/nulls'''
+    column = stats.setdefault(name, {'min': None, 'max': None, 'nulls': 0})
+    column['nulls'] += int(values.isna().sum())
+    previous = kinds.get(name, kind)
+    kinds[name] = 'float' if {previous, kind} == {'int', 'float'} else previous
+    if kind in ('int', 'float') and values.notna().any():
+        lo, hi = values.min(), values.max()
+        lo, hi = (int(lo), int(hi)) if kind == 'int' else (float(lo), float(hi))
+        column['min'] = lo if column['min'] is None else min(column['min'], lo)
+        column['max'] = hi if column['max'] is None else max(column['max'], hi)
+
+
+def dtypes(columns, kinds, stats, rows):
+    return {name: DTYPES[kinds.get(name, 'str')] if stats[name]['nulls'] < rows else 'empty' for name in columns}
+
+
+class ArchiveWriter(object):
+    '''
+    Appends DataFrames of sensor log rows to a new archive.
+
+    Episode and lap numbers carry over between append() calls, so a log
+    can be converted in pieces without loading it whole. close() writes
+    the index and the schema sidecar.
+    '''
+
+    def __init__(self, path, chunk_rows=4096, level=6):
+        '''Constructor'''
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.level = level
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.columns = None
+        self.chunks = []
+        self.rows = 0
+        self.stats = {}
+        self.kinds = {}
+
+        self.episode = 0
+        self.lap = 0
+        self.last_dist = None
+        self.last_lap_time = None
+
+    def _label(self, frame):
+        '''Episode and lap number for each row'''
+        n = len(frame)
+        restart = np.zeros(n, dtype=bool)
+        changed = np.zeros(n, dtype=bool)
+        if 'distRaced' in frame.columns:
+            dist = frame['distRaced'].to_numpy(dtype=float)
+            previous = np.concatenate(([np.nan if self.last_dist is None else self.last_dist], dist[:-1]))
+            restart = dist < previous
+            self.last_dist = dist[-1]
+        if 'lastLapTime' in frame.columns:
+            lap_time = frame['lastLapTime'].to_numpy(dtype=float)
+            previous = np.concatenate(([lap_time[0] if self.last_lap_time is None else self.last_lap_time], lap_time[:-1]))
+            changed = (lap_time != previous) & (lap_time > 0)
+            self.last_lap_time = lap_time[-1]
+
+        episode = self.episode + np.cumsum(restart)
+        count = np.cumsum(changed)
+        since = np.maximum.accumulate(np.where(restart, np.arange(n), -1))
+        lap = np.where(since >= 0, count - count[np.maximum(since, 0)], self.lap + count)
+        self.episode, self.lap = int(episode[-1]), int(lap[-1])
+        return episode, lap
+
+    def append(self, frame):
+        if len(frame) == 0:
+            return
+        if self.columns is None:
+            self.columns = list(frame.columns)
+        elif list(frame.columns) != self.columns:
+            raise ValueError("All appended frames must have the same columns")
+        episode, lap = self._label(frame)
+        cuts = np.flatnonzero((np.diff(episode) != 0) | (np.diff(lap) != 0)) + 1
+        for start, stop in zip(np.concatenate(([0], cuts)), np.concatenate((cuts, [len(frame)]))):
+            for row in range(start, stop, self.chunk_rows):
+                end = min(row + self.chunk_rows, stop)
+                self._write_chunk(frame.iloc[row:end], int(episode[row]), int(lap[row]))
+
+    def _write_chunk(self, frame, episode, lap):
+        entry = {'episode': episode, 'lap': lap, 'row': self.rows, 'rows': len(frame), 't0': None, 't1': None,
+                 'columns': {}}
+        for name in self.columns:
+            values = frame[name]
+            kind = _kind(name, values)
+            blob = encode(values.to_numpy(), kind, self.level)
+            entry['columns'][name] = [self.file.tell(), len(blob), kind]
+            self.file.write(blob)
+            update_stats(self.stats, self.kinds, name, kind, values)
+            if kind == 'time':
+                stamps = pd.to_datetime(values, format='ISO8601')
+                entry['t0'], entry['t1'] = stamps.iloc[0].isoformat(), stamps.iloc[-1].isoformat()
+        self.chunks.append(entry)
+        self.rows += len(frame)
+
+    def close(self):
+        if self.file.closed:
+            return
+        footer = zlib.compress(json.dumps({'columns': self.columns or [], 'rows': self.rows,
+                                           'chunks': self.chunks}).encode())
+        offset = self.file.tell()
+        self.file.write(footer)
+        self.file.write(TRAILER.pack(offset, MAGIC))
+        self.file.close()
+        columns = self.columns or []
+        telemetry_schema.write_sidecar(self.path, columns, self.rows, dtypes(columns, self.kinds, self.stats, self.rows),
+                                       self.stats)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ArchiveReader(object):
+    '''Random access to an archive by episode, lap, time range and column'''
+
+    def __init__(self, path):
+        '''Constructor, reads only the trailer and the index'''
+        self.path = path
+        self.file = open(path, 'rb')
+        if self.file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"Not a telemetry archive: {path}")
+        self.file.seek(-TRAILER.size, os.SEEK_END)
+        end = self.file.tell()
+        offset, magic = TRAILER.unpack(self.file.read(TRAILER.size))
+        if magic != MAGIC:
+            raise ValueError(f"Truncated telemetry archive: {path}")
+        self.file.seek(offset)
+        index = json.loads(zlib.decompress(self.file.read(end - offset)))
+        self.columns = index['columns']
+        self.rows = index['rows']
+        self.chunks = index['chunks']
+
+    def schema(self, stats=True):
+        '''
+        The metadata the writer's sidecar holds: columns, and unless stats
+        is False rows, dtypes and min/max/nulls, which need every blob read.
+        '''
+        if not stats:
+            return {'columns': self.columns}
+        column_stats = {name: {'min': None, 'max': None, 'nulls': 0} for name in self.columns}
+        kinds = {}
+        for entry in self.chunks:
+            frame = self.read_chunk(entry)
+            for name in self.columns:
+                update_stats(column_stats, kinds, name, entry['columns'][name][2], frame[name])
+        return {'columns': self.columns, 'rows': self.rows,
+                'dtypes': dtypes(self.columns, kinds, column_stats, self.rows), 'stats': column_stats}
+
+    def episodes(self):
+        return sorted({c['episode'] for c in self.chunks})
+
+    def laps(self, episode=None):
+        '''(episode, lap) pairs present, optionally for one episode'''
+        return sorted({(c['episode'], c['lap']) for c in self.chunks if episode is None or c['episode'] == episode})
+
+    def select(self, episode=None, lap=None, start=None, end=None):
+        '''Index entries of the chunks that can hold matching rows'''
+        start = pd.Timestamp(start) if start is not None else None
+        end = pd.Timestamp(end) if end is not None else None
+        chosen = []
+        for c in self.chunks:
+            if episode is not None and c['episode'] != episode:
+                continue
+            if lap is not None and c['lap'] != lap:
+                continue
+            if c['t0'] is not None:
+                if start is not None and pd.Timestamp(c['t1']) < start:
+                    continue
+                if end is not None and pd.Timestamp(c['t0']) > end:
+                    continue
+            chosen.append(c)
+        return chosen
+
+    def read_chunk(self, entry, columns=None):
+        data = {}
+        for name in columns or self.columns:
+            offset, length, kind = entry['columns'][name]
+            self.file.seek(offset)
+            data[name] = decode(self.file.read(length), kind, entry['rows'])
+        return pd.DataFrame(data, index=pd.RangeIndex(entry['row'], entry['row'] + entry['rows']))
+
+    def iter_chunks(self, columns=None, episode=None, lap=None, start=None, end=None):
+        for entry in self.select(episode, lap, start, end):
+            frame = self.read_chunk(entry, columns)
+            if (start is not None or end is not None) and entry['t0'] is not None:
+                frame = self._clip(entry, frame, start, end)
+            yield frame
+
+    def _clip(self, entry, frame, start, end):
+        stamps = pd.to_datetime(self.read_chunk(entry, ['timestamp'])['timestamp'], format='ISO8601')
+        keep = np.ones(len(frame), dtype=bool)
+        if start is not None:
+            keep &= (stamps >= pd.Timestamp(start)).to_numpy()
+        if end is not None:
+            keep &= (stamps <= pd.Timestamp(end)).to_numpy()
+        return frame[keep]
+
+    def read(self, columns=None, episode=None, lap=None, start=None, end=None):
+        '''Matching rows as one DataFrame, columns in file order'''
+        if columns is not None:
+            columns = [c for c in self.columns if c in set(columns)]
+        frames = list(self.iter_chunks(columns, episode, lap, start, end))
+        if not frames:
+            return pd.DataFrame({c: [] for c in columns or self.columns})
+        return pd.concat(frames)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def is_archive(path):
+    return str(path).endswith(SUFFIX)
+
+
+def pack(csv_path, out_path=None, chunk_rows=4096, level=6):
+    '''Convert a sensor log CSV to an archive, streaming it in pieces'''
+    out_path = out_path or os.path.splitext(csv_path)[0] + SUFFIX
+    with ArchiveWriter(out_path, chunk_rows, level) as writer:
+        for frame in pd.read_csv(csv_path, chunksize=64 * chunk_rows):
+            writer.append(frame)
+    return out_path
+
+
+def read_table(path, usecols=None, **select):
+    '''pd.read_csv for either format; select (episode, lap, start, end) needs an archive'''
+    select = {k: v for k, v in select.items() if v is not None}
+    if is_archive(path):
+        with ArchiveReader(path) as reader:
+            return reader.read(usecols, **select).reset_index(drop=True)
+    if select:
+        raise ValueError("Selecting by episode, lap or time needs a telemetry archive")
+    return pd.read_csv(path, usecols=usecols)
+
+
+def read_chunks(path, usecols=None, chunk_size=8192):
+    '''Iterate over DataFrame pieces of either format; archives yield their own chunks'''
+    if is_archive(path):
+        with ArchiveReader(path) as reader:
+            yield from reader.iter_chunks(usecols and [c for c in reader.columns if c in set(usecols)])
+    else:
+        yield from pd.read_csv(path, usecols=usecols, chunksize=chunk_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pack sensor logs into compressed archives and read them back.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    packing = commands.add_parser('pack', help='Convert sensor log CSVs to archives')
+    packing.add_argument('logs', nargs='+', help='Sensor log CSVs')
+    packing.add_argument('--chunkRows', type=int, default=4096, help='Maximum rows per chunk')
+    packing.add_argument('--level', type=int, default=6, help='zlib compression level')
+    info = commands.add_parser('info', help='Show the episodes, laps and size of an archive')
+    info.add_argument('archive')
+    unpack = commands.add_parser('unpack', help='Write (part of) an archive back out as CSV')
+    unpack.add_argument('archive')
+    unpack.add_argument('out', help='CSV to write')
+    unpack.add_argument('--episode', type=int, default=None)
+    unpack.add_argument('--lap', type=int, default=None)
+    unpack.add_argument('--columns', nargs='+', default=None)
+    arguments = parser.parse_args()
+
+    if arguments.command == 'pack':
+        for log in arguments.logs:
+            out = pack(log, chunk_rows=arguments.chunkRows, level=arguments.level)
+            before, after = os.path.getsize(log), os.path.getsize(out)
+            print(f"{log} -> {out}: {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB ({before / max(after, 1):.1f}x)")
+    elif arguments.command == 'info':
+        with ArchiveReader(arguments.archive) as reader:
+            print(f"{reader.rows} rows, {len(reader.columns)} columns, {len(reader.chunks)} chunks")
+            for episode, lap in reader.laps():
+                chunks = reader.select(episode, lap)
+                rows = sum(c['rows'] for c in chunks)
+                print(f"  episode {episode} lap {lap}: {rows} rows, {chunks[0]['t0']} .. {chunks[-1]['t1']}")
+    else:
+        frame = read_table(arguments.archive, arguments.columns, episode=arguments.episode, lap=arguments.lap)
+        frame.to_csv(arguments.out, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+'''
+Live telemetry over a shared-memory ring buffer.
+
+One writer publishes fixed-width rows of float64 into a ring of slots;
+any number of readers in other processes attach by name and read them
+without the writer ever waiting on or even knowing about them.
+
+    header (HEADER_BYTES)  magic, slots, width, published, writer pid,
+                           JSON column names
+    slot i                 sequence word, then width float64 values
+
+Every slot is guarded by a sequence lock. Before writing row n the writer
+sets the slot's sequence to 2n+1 (odd: being written), and afterwards to
+2n+2, then bumps published to n+1. A reader copies a slot between two
+reads of its sequence and keeps the copy only if both equal 2n+2, so a row
+torn by a writer that has lapped the reader is dropped and counted, never
+returned.
+
+Rings are named per client port (ring_name), so parallel clients each get
+their own. A writer refuses a name whose previous writer is still running
+and only replaces the segment of one that died without cleaning up.
+'''
+import argparse
+import json
+import os
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+DEFAULT_NAME = 'torcs_telemetry'
+MAGIC = 0x31524c54  # 'TLR1'
+HEADER_BYTES = 4096
+HEADER_WORDS = 5
+MAGIC_WORD, SLOTS_WORD, WIDTH_WORD, PUBLISHED_WORD, PID_WORD = range(HEADER_WORDS)
+
+
+def ring_name(port):
+    '''Ring name of the client on port'''
+    return f'{DEFAULT_NAME}_{port}'
+
+
+def _writer_pid(shm):
+    header = np.ndarray((HEADER_WORDS,), dtype=np.uint64, buffer=shm.buf)
+    pid = int(header[PID_WORD]) if header[MAGIC_WORD] == MAGIC else 0
+    del header
+    return pid
+
+
+def _attach(name):
+    '''Open an existing segment without registering it for cleanup at exit'''
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name)
+        # A writer in this process holds the one registration there is
+        if _writer_pid(shm) != os.getpid():
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def _owner(shm):
+    '''pid of the writer that created the segment, or None if it is gone'''
+    pid = _writer_pid(shm)
+    if os.name == 'nt':
+        # Windows frees a segment with its last handle, so one that exists is held
+        return pid or -1
+    if pid <= 0:
+        return None
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return None
+    except PermissionError:
+        pass
+    return pid
+
+
+def _views(buf, slots, width):
+    header = np.ndarray((HEADER_WORDS,), dtype=np.uint64, buffer=buf)
+    stride = (width + 1) * 8
+    seq = np.ndarray((slots,), dtype=np.uint64, buffer=buf, offset=HEADER_BYTES, strides=(stride,))
+    data = np.ndarray((slots, width), dtype=np.float64, buffer=buf, offset=HEADER_BYTES + 8, strides=(stride, 8))
+    return header, seq, data
+
+
+class RingWriter(object):
+    '''
+    Single writer of a named ring. A ring of the same name left by a dead
+    writer is replaced; one whose writer is alive raises FileExistsError.
+    '''
+
+    def __init__(self, name=DEFAULT_NAME, columns=(), slots=4096):
+        '''Constructor'''
+        self.name = name
+        self.columns = list(columns)
+        self.slots = slots
+        width = len(self.columns)
+        names = json.dumps(self.columns).encode()
+        if HEADER_WORDS * 8 + len(names) > HEADER_BYTES:
+            raise ValueError("Too many column names for the ring header")
+        size = HEADER_BYTES + slots * (width + 1) * 8
+        try:
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            stale = _attach(name)
+            owner = _owner(stale)
+            stale.close()
+            if owner is not None:
+                raise FileExistsError(f"Telemetry ring {name} is in use by process {owner}")
+            dead = shared_memory.SharedMemory(name)
+            dead.close()
+            dead.unlink()
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        self.header, self.seq, self.data = _views(self.shm.buf, slots, width)
+        self.seq[:] = 0
+        self.shm.buf[HEADER_WORDS * 8:HEADER_WORDS * 8 + len(names)] = names
+        self.header[SLOTS_WORD] = slots
+        self.header[WIDTH_WORD] = width
+        self.header[PUBLISHED_WORD] = 0
+        self.header[PID_WORD] = os.getpid()
+        self.header[MAGIC_WORD] = MAGIC
+        self.published = 0
+
+    def publish(self, values):
+        '''Write one row; None values become NaN'''
+        n = self.published
+        i = n % self.slots
+        self.seq[i] = 2 * n + 1
+        self.data[i] = values
+        self.seq[i] = 2 * n + 2
+        self.published = n + 1
+        self.header[PUBLISHED_WORD] = n + 1
+
+    def close(self):
+        if self.shm is None:
+            return
+        del self.header, self.seq, self.data
+        self.shm.close()
+        self.shm.unlink()
+        self.shm = None
+
+
+class RingReader(object):
+    '''
+    Attaches to a ring by name. poll() returns every row published since
+    the last call that was not overwritten in the meantime; latest() only
+    the newest one. Rows the reader was too slow for are counted in lost.
+    '''
+
+    def __init__(self, name=DEFAULT_NAME):
+        '''Constructor'''
+        self.name = name
+        # Readers must not unlink the writer's segment when they exit
+        self.shm = _attach(name)
+        header = np.ndarray((HEADER_WORDS,), dtype=np.uint64, buffer=self.shm.buf)
+        if header[MAGIC_WORD] != MAGIC:
+            raise ValueError(f"Not a telemetry ring: {name}")
+        self.slots, width = int(header[SLOTS_WORD]), int(header[WIDTH_WORD])
+        raw = bytes(self.shm.buf[HEADER_WORDS * 8:HEADER_BYTES]).rstrip(b'\x00')
+        self.columns = json.loads(raw)
+        self.index = {name: i for i, name in enumerate(self.columns)}
+        self.header, self.seq, self.data = _views(self.shm.buf, self.slots, width)
+        self.next = int(self.header[PUBLISHED_WORD])
+        self.lost = 0
+
+    @property
+    def published(self):
+        return int(self.header[PUBLISHED_WORD])
+
+    def _read(self, first, last):
+        numbers = np.arange(first, last, dtype=np.uint64)
+        slots = numbers % np.uint64(self.slots)
+        before = self.seq[slots]
+        rows = self.data[slots]
+        after = self.seq[slots]
+        expected = 2 * numbers + 2
+        valid = (before == expected) & (after == expected)
+        return numbers[valid], rows[valid]
+
+    def poll(self):
+        '''(sequence numbers, rows) published since the last poll'''
+        last = self.published
+        first = max(self.next, last - self.slots)
+        numbers, rows = self._read(first, last)
+        self.lost += (first - self.next) + (last - first - len(numbers))
+        self.next = last
+        return numbers, rows
+
+    def latest(self):
+        '''(sequence number, row) of the newest row, or None before the first'''
+        last = self.published
+        if last == 0:
+            return None
+        numbers, rows = self._read(last - 1, last)
+        if not len(numbers):
+            return None
+        return int(numbers[0]), rows[0]
+
+    def close(self):
+        if self.shm is None:
+            return
+        del self.header, self.seq, self.data
+        self.shm.close()
+        self.shm = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Print live telemetry from a running driver.')
+    parser.add_argument('--port', type=int, default=3001, help='Port of the client to follow (default: 3001)')
+    parser.add_argument('--name', default=None, help='Ring name, instead of the one for --port')
+    parser.add_argument('--columns', nargs='+', default=['speedX', 'rpm', 'gear', 'trackPos', 'steer'],
+                        help='Columns to show')
+    parser.add_argument('--rate', type=float, default=5.0, help='Lines per second')
+    arguments = parser.parse_args()
+
+    reader = RingReader(arguments.name or ring_name(arguments.port))
+    picks = [reader.index[c] for c in arguments.columns]
+    print(' '.join(f'{c:>10}' for c in ['tick'] + arguments.columns))
+    try:
+        while True:
+            time.sleep(1.0 / arguments.rate)
+            numbers, rows = reader.poll()
+            if len(rows):
+                print(f'{numbers[-1]:>10} ' + ' '.join(f'{v:10.3f}' for v in rows[-1, picks]) +
+                      (f'  ({reader.lost} lost)' if reader.lost else ''))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.close()
+
+
+if __name__ == "__main__":
+    main()
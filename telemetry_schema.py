@@ -0,0 +1,190 @@
+import csv
+import json
+import os
+import threading
+
+SIDECAR_SUFFIX = '.schema.json'
+
+
+class TelemetrySchema(object):
+    '''
+    Schema and summary statistics for telemetry files, without loading the data.
+
+    Column names come from the CSV header line only. Dtypes, row counts and
+    min/max statistics need one streaming pass over the file, which is done
+    the first time they are asked for and then cached in a sidecar file
+    (<file>.schema.json) keyed by the file's mtime and size. Telemetry
+    archives (.tlz) come with a sidecar from their writer; one copied without
+    it, or whose sidecar no longer matches, is described from the archive's
+    own index, and its statistics from one pass over its blobs.
+    '''
+
+    def __init__(self):
+        '''Constructor'''
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _key(self, path):
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+
+    def _sidecar(self, path):
+        return path + SIDECAR_SUFFIX
+
+    def _load_sidecar(self, path, key):
+        try:
+            with open(self._sidecar(path)) as file:
+                meta = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if (meta.get('mtime_ns'), meta.get('size')) != key:
+            return None
+        return meta
+
+    def _save_sidecar(self, path, meta):
+        tmp = self._sidecar(path) + '.tmp'
+        try:
+            with open(tmp, 'w') as file:
+                json.dump(meta, file)
+            os.replace(tmp, self._sidecar(path))
+        except OSError:
+            # Read-only data directories still get the in-memory cache
+            pass
+
+    def _read_header(self, path):
+        with open(path, newline='') as file:
+            return next(csv.reader(file), [])
+
+    def _read_archive(self, path, stats=True):
+        import telemetry_archive  # It imports this module to write sidecars
+        with telemetry_archive.ArchiveReader(path) as reader:
+            return reader.schema(stats)
+
+    def _scan(self, path, columns):
+        '''Single streaming pass computing dtypes, row count and min/max'''
+        n = len(columns)
+        kinds = ['int'] * n
+        mins = [None] * n
+        maxs = [None] * n
+        nulls = [0] * n
+        rows = 0
+        with open(path, newline='') as file:
+            reader = csv.reader(file)
+            next(reader, None)
+            for row in reader:
+                rows += 1
+                for i in range(min(n, len(row))):
+                    cell = row[i]
+                    if cell == '' or cell == 'None':
+                        nulls[i] += 1
+                        continue
+                    kind = kinds[i]
+                    if kind == 'str':
+                        continue
+                    try:
+                        value = int(cell) if kind == 'int' else float(cell)
+                    except ValueError:
+                        try:
+                            value = float(cell)
+                            kinds[i] = 'float'
+                        except ValueError:
+                            kinds[i] = 'str'
+                            mins[i] = maxs[i] = None
+                            continue
+                    if mins[i] is None or value < mins[i]:
+                        mins[i] = value
+                    if maxs[i] is None or value > maxs[i]:
+                        maxs[i] = value
+        dtypes = {}
+        stats = {}
+        for i, name in enumerate(columns):
+            if nulls[i] == rows and rows > 0:
+                dtypes[name] = 'empty'
+            else:
+                dtypes[name] = {'int': 'int64', 'float': 'float64', 'str': 'object'}[kinds[i]]
+            stats[name] = {'min': mins[i], 'max': maxs[i], 'nulls': nulls[i]}
+        return {'rows': rows, 'dtypes': dtypes, 'stats': stats}
+
+    def describe(self, path, stats=True):
+        '''
+        Return the metadata dict for path: columns, and unless stats is
+        False also rows, dtypes and per-column min/max/nulls.
+        '''
+        path = os.path.abspath(path)
+        key = self._key(path)
+        with self._lock:
+            meta = self._cache.get(path)
+            if meta is not None and (meta['mtime_ns'], meta['size']) == key:
+                if not stats or 'rows' in meta:
+                    return meta
+
+        archive = path.endswith('.tlz')
+        meta = self._load_sidecar(path, key)
+        if meta is None:
+            if archive:
+                columns = self._read_archive(path, stats=False)['columns']
+            elif path.endswith('.csv'):
+                columns = self._read_header(path)
+            else:
+                raise ValueError(f"No schema sidecar for binary telemetry file: {path}")
+            meta = {'mtime_ns': key[0], 'size': key[1], 'columns': columns}
+        if stats and 'rows' not in meta:
+            meta.update(self._read_archive(path) if archive else self._scan(path, meta['columns']))
+            self._save_sidecar(path, meta)
+
+        with self._lock:
+            self._cache[path] = meta
+        return meta
+
+    def write_sidecar(self, path, columns, rows=None, dtypes=None, stats=None):
+        '''Record metadata for a binary file whose writer already knows it'''
+        path = os.path.abspath(path)
+        key = self._key(path)
+        meta = {'mtime_ns': key[0], 'size': key[1], 'columns': list(columns)}
+        if rows is not None:
+            meta['rows'] = rows
+            meta['dtypes'] = dtypes or {}
+            meta['stats'] = stats or {}
+        self._save_sidecar(path, meta)
+        with self._lock:
+            self._cache[path] = meta
+        return meta
+
+    def columns(self, path):
+        return self.describe(path, stats=False)['columns']
+
+    def dtypes(self, path):
+        return self.describe(path)['dtypes']
+
+    def row_count(self, path):
+        return self.describe(path)['rows']
+
+    def column_stats(self, path, column):
+        return self.describe(path)['stats'][column]
+
+
+_default = TelemetrySchema()
+
+
+def describe(path, stats=True):
+    return _default.describe(path, stats)
+
+
+def columns(path):
+    return _default.columns(path)
+
+
+def dtypes(path):
+    return _default.dtypes(path)
+
+
+def row_count(path):
+    return _default.row_count(path)
+
+
+def column_stats(path, column):
+    return _default.column_stats(path, column)
+
+
+def write_sidecar(path, columns, rows=None, dtypes=None, stats=None):
+    return _default.write_sidecar(path, columns, rows, dtypes, stats)
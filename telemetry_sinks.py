@@ -0,0 +1,200 @@
+import csv
+import json
+import os
+import time
+from datetime import datetime
+
+import focus_scheduler
+import opponents
+import telemetry_ring
+
+SENSOR_COLUMNS = [
+    'timestamp',
+    'angle',
+    'curLapTime',
+    'damage',
+    'distFromStart',
+    'distRaced',
+    'fuel',
+    'gear',
+    'lastLapTime',
+    'racePos',
+    'rpm',
+    'speedX',
+    'speedY',
+    'speedZ',
+    'trackPos',
+    'z',
+    # Array-type sensors will be flattened
+    *[f'focus_{i}' for i in range(5)],
+    *[f'opponent_{i}' for i in range(36)],
+    *[f'track_{i}' for i in range(19)],
+    *[f'wheelSpinVel_{i}' for i in range(4)],
+    # Free space from the range finders, refined by the focus readings
+    *focus_scheduler.FEATURE_NAMES,
+    # Nearest opponent and the gaps beside the car
+    *opponents.FEATURE_NAMES,
+    # Control outputs
+    'accel',
+    'brake',
+    'clutch',
+    'steer',
+    # Inputs
+    'inputs'
+]
+
+
+def sensor_values(state, control, edges=None):
+    '''The sensor and control values of a log row, without timestamp and inputs'''
+    focus = state.focus if state.focus is not None else [None]*5
+    sectors = state.opponents if state.opponents is not None else [None]*36
+    track = state.track if state.track is not None else [None]*19
+    wheelSpinVel = state.wheelSpinVel if state.wheelSpinVel is not None else [None]*4
+
+    return [
+        state.angle,
+        state.curLapTime,
+        state.damage,
+        state.distFromStart,
+        state.distRaced,
+        state.fuel,
+        state.gear,
+        state.lastLapTime,
+        state.racePos,
+        state.rpm,
+        state.speedX,
+        state.speedY,
+        state.speedZ,
+        state.trackPos,
+        state.z,
+        *focus,
+        *sectors,
+        *track,
+        *wheelSpinVel,
+        *focus_scheduler.features(edges),
+        *opponents.tick_features(state.opponents),
+        control.getAccel(),
+        control.getBrake(),
+        control.getClutch(),
+        control.getSteer(),
+    ]
+
+
+def sensor_row(state, control, inputs, edges=None):
+    '''Flatten one tick of CarState and CarControl into a log row'''
+    # Convert current inputs to string representation
+    input_str = ','.join(sorted(inputs)) if inputs else 'None'
+    return [datetime.now().isoformat(), *sensor_values(state, control, edges), input_str]
+
+
+class CsvSink(object):
+    '''Writes every tick to a sensor_log CSV, keeping the file open'''
+
+    def __init__(self, path):
+        '''Constructor'''
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, mode='w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(SENSOR_COLUMNS)
+
+    def write(self, driver):
+        self.writer.writerow(sensor_row(driver.state, driver.control, driver.current_inputs, driver.edges))
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+class LapSink(object):
+    '''Collects lap times, damage and distance for a run summary'''
+
+    def __init__(self, path=None):
+        '''Constructor, path is where close() writes the summary as JSON'''
+        self.path = path
+        self.laps = []
+        self.ticks = 0
+        self.off_track_ticks = 0
+        self.damage = 0.0
+        self.dist_raced = 0.0
+        self.last_lap_seen = None
+
+    def write(self, driver):
+        state = driver.state
+        self.ticks += 1
+        if state.trackPos is not None and abs(state.trackPos) > 1.0:
+            self.off_track_ticks += 1
+        if state.damage is not None:
+            self.damage = state.damage
+        if state.distRaced is not None:
+            self.dist_raced = state.distRaced
+        last_lap = state.lastLapTime
+        if last_lap and last_lap != self.last_lap_seen:
+            self.laps.append(last_lap)
+        self.last_lap_seen = last_lap
+
+    def summary(self):
+        return {
+            'laps': list(self.laps),
+            'best_lap': min(self.laps) if self.laps else None,
+            'ticks': self.ticks,
+            'off_track_ticks': self.off_track_ticks,
+            'damage': self.damage,
+            'dist_raced': self.dist_raced,
+        }
+
+    def close(self):
+        if self.path is not None:
+            with open(self.path, 'w') as file:
+                json.dump(self.summary(), file)
+
+
+# Wall-clock time and the commanded gear and meta replace the log's text columns
+RING_COLUMNS = ['time', *SENSOR_COLUMNS[1:-1], 'gearCmd', 'meta']
+
+
+class RingSink(object):
+    '''
+    Publishes every tick to a shared-memory ring that live readers
+    (dashboards, recorders, anomaly detectors) attach to by name; see
+    telemetry_ring. Publishing is a few stores into shared memory, and
+    readers never hold up the drive loop.
+    '''
+
+    def __init__(self, name=telemetry_ring.DEFAULT_NAME, slots=4096):
+        '''Constructor'''
+        self.ring = telemetry_ring.RingWriter(name, RING_COLUMNS, slots)
+
+    def write(self, driver):
+        control = driver.control
+        self.ring.publish([time.time(), *sensor_values(driver.state, control, driver.edges), control.getGear(),
+                          control.getMeta()])
+
+    def close(self):
+        self.ring.close()
+
+
+def log_path(logdir, control_mode, prefix='sensor_log', ext='csv'):
+    '''Timestamped sensor_log file name, tagged human or ai'''
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    kind = 'human' if control_mode in ['kb', 'controller', 'replay'] else 'ai'
+    return os.path.join(logdir, f"{prefix}_{timestamp}_{kind}.{ext}")
+
+
+SINKS = {
+    'csv': lambda logdir, control_mode, ring_name: CsvSink(log_path(logdir, control_mode)),
+    'laps': lambda logdir, control_mode, ring_name: LapSink(log_path(logdir, control_mode, 'laps', 'json')),
+    'ring': lambda logdir, control_mode, ring_name: RingSink(ring_name),
+}
+
+
+def make_sinks(names, logdir, control_mode, ring_name=telemetry_ring.DEFAULT_NAME):
+    '''Build the named sinks; an empty list means logging is off'''
+    sinks = []
+    for name in names or []:
+        if name not in SINKS:
+            raise ValueError(f"Telemetry sink must be one of {list(SINKS)}")
+        sinks.append(SINKS[name](logdir, control_mode, ring_name))
+    return sinks
@@ -0,0 +1,92 @@
+import numpy as np
+
+# Range finders return -1 when the car is outside the track
+MAX_RANGE = 200.0
+
+FEATURE_NAMES = ['edgeCurvature', 'freeSpaceAngle', 'freeSpaceDist', 'trackWidth']
+
+
+class TrackEdges(object):
+    '''
+    Geometry derived from one tick of track range finder readings.
+
+    Edge points are in the car frame, x forward and y to the left (the same
+    side as a positive trackPos). Angles are in radians with the range finder
+    convention: sensors sweep clockwise, so negative angles point left.
+    '''
+
+    def __init__(self, points, curvature, free_angle, free_dist, width):
+        self.points = points
+        self.curvature = curvature
+        self.free_angle = free_angle
+        self.free_dist = free_dist
+        self.width = width
+
+    def features(self):
+        return np.array([self.curvature, self.free_angle, self.free_dist, self.width])
+
+
+class RangefinderGeometry(object):
+    '''
+    Precomputed sin/cos table for the configured range finder angles, with
+    a vectorised conversion of track readings into edge geometry.
+    '''
+
+    def __init__(self, angles):
+        '''Constructor, angles in degrees as sent in the init string'''
+        self.angles = np.radians(np.asarray(angles, dtype=float))
+        self.cos = np.cos(self.angles)
+        self.sin = np.sin(self.angles)
+        self.n = len(self.angles)
+        self.tiebreak = 1e-6 * np.abs(self.angles)
+        # Sensors closest to straight left and right, used for track width
+        self.left = int(np.argmin(self.angles))
+        self.right = int(np.argmax(self.angles))
+
+    def compute(self, track):
+        '''
+        Convert readings into edge points, curvature and free space.
+
+        track may hold one tick (n,) or many ticks (m, n); the result fields
+        then have the matching leading shape. Returns None for a single tick
+        taken off track, where the readings are meaningless.
+        '''
+        d = np.asarray(track, dtype=float)
+        single = d.ndim == 1
+        if single and (d.shape[0] != self.n or d[0] < 0):
+            return None
+        d = np.clip(d, 0.0, MAX_RANGE)
+
+        points = np.stack((d * self.cos, -d * self.sin), axis=-1)
+
+        # Ties (e.g. every ray saturated) resolve toward straight ahead
+        best = np.argmax(d - self.tiebreak, axis=-1)
+        free_dist = np.take_along_axis(d, best[..., None], axis=-1)[..., 0]
+        # Refine the free space direction with a distance weighted mean of
+        # the longest ray and its neighbours; angles are not evenly spaced
+        lo = np.clip(best - 1, 0, self.n - 1)
+        hi = np.clip(best + 1, 0, self.n - 1)
+        idx = np.stack((lo, best, hi), axis=-1)
+        w = np.take_along_axis(d, idx, axis=-1)
+        w = w * w
+        free_angle = (self.angles[idx] * w).sum(axis=-1) / np.maximum(w.sum(axis=-1), 1e-9)
+
+        # Arc through the car, tangent to its heading, ending at the free
+        # space point: k = 2 sin(theta) / d. Positive curves right.
+        curvature = 2.0 * np.sin(free_angle) / np.maximum(free_dist, 1.0)
+
+        width = d[..., self.left] * np.abs(self.sin[self.left]) + d[..., self.right] * np.abs(self.sin[self.right])
+
+        if single:
+            return TrackEdges(points, float(curvature), float(free_angle), float(free_dist), float(width))
+        return TrackEdges(points, curvature, free_angle, free_dist, width)
+
+    def features(self, track):
+        '''Feature matrix (m, 4) in FEATURE_NAMES order for a batch of readings'''
+        edges = self.compute(np.atleast_2d(track))
+        return np.stack((edges.curvature, edges.free_angle, edges.free_dist, edges.width), axis=-1)
+
+
+def default_angles():
+    '''The 19 range finder angles requested by Driver.init, in degrees'''
+    return np.concatenate((np.arange(-90, -15, 15), np.arange(-20, 25, 5), np.arange(30, 105, 15))).tolist()
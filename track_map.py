@@ -0,0 +1,153 @@
+import os
+import re
+import numpy as np
+
+MAP_DIR = 'track_maps'
+
+
+class TrackMap(object):
+    '''
+    Compact per-track map indexed by distFromStart.
+
+    Each bin holds the learned edge curvature and track width, and the speed
+    and trackPos driven through it on the fastest completed lap. The map is
+    saved per track name and reloaded at startup, so later races reuse it.
+    Lookups are a single array index; users that derive data from a whole
+    lap (the speed profile) cache it on version, bumped at lap end.
+    '''
+
+    def __init__(self, track_name, directory=MAP_DIR, bin_size=5.0):
+        '''Constructor'''
+        self.track_name = track_name
+        self.directory = directory
+        self.bin_size = bin_size
+
+        self.n_bins = 0
+        self.curvature = np.zeros(0)
+        self.width = np.zeros(0)
+        self.samples = np.zeros(0, dtype=np.int32)
+        self.best_speed = np.zeros(0)
+        self.best_line = np.zeros(0)
+        self.best_lap_time = np.inf
+        # Bumped whenever derived data changes, so users can cache on it
+        self.version = 0
+
+        self.lap_speed = np.zeros(0)
+        self.lap_line = np.zeros(0)
+        self.last_lap_seen = None
+
+    @property
+    def path(self):
+        name = re.sub(r'[^A-Za-z0-9_.-]', '_', str(self.track_name))
+        return os.path.join(self.directory, f"{name}.npz")
+
+    @classmethod
+    def load(cls, track_name, directory=MAP_DIR, **kwargs):
+        '''Return the saved map for track_name, or an empty one'''
+        track_map = cls(track_name, directory, **kwargs)
+        if os.path.exists(track_map.path):
+            try:
+                with np.load(track_map.path) as data:
+                    track_map.bin_size = float(data['bin_size'])
+                    track_map.curvature = data['curvature']
+                    track_map.width = data['width']
+                    track_map.samples = data['samples']
+                    track_map.best_speed = data['best_speed']
+                    track_map.best_line = data['best_line']
+                    track_map.best_lap_time = float(data['best_lap_time'])
+                track_map.n_bins = len(track_map.curvature)
+                track_map.lap_speed = np.full(track_map.n_bins, np.nan)
+                track_map.lap_line = np.full(track_map.n_bins, np.nan)
+                track_map.refresh()
+            except Exception as e:
+                print(f"Error loading track map: {e}")
+                return cls(track_name, directory, **kwargs)
+        return track_map
+
+    def save(self):
+        if self.n_bins == 0:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        # Write then rename, so parallel workers on one track never leave a
+        # half-written map behind
+        tmp = f"{self.path[:-4]}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp,
+            bin_size=self.bin_size,
+            curvature=self.curvature,
+            width=self.width,
+            samples=self.samples,
+            best_speed=self.best_speed,
+            best_line=self.best_line,
+            best_lap_time=self.best_lap_time
+        )
+        os.replace(tmp, self.path)
+
+    def _grow(self, n):
+        extra = n - self.n_bins
+        self.curvature = np.concatenate((self.curvature, np.zeros(extra)))
+        self.width = np.concatenate((self.width, np.zeros(extra)))
+        self.samples = np.concatenate((self.samples, np.zeros(extra, dtype=np.int32)))
+        self.best_speed = np.concatenate((self.best_speed, np.full(extra, np.nan)))
+        self.best_line = np.concatenate((self.best_line, np.full(extra, np.nan)))
+        self.lap_speed = np.concatenate((self.lap_speed, np.full(extra, np.nan)))
+        self.lap_line = np.concatenate((self.lap_line, np.full(extra, np.nan)))
+        self.n_bins = n
+
+    def index(self, dist_from_start):
+        i = int(dist_from_start / self.bin_size)
+        if i < 0 or i >= self.n_bins:
+            return None
+        return i
+
+    def update(self, state, edges):
+        '''Fold one tick of telemetry into the map'''
+        dist = state.distFromStart
+        if dist is None or dist < 0:
+            return
+        i = int(dist / self.bin_size)
+        if i >= self.n_bins:
+            # Grow in blocks so the first lap does not reallocate every bin
+            self._grow(i + 64)
+
+        if edges is not None:
+            # Running mean, capped so the map keeps adapting slowly
+            n = min(self.samples[i] + 1, 20)
+            self.curvature[i] += (edges.curvature - self.curvature[i]) / n
+            self.width[i] += (edges.width - self.width[i]) / n
+            self.samples[i] += 1
+
+        self.lap_speed[i] = state.speedX
+        self.lap_line[i] = state.trackPos
+
+        # lastLapTime changes exactly once per completed lap
+        last_lap = state.lastLapTime
+        if self.last_lap_seen is None:
+            self.last_lap_seen = last_lap
+        elif last_lap and last_lap != self.last_lap_seen:
+            self.last_lap_seen = last_lap
+            self.finish_lap(last_lap)
+
+    def finish_lap(self, lap_time):
+        '''Keep the speed and line of the fastest lap'''
+        if lap_time < self.best_lap_time:
+            self.best_lap_time = lap_time
+            driven = ~np.isnan(self.lap_speed)
+            self.best_speed[driven] = self.lap_speed[driven]
+            self.best_line[driven] = self.lap_line[driven]
+        self.lap_speed[:] = np.nan
+        self.lap_line[:] = np.nan
+        self.refresh()
+
+    def refresh(self):
+        '''Mark the map changed, so data cached on version is rebuilt'''
+        self.version += 1
+
+    def lookup(self, dist_from_start):
+        '''(curvature, width, best_speed, best_line) or None'''
+        if dist_from_start is None:
+            return None
+        i = self.index(dist_from_start)
+        if i is None or self.samples[i] == 0:
+            return None
+        return self.curvature[i], self.width[i], self.best_speed[i], self.best_line[i]
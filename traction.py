@@ -0,0 +1,88 @@
+import numpy as np
+
+# wheelSpinVel order sent by the server
+FRONT_RIGHT, FRONT_LEFT, REAR_RIGHT, REAR_LEFT = range(4)
+
+DRIVEN_WHEELS = {
+    'rwd': [REAR_RIGHT, REAR_LEFT],
+    'fwd': [FRONT_RIGHT, FRONT_LEFT],
+    '4wd': [FRONT_RIGHT, FRONT_LEFT, REAR_RIGHT, REAR_LEFT],
+}
+
+
+class TractionControl(object):
+    '''
+    Traction control and ABS applied to a decided accel/brake pair.
+
+    Wheel slip is (wheel surface speed - car speed) / car speed, from
+    wheelSpinVel (rad/s) times each wheel's radius. Throttle is cut when a
+    driven wheel spins faster than tc_slip_limit, and brake is released when
+    any wheel locks beyond abs_slip_limit. Below min_speed (m/s) slip is
+    meaningless and both are left alone, so the car can hold itself still
+    and pull away. Inputs may be a single tick or
+    arrays of ticks (wheel speeds shaped (n, 4)).
+    '''
+
+    def __init__(self, profile, min_speed=3.0):
+        '''Constructor'''
+        self.radius = np.asarray(profile['wheel_radius'], dtype=float)
+        driven = np.zeros(4, dtype=bool)
+        driven[DRIVEN_WHEELS[profile['drive']]] = True
+        # Undriven wheels never count as spinning under throttle
+        self.driven_radius = np.where(driven, self.radius, 0.0)
+        # Plain tuples for the per-tick path, where NumPy call overhead on
+        # four values would cost more than the arithmetic itself
+        self.wheels = tuple(enumerate(self.radius.tolist()))
+        self.driven = tuple((i, r) for i, r in self.wheels if driven[i])
+        self.tc_slip_limit = profile.get('tc_slip_limit', 0.15)
+        self.tc_gain = profile.get('tc_gain', 4.0)
+        self.abs_slip_limit = profile.get('abs_slip_limit', 0.15)
+        self.abs_gain = profile.get('abs_gain', 4.0)
+        self.min_speed = min_speed
+        self.tc_active = 0
+        self.abs_active = 0
+
+    def slip(self, speed_x, wheel_spin_vel):
+        '''Per-wheel slip ratio; speed_x in km/h'''
+        v = np.maximum(np.abs(np.asarray(speed_x, dtype=float)) / 3.6, self.min_speed)
+        w = np.asarray(wheel_spin_vel, dtype=float) * self.radius
+        return (w - v[..., None]) / v[..., None]
+
+    def apply(self, accel, brake, speed_x, wheel_spin_vel):
+        '''Return (accel, brake) after traction control and ABS'''
+        if wheel_spin_vel is None or speed_x is None:
+            return accel, brake
+        v = abs(speed_x) / 3.6
+        if v < self.min_speed:
+            return accel, brake
+        w = wheel_spin_vel
+
+        if accel > 0:
+            spin = (max([w[i] * r for i, r in self.driven]) - v) / v
+            if spin > self.tc_slip_limit:
+                accel *= max(0.0, 1.0 - self.tc_gain * (spin - self.tc_slip_limit))
+                self.tc_active += 1
+
+        if brake > 0:
+            lock = (min([w[i] * r for i, r in self.wheels]) - v) / v
+            if lock < -self.abs_slip_limit:
+                brake *= max(0.0, 1.0 + self.abs_gain * (lock + self.abs_slip_limit))
+                self.abs_active += 1
+
+        return accel, brake
+
+    def apply_batch(self, accel, brake, speed_x, wheel_spin_vel):
+        '''Vectorised apply over arrays of ticks, for replay and simulation'''
+        accel = np.asarray(accel, dtype=float)
+        brake = np.asarray(brake, dtype=float)
+        w = np.asarray(wheel_spin_vel, dtype=float)
+        v = np.abs(np.asarray(speed_x, dtype=float)) / 3.6
+        moving = v >= self.min_speed
+        v = np.maximum(v, self.min_speed)
+        spin = ((w * self.driven_radius).max(axis=-1) - v) / v
+        lock = ((w * self.radius).min(axis=-1) - v) / v
+        tc = np.clip(1.0 - self.tc_gain * (spin - self.tc_slip_limit), 0.0, 1.0)
+        abs_ = np.clip(1.0 + self.abs_gain * (lock + self.abs_slip_limit), 0.0, 1.0)
+        accel = np.where(moving & (accel > 0) & (spin > self.tc_slip_limit), accel * tc, accel)
+        brake = np.where(moving & (brake > 0) & (lock < -self.abs_slip_limit), brake * abs_, brake)
+        return accel, brake
@@ -1,3 +1,4 @@
+import argparse
 import pandas as pd
 import numpy as np
 from sklearn.model_selection import train_test_split
@@ -6,43 +7,65 @@ from sklearn.metrics import mean_squared_error, r2_score
 from sklearn.neural_network import MLPRegressor
 import os
 import joblib
+import augmentation
+import coreset
+import focus_scheduler
+import opponents
+import telemetry_archive
+import telemetry_schema
 from driver import Driver
 
-def load_and_preprocess_data():
-    # Create models directory if it doesn't exist
-    os.makedirs('models', exist_ok=True)
-    
-    # Load the dataset
-    print("Loading sensor data...")
-    data = pd.read_csv('sensor_data/sensor_data.csv')
-    
-    # Print available columns
-    print("\nAvailable columns in the dataset:")
-    print(data.columns.tolist())
-    
+DATA_PATH = 'sensor_data/sensor_data.csv'
+
+def select_columns(available):
     # Define features based on available columns
     features = []
     # Add track sensors
     for i in range(19):
-        if f'track_{i}' in data.columns:
+        if f'track_{i}' in available:
             features.append(f'track_{i}')
     
     # Add other features
     additional_features = ['trackPos', 'angle', 'speedX', 'speedY', 'speedZ', 'rpm', 'gear']
     for feature in additional_features:
-        if feature in data.columns:
+        if feature in available:
             features.append(feature)
     
+    # Refined free space and opponents, where the logs have them; NNDriver
+    # detects the extra inputs from the model's feature count
+    for names in (focus_scheduler.FEATURE_NAMES, opponents.FEATURE_NAMES):
+        if all(f in available for f in names):
+            features.extend(names)
+    
     print("\nUsing features:", features)
     
     # Define target variables
     target = ['accel', 'brake', 'steer', 'gear']
     
     # Verify target columns exist
-    missing_targets = [t for t in target if t not in data.columns]
+    missing_targets = [t for t in target if t not in available]
     if missing_targets:
         raise ValueError(f"Missing target columns: {missing_targets}")
     
+    return features, target
+
+def load_and_preprocess_data(coreset_options=None, data_path=DATA_PATH):
+    # Create models directory if it doesn't exist
+    os.makedirs('models', exist_ok=True)
+    
+    # Read only the header to decide which columns to load
+    available = telemetry_schema.columns(data_path)
+    
+    # Print available columns
+    print("\nAvailable columns in the dataset:")
+    print(available)
+    
+    features, target = select_columns(available)
+    
+    # Load the dataset, skipping the columns we do not use
+    print("Loading sensor data...")
+    data = telemetry_archive.read_table(data_path, usecols=list(dict.fromkeys(features + target)))
+    
     # Split features and target
     X = data[features]
     y = data[target]
@@ -58,7 +81,14 @@ def load_and_preprocess_data():
     # Save the scaler
     joblib.dump(scaler, 'models/nn_scaler.pkl')
     
-    return X_train_scaled, X_test_scaled, y_train, y_test
+    # Reduce the training split to a weighted coreset; the test split stays whole
+    weights = None
+    if coreset_options is not None:
+        keep, weights = coreset.select(X_train, y_train, **coreset_options)
+        print(f"Coreset: {len(keep)} of {len(X_train)} training rows")
+        X_train_scaled, y_train = X_train_scaled[keep], y_train.iloc[keep]
+    
+    return X_train_scaled, X_test_scaled, y_train, y_test, weights
 
 def create_model():
     model = MLPRegressor(
@@ -76,17 +106,68 @@ def create_model():
     )
     return model
 
-def train_model(X_train, y_train, X_test, y_test):
+def train_model(X_train, y_train, X_test, y_test, sample_weight=None):
     print("Training Neural Network model...")
     
     # Create model
     model = create_model()
     
     # Train model
-    model.fit(X_train, y_train)
+    model.fit(X_train, y_train, sample_weight=sample_weight)
     
     return model
 
+def _stream(data_path, usecols, chunk_size, holdout, seed):
+    '''Yield (is_test, chunk) per CSV chunk; the same rows are held out on every pass'''
+    for i, chunk in enumerate(telemetry_archive.read_chunks(data_path, usecols, chunk_size)):
+        yield np.random.default_rng([seed, i]).random(len(chunk)) < holdout, chunk
+
+def train_streaming(augment_options, epochs=10, chunk_size=8192, block_size=1024, holdout=0.2, seed=42,
+                    data_path=DATA_PATH):
+    '''
+    Train without loading the whole dataset, augmenting each block as it is used.
+    
+    The CSV is read in chunks: one pass fits the scaler and collects the
+    held-out rows, then every epoch streams the training rows again in
+    shuffled blocks through the Augmenter and partial_fit. Memory stays at
+    one chunk plus the test set, however many variants are drawn.
+    '''
+    os.makedirs('models', exist_ok=True)
+    features, target = select_columns(telemetry_schema.columns(data_path))
+    usecols = list(dict.fromkeys(features + target))
+    
+    print("Fitting scaler...")
+    scaler = StandardScaler()
+    test_chunks = []
+    for test, chunk in _stream(data_path, usecols, chunk_size, holdout, seed):
+        if not test.all():
+            scaler.partial_fit(chunk.loc[~test, features].to_numpy(dtype=float))
+        test_chunks.append(chunk[test])
+    test_data = pd.concat(test_chunks)
+    joblib.dump(scaler, 'models/nn_scaler.pkl')
+    
+    augment = augmentation.Augmenter(features, target, mean=scaler.mean_, scale=scaler.scale_, seed=seed,
+                                     **augment_options)
+    model = create_model()
+    # Early stopping needs a validation split that partial_fit never makes
+    model.set_params(early_stopping=False)
+    rng = np.random.default_rng(seed)
+    
+    print("Training Neural Network model (streaming)...")
+    for epoch in range(epochs):
+        for test, chunk in _stream(data_path, usecols, chunk_size, holdout, seed):
+            train = chunk[~test]
+            X = train[features].to_numpy(dtype=float)
+            y = train[target].to_numpy(dtype=float)
+            order = rng.permutation(len(train))
+            for start in range(0, len(order), block_size):
+                rows = order[start:start + block_size]
+                X_block, y_block = augment(X[rows], y[rows])
+                model.partial_fit(scaler.transform(X_block), y_block)
+        print(f"Epoch {epoch + 1}/{epochs}: loss {model.loss_:.5f}")
+    
+    return model, scaler.transform(test_data[features].to_numpy(dtype=float)), test_data[target]
+
 def evaluate_model(model, X_test, y_test):
     print("Evaluating model...")
     y_pred = model.predict(X_test)
@@ -214,11 +295,49 @@ class NNDriver(Driver):
         return f'(accel {acceleration:.3f}) (brake {braking:.3f}) (steer {steering:.3f}) (gear {gear})'
 
 def main():
+    parser = argparse.ArgumentParser(description='Train the NNDriver MLP on logged telemetry.')
+    parser.add_argument('--data', default=DATA_PATH, help='Training data, a sensor log CSV or .tlz archive')
+    parser.add_argument('--coreset', action='store_true', help='Train on a deduplicated, stratified coreset')
+    parser.add_argument('--resolution', type=float, default=0.05,
+                        help='Coreset grid cell size in standard deviations per column')
+    parser.add_argument('--fraction', type=float, default=1.0,
+                        help='Share of distinct cells to keep (1.0 only removes near-duplicates)')
+    parser.add_argument('--compare', action='store_true',
+                        help='Also train on the full set and report time against accuracy per target')
+    parser.add_argument('--stream', action='store_true',
+                        help='Stream the data in chunks and augment each block as it is trained on')
+    parser.add_argument('--epochs', type=int, default=10, help='Passes over the data when streaming')
+    parser.add_argument('--mirror', type=float, default=0.5, help='Probability a streamed row is mirrored')
+    parser.add_argument('--noise', type=float, default=0.02, help='Sensor noise in standard deviations')
+    parser.add_argument('--dropout', type=float, default=0.05, help='Probability a range finder reading is dropped')
+    arguments = parser.parse_args()
+    
+    if arguments.stream:
+        if arguments.coreset or arguments.compare:
+            parser.error('--stream cannot be combined with --coreset or --compare')
+        augment_options = {'mirror': arguments.mirror, 'noise': arguments.noise, 'dropout': arguments.dropout}
+        model, X_test, y_test = train_streaming(augment_options, arguments.epochs, data_path=arguments.data)
+        evaluate_model(model, X_test, y_test)
+        joblib.dump(model, 'models/nn_model.pkl')
+        print("\nTraining complete!")
+        return
+    
+    options = None
+    if arguments.coreset or arguments.compare:
+        options = {'resolution': arguments.resolution, 'fraction': arguments.fraction}
+    
+    if arguments.compare:
+        # The split is seeded, so both loads hold out the same test rows
+        X_train, X_test, y_train, y_test, _ = load_and_preprocess_data(data_path=arguments.data)
+        X_core, _, y_core, _, weights = load_and_preprocess_data(options, arguments.data)
+        coreset.compare(create_model, (X_train, y_train), (X_core, y_core, weights), X_test, y_test)
+        return
+    
     # Load and preprocess data
-    X_train, X_test, y_train, y_test = load_and_preprocess_data()
+    X_train, X_test, y_train, y_test, weights = load_and_preprocess_data(options, arguments.data)
     
     # Train model
-    model = train_model(X_train, y_train, X_test, y_test)
+    model = train_model(X_train, y_train, X_test, y_test, weights)
     
     # Evaluate model
     metrics = evaluate_model(model, X_test, y_test)